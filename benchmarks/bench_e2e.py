@@ -0,0 +1,111 @@
+"""End-to-end benchmarks against a local mock ESP32 fleet (no hardware needed).
+
+Measures:
+  * scan      - time to sweep a /24 that contains the mock devices
+  * upload    - single-device streaming upload throughput
+  * rollout   - fleet rollout wall time at several parallelism levels and
+                with the adaptive (canary + AIMD) scheduler
+
+Every device is an ota.mock.MockDevice. Use --bandwidth to give each one a
+Wi-Fi-like upload cap and --shared-bandwidth to model a single access
+point. History and caches go to a temporary OTA_DATA_DIR. Delta uploads are
+turned off, since every rollout re-flashes the image the devices already run.
+
+Usage:
+    python benchmarks/bench_e2e.py [--devices 16] [--image-mb 1] [--bandwidth 1M]
+                                   [--shared-bandwidth 4M] [--parallel 1 4 8]
+                                   [--only scan upload rollout] [--json]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OTA_DATA_DIR", tempfile.mkdtemp(prefix="ota-bench-"))
+
+from ota.device import http_stats  # noqa: E402
+from ota.mock import MockFleet  # noqa: E402
+from ota.rollout import adaptive_rollout  # noqa: E402
+from ota.scan import scan_network_for_devices  # noqa: E402
+from ota.shaping import parse_rate  # noqa: E402
+from ota.upload import format_rate, rollout_firmware, upload_to_device  # noqa: E402
+
+def make_image(size_mb):
+    path = os.path.join(os.environ["OTA_DATA_DIR"], f"bench_{size_mb}mb.bin")
+    with open(path, "wb") as f:
+        f.write(os.urandom(int(size_mb * 1024 * 1024)))
+    return path
+
+def bench_scan(fleet, port):
+    if not sys.platform.startswith("linux"):
+        return {'skipped': "per-address mock devices need Linux loopback"}
+    base = fleet.devices[0].host.rsplit(".", 1)[0]
+    hosts = [f"{base}.{i}" for i in range(1, 255)]
+    start = time.perf_counter()
+    devices = scan_network_for_devices(hosts=hosts, port=port)
+    elapsed = time.perf_counter() - start
+    return {'hosts': len(hosts), 'found': len(devices), 'seconds': round(elapsed, 3)}
+
+def bench_upload(fleet, image):
+    result = upload_to_device(fleet.addresses[0], image, verify=False, delta="off")
+    return {'status': result['status'], 'seconds': round(result['transfer_elapsed'], 3),
+            'throughput': format_rate(result['transfer_rate']),
+            'timings': {phase: round(seconds, 3) for phase, seconds in result['timings'].items()}}
+
+def bench_rollout(fleet, image, parallel_levels):
+    rows = []
+    for parallelism in parallel_levels:
+        summary = rollout_firmware(fleet.addresses, image, parallelism=parallelism, verify=False, delta="off")
+        rows.append({'parallel': parallelism, 'succeeded': summary['succeeded'], 'devices': len(fleet.devices),
+                     'seconds': round(summary['elapsed'], 3), 'aggregate': format_rate(summary['throughput'])})
+    summary = adaptive_rollout(fleet.addresses, image, max_parallelism=max(parallel_levels), verify=False,
+                               delta="off")
+    rows.append({'parallel': "aimd", 'succeeded': summary['succeeded'], 'devices': len(fleet.devices),
+                 'seconds': round(summary['elapsed'], 3), 'aggregate': format_rate(summary['throughput']),
+                 'concurrency': summary['concurrency']})
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, default=16)
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--image-mb", type=float, default=1.0)
+    parser.add_argument("--bandwidth", default="1M", help="per-device cap (bytes/s), 0 for none")
+    parser.add_argument("--shared-bandwidth", default="0", help="cap shared by the fleet (bytes/s)")
+    parser.add_argument("--latency", type=float, default=0.005, help="seconds added to every request")
+    parser.add_argument("--parallel", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--only", nargs="+", choices=["scan", "upload", "rollout"])
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    image = make_image(args.image_mb)
+    results = {}
+    with MockFleet(args.devices, port=args.port, latency=args.latency,
+                   bandwidth=parse_rate(args.bandwidth), shared_bandwidth=parse_rate(args.shared_bandwidth)) as fleet:
+        only = set(args.only or ["scan", "upload", "rollout"])
+        if "scan" in only:
+            results['scan'] = bench_scan(fleet, args.port)
+        if "upload" in only:
+            results['upload'] = bench_upload(fleet, image)
+        if "rollout" in only:
+            results['rollout'] = bench_rollout(fleet, image, args.parallel)
+    results['http'] = http_stats.snapshot()
+    results['http'].pop('per_host')
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    if 'scan' in results:
+        print(f"scan     {results['scan']}")
+    if 'upload' in results:
+        print(f"upload   {results['upload']}")
+    for row in results.get('rollout', []):
+        print(f"rollout  parallel={row['parallel']:<3} {row['succeeded']}/{row['devices']} ok "
+              f"in {row['seconds']:.2f}s ({row['aggregate']} aggregate)")
+    print(f"http     {http_stats.describe()}")
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,12 @@
 #include <WiFi.h>
 #include <WebServer.h>
+#include <ESPmDNS.h>
 #include <Update.h>
 #include <ArduinoJson.h>
+#include "esp_ota_ops.h"
+#include "esp_partition.h"
+#include "esp32/rom/miniz.h"
+#include "esp32/rom/crc.h"
 
 const char* ssid = "YOUR_WIFI";
 const char* password = "YOUR_PASSWORD";
@@ -10,6 +15,358 @@ const char* DEVICE_NAME = "ESP32_OTA";
 
 WebServer server(80);
 
+bool imageWrite(const uint8_t* data, size_t len);
+
+// gzip-compressed OTA (POST /update?encoding=gzip): the stream is inflated
+// with the ROM tinfl decoder into a 32 KB ring buffer, which doubles as the
+// LZ77 dictionary, and every decoded block goes straight to imageWrite.
+struct GzipStream {
+  tinfl_decompressor* inflator = nullptr;
+  uint8_t* window = nullptr;
+  size_t windowOfs = 0;
+  bool headerDone = false;
+  bool done = false;
+};
+
+GzipStream gz;
+bool otaFailed = false;
+
+void gzipFree() {
+  free(gz.inflator);
+  free(gz.window);
+  gz = GzipStream();
+}
+
+bool gzipBegin() {
+  gzipFree();
+  gz.inflator = (tinfl_decompressor*)malloc(sizeof(tinfl_decompressor));
+  gz.window = (uint8_t*)malloc(TINFL_LZ_DICT_SIZE);
+  if (!gz.inflator || !gz.window) return false;
+  tinfl_init(gz.inflator);
+  return true;
+}
+
+// Length of the gzip member header at the start of data, or 0 if invalid or
+// not fully contained in this first upload buffer.
+size_t gzipHeaderLength(const uint8_t* data, size_t len) {
+  if (len < 10 || data[0] != 0x1f || data[1] != 0x8b || data[2] != 8) return 0;
+  uint8_t flags = data[3];
+  size_t pos = 10;
+  if (flags & 0x04) {  // FEXTRA
+    if (pos + 2 > len) return 0;
+    pos += 2 + (data[pos] | (data[pos + 1] << 8));
+  }
+  for (uint8_t bit : {0x08, 0x10}) {  // FNAME, FCOMMENT
+    if (!(flags & bit)) continue;
+    while (pos < len && data[pos]) pos++;
+    pos++;
+  }
+  if (flags & 0x02) pos += 2;  // FHCRC
+  return pos <= len ? pos : 0;
+}
+
+bool gzipWrite(const uint8_t* data, size_t len) {
+  if (!gz.headerDone) {
+    size_t header = gzipHeaderLength(data, len);
+    if (!header) return false;
+    data += header;
+    len -= header;
+    gz.headerDone = true;
+  }
+  if (gz.done) return true;  // CRC32/ISIZE trailer
+  for (;;) {
+    size_t inBytes = len;
+    size_t outBytes = TINFL_LZ_DICT_SIZE - gz.windowOfs;
+    tinfl_status status = tinfl_decompress(gz.inflator, data, &inBytes, gz.window, gz.window + gz.windowOfs,
+                                           &outBytes, TINFL_FLAG_HAS_MORE_INPUT);
+    data += inBytes;
+    len -= inBytes;
+    if (outBytes && !imageWrite(gz.window + gz.windowOfs, outBytes)) return false;
+    gz.windowOfs = (gz.windowOfs + outBytes) & (TINFL_LZ_DICT_SIZE - 1);
+    if (status == TINFL_STATUS_DONE) {
+      gz.done = true;
+      return true;
+    }
+    if (status < 0) return false;
+    if (status == TINFL_STATUS_NEEDS_MORE_INPUT && len == 0) return true;
+  }
+}
+
+// Delta OTA (encoding=delta, or delta-gzip for a gzipped delta): the new image
+// is rebuilt from the running partition. After a 48-byte header ("OTAD",
+// version, base size and MD5, target size and MD5) come ops: COPY (0x01,
+// offset, length; bytes read from the running partition), INSERT (0x02,
+// length, literal bytes) and END (0x00), integers little-endian. A delta for
+// another base image is refused, and Update.setMD5 makes Update.end reject
+// a result that is not the target image.
+const size_t DELTA_HEADER_SIZE = 48;
+const uint8_t DELTA_VERSION = 1;
+const uint8_t DELTA_END = 0x00;
+const uint8_t DELTA_COPY = 0x01;
+const uint8_t DELTA_INSERT = 0x02;
+
+struct DeltaStream {
+  bool active = false;
+  bool done = false;
+  const esp_partition_t* base = nullptr;
+  uint32_t baseSize = 0;
+  uint8_t header[DELTA_HEADER_SIZE];
+  size_t headerLen = 0;
+  uint8_t op[9];
+  size_t opLen = 0;
+  uint32_t insertLeft = 0;
+};
+
+DeltaStream delta;
+uint8_t deltaBuf[1024];
+
+uint32_t readU32(const uint8_t* p) {
+  return p[0] | (p[1] << 8) | (p[2] << 16) | ((uint32_t)p[3] << 24);
+}
+
+String md5Hex(const uint8_t* digest) {
+  char hex[33];
+  for (int i = 0; i < 16; i++) sprintf(hex + i * 2, "%02x", digest[i]);
+  return String(hex);
+}
+
+void deltaFree() {
+  delta = DeltaStream();
+}
+
+bool deltaBegin() {
+  deltaFree();
+  delta.base = esp_ota_get_running_partition();
+  delta.active = delta.base != nullptr;
+  return delta.active;
+}
+
+bool deltaCheckHeader() {
+  const uint8_t* h = delta.header;
+  if (memcmp(h, "OTAD", 4) != 0 || h[4] != DELTA_VERSION) return false;
+  delta.baseSize = readU32(h + 8);
+  if (delta.baseSize != ESP.getSketchSize() || md5Hex(h + 12) != ESP.getSketchMD5()) {
+    Serial.println("Delta base does not match the running image");
+    return false;
+  }
+  return Update.setMD5(md5Hex(h + 32).c_str());
+}
+
+bool deltaCopy(uint32_t offset, uint32_t length) {
+  if (offset > delta.baseSize || length > delta.baseSize - offset) return false;
+  while (length) {
+    size_t n = min((size_t)length, sizeof(deltaBuf));
+    if (esp_partition_read(delta.base, offset, deltaBuf, n) != ESP_OK) return false;
+    if (Update.write(deltaBuf, n) != n) return false;
+    offset += n;
+    length -= n;
+  }
+  return true;
+}
+
+bool deltaWrite(const uint8_t* data, size_t len) {
+  while (len) {
+    if (delta.headerLen < DELTA_HEADER_SIZE) {
+      size_t n = min(len, DELTA_HEADER_SIZE - delta.headerLen);
+      memcpy(delta.header + delta.headerLen, data, n);
+      delta.headerLen += n;
+      data += n;
+      len -= n;
+      if (delta.headerLen == DELTA_HEADER_SIZE && !deltaCheckHeader()) return false;
+      continue;
+    }
+    if (delta.done) return false;  // bytes after END
+    if (delta.insertLeft) {
+      size_t n = min((size_t)delta.insertLeft, len);
+      if (Update.write((uint8_t*)data, n) != n) return false;
+      delta.insertLeft -= n;
+      data += n;
+      len -= n;
+      continue;
+    }
+    delta.op[delta.opLen++] = *data++;
+    len--;
+    uint8_t op = delta.op[0];
+    size_t need = op == DELTA_COPY ? 9 : op == DELTA_INSERT ? 5 : op == DELTA_END ? 1 : 0;
+    if (!need) return false;
+    if (delta.opLen < need) continue;
+    delta.opLen = 0;
+    if (op == DELTA_END) delta.done = true;
+    else if (op == DELTA_INSERT) delta.insertLeft = readU32(delta.op + 1);
+    else if (!deltaCopy(readU32(delta.op + 1), readU32(delta.op + 5))) return false;
+  }
+  return true;
+}
+
+// Every decoded image byte goes through here on its way to flash.
+bool imageWrite(const uint8_t* data, size_t len) {
+  if (delta.active) return deltaWrite(data, len);
+  return Update.write((uint8_t*)data, len) == len;
+}
+
+// Set up the decoders for an upload's encoding (gzip, delta or delta-gzip).
+bool beginDecoders(const String& encoding) {
+  deltaFree();
+  gzipFree();
+  if (encoding.startsWith("delta") && !deltaBegin()) return false;
+  if (encoding.endsWith("gzip") && !gzipBegin()) return false;
+  return true;
+}
+
+bool decodersComplete() {
+  return (!gz.inflator || gz.done) && (!delta.active || delta.done);
+}
+
+void freeDecoders() {
+  gzipFree();
+  deltaFree();
+}
+
+bool decodeWrite(const uint8_t* data, size_t len) {
+  return gz.inflator ? gzipWrite(data, len) : imageWrite(data, len);
+}
+
+// Resumable chunked OTA: POST /update/chunk?session=..&offset=..&total=..&crc=..
+// carries one raw chunk (at most CHUNK_MAX bytes). A chunk is only
+// acknowledged after its CRC32 matched and it was written, and
+// GET /update/status reports the acknowledged offset so an interrupted
+// transfer can continue from there. offset=0 (re)starts a session.
+const size_t CHUNK_MAX = 32768;
+
+struct ChunkSession {
+  String id;
+  size_t offset = 0;
+  size_t total = 0;
+  bool active = false;
+};
+
+ChunkSession chunkSession;
+uint8_t* chunkBuf = nullptr;
+size_t chunkLen = 0;
+bool chunkOverflow = false;
+
+void sendChunkState(int code) {
+  JsonDocument doc;
+  doc["session"] = chunkSession.id;
+  doc["offset"] = chunkSession.offset;
+  doc["total"] = chunkSession.total;
+  String json;
+  serializeJson(doc, json);
+  server.send(code, "application/json", json);
+}
+
+void endChunkSession() {
+  if (chunkSession.active) Update.abort();
+  freeDecoders();
+  chunkSession = ChunkSession();
+}
+
+void handleChunkBody() {
+  HTTPRaw& raw = server.raw();
+  if (raw.status == RAW_START) {
+    chunkLen = 0;
+    chunkOverflow = false;
+    if (!chunkBuf) chunkBuf = (uint8_t*)malloc(CHUNK_MAX);
+  }
+  else if (raw.status == RAW_WRITE) {
+    if (!chunkBuf || chunkLen + raw.currentSize > CHUNK_MAX) {
+      chunkOverflow = true;
+      return;
+    }
+    memcpy(chunkBuf + chunkLen, raw.buf, raw.currentSize);
+    chunkLen += raw.currentSize;
+  }
+  else if (raw.status == RAW_ABORTED) {
+    chunkOverflow = true;
+  }
+}
+
+void handleChunk() {
+  String session = server.arg("session");
+  size_t offset = strtoul(server.arg("offset").c_str(), nullptr, 10);
+  size_t total = strtoul(server.arg("total").c_str(), nullptr, 10);
+  uint32_t crc = strtoul(server.arg("crc").c_str(), nullptr, 16);
+
+  if (chunkOverflow) {
+    server.send(413, "text/plain", "Chunk too large");
+    return;
+  }
+  if (offset == 0) {
+    endChunkSession();
+    String encoding = server.arg("encoding");
+    Serial.println(encoding.length() ? "OTA Start (chunked, " + encoding + ")" : "OTA Start (chunked)");
+    if (!Update.begin(encoding.length() ? UPDATE_SIZE_UNKNOWN : total)) {
+      server.send(413, "text/plain", "Firmware too large");
+      return;
+    }
+    chunkSession.active = true;
+    if (!beginDecoders(encoding)) {
+      endChunkSession();
+      server.send(500, "text/plain", "Update failed");
+      return;
+    }
+    chunkSession.id = session;
+    chunkSession.total = total;
+  }
+  if (!chunkSession.active || session != chunkSession.id || offset != chunkSession.offset) {
+    sendChunkState(409);
+    return;
+  }
+  if (crc32_le(0, chunkBuf, chunkLen) != crc) {
+    sendChunkState(422);
+    return;
+  }
+
+  bool written = decodeWrite(chunkBuf, chunkLen);
+  if (!written) {
+    int code = Update.hasError() ? 500 : 400;
+    endChunkSession();
+    server.send(code, "text/plain", code == 400 ? "Invalid firmware" : "Update failed");
+    return;
+  }
+  chunkSession.offset += chunkLen;
+  if (chunkSession.offset < chunkSession.total) {
+    sendChunkState(200);
+    return;
+  }
+
+  bool complete = decodersComplete();
+  freeDecoders();
+  chunkSession.active = false;
+  server.sendHeader("Connection", "close");
+  if (!complete || !Update.end(true)) {
+    Update.abort();
+    chunkSession = ChunkSession();
+    server.send(500, "text/plain", "Update failed");
+    return;
+  }
+  Serial.println("OTA Success");
+  server.send(200, "text/plain", "Update successful. Rebooting...");
+  delay(1000);
+  ESP.restart();
+}
+
+// Advertise _ota._tcp over mDNS so the uploader finds us without a subnet sweep.
+// The MAC suffix keeps host and instance names unique when boards share DEVICE_NAME.
+void startMdns() {
+  String mac = WiFi.macAddress();
+  mac.replace(":", "");
+  mac.toLowerCase();
+  String suffix = mac.substring(6);
+  String host = "esp32-ota-" + suffix;
+  if (!MDNS.begin(host.c_str())) {
+    Serial.println("mDNS failed");
+    return;
+  }
+  MDNS.setInstanceName(String(DEVICE_NAME) + "-" + suffix);
+  MDNS.addService("ota", "tcp", 80);
+  MDNS.addServiceTxt("ota", "tcp", "name", DEVICE_NAME);
+  MDNS.addServiceTxt("ota", "tcp", "version", FIRMWARE_VERSION);
+  MDNS.addServiceTxt("ota", "tcp", "caps", "gzip,chunked,delta");
+  MDNS.addService("http", "tcp", 80);
+  Serial.println("mDNS: " + host + ".local");
+}
+
 void setup() {
   Serial.begin(115200);
 
@@ -18,10 +375,15 @@ void setup() {
 
   Serial.println("Connected");
   Serial.println(WiFi.localIP());
+  startMdns();
 
   server.on("/update", HTTP_POST,
     []() {
       server.sendHeader("Connection", "close");
+      if (otaFailed || Update.hasError()) {
+        server.send(500, "text/plain", "Update failed");
+        return;
+      }
       server.send(200, "text/plain", "Update successful. Rebooting...");
       delay(1000);
       ESP.restart();
@@ -30,31 +392,55 @@ void setup() {
       HTTPUpload& upload = server.upload();
 
       if (upload.status == UPLOAD_FILE_START) {
-        Serial.println("OTA Start");
-        Update.begin(UPDATE_SIZE_UNKNOWN);
+        String encoding = server.arg("encoding");
+        Serial.println(encoding.length() ? "OTA Start (" + encoding + ")" : "OTA Start");
+        endChunkSession();
+        otaFailed = !Update.begin(UPDATE_SIZE_UNKNOWN) || !beginDecoders(encoding);
       } 
       else if (upload.status == UPLOAD_FILE_WRITE) {
-        Update.write(upload.buf, upload.currentSize);
+        if (otaFailed) return;
+        otaFailed = !decodeWrite(upload.buf, upload.currentSize);
       } 
       else if (upload.status == UPLOAD_FILE_END) {
-        if (Update.end(true)) {
+        if (!decodersComplete()) otaFailed = true;
+        freeDecoders();
+        if (!otaFailed && Update.end(true)) {
           Serial.println("OTA Success");
         } else {
+          otaFailed = true;
+          Update.abort();
           Serial.println("OTA Failed");
         }
       }
+      else if (upload.status == UPLOAD_FILE_ABORTED) {
+        freeDecoders();
+        Update.abort();
+        otaFailed = true;
+      }
     }
   );
 
+  server.on("/update/chunk", HTTP_POST, handleChunk, handleChunkBody);
+  server.on("/update/status", HTTP_GET, []() {
+    sendChunkState(200);
+  });
+
   // Device info endpoint
   server.on("/info", HTTP_GET, []() {
-    StaticJsonDocument<200> doc;
+    JsonDocument doc;
     doc["name"] = DEVICE_NAME;
     doc["version"] = FIRMWARE_VERSION;
     doc["ip"] = WiFi.localIP().toString();
     doc["mac"] = WiFi.macAddress();
     doc["uptime"] = millis() / 1000;
     doc["rssi"] = WiFi.RSSI();
+    JsonArray caps = doc["caps"].to<JsonArray>();
+    caps.add("gzip");
+    caps.add("chunked");
+    caps.add("delta");
+    doc["chunk_max"] = CHUNK_MAX;
+    doc["sketch_md5"] = ESP.getSketchMD5();
+    doc["sketch_size"] = ESP.getSketchSize();
     
     String json;
     serializeJson(doc, json);
@@ -1,18 +1,53 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk, scrolledtext
-import requests
-import json
 import os
+import queue
 import threading
-import socket
-import hashlib
-from datetime import datetime
+import time
+
+from ota.backup import export_config, import_config
+from ota.device import http_stats, refresh_device_version
+from ota.poller import DEFAULT_POLL_CONCURRENCY, DEFAULT_POLL_INTERVAL, DevicePoller
+from ota.history import HISTORY_MAX_ENTRIES, HISTORY_SORT_COLUMNS, compact_history, count_history, query_history
+from ota.scan import DEFAULT_SCAN_CONCURRENCY, DEFAULT_SCAN_PROBE_TIMEOUT, DEFAULT_SCAN_RATE
+from ota.mdns import MDNS_DISCOVERY_TIMEOUT, MdnsBrowser, discover_devices
+from ota.discovery import cached_devices, cached_scan, forget_devices, remember_devices
+from ota.storage import app_config, load_device_versions, load_ips, merge_ips, remove_ips, save_config
+from ota.upload import DEFAULT_ROLLOUT_PARALLELISM, UPLOAD_ERROR_MESSAGES, format_rate, rollout_firmware, upload_to_device
+from ota.profiling import hot_path
+from ota.rollout import adaptive_rollout, describe_rollout
+from ota.shaping import global_rate_limit
+from ota.verify import verify_update
 
 # ============= CONFIGURATION & CONSTANTS =============
-IPS_FILE = os.path.join(os.path.dirname(__file__), "ips.json")
-HISTORY_FILE = os.path.join(os.path.dirname(__file__), "upload_history.json")
-CONFIG_FILE = os.path.join(os.path.dirname(__file__), "app_config.json")
-VERSION_CACHE_FILE = os.path.join(os.path.dirname(__file__), "device_versions.json")
+# UI event queue: worker threads post events, the Tk loop drains them once per frame
+UI_FRAME_MS = 50
+_ui_events = queue.Queue()
+
+# Upload history browser: rows fetched per page as the list is scrolled, and rows kept in the
+# table; pages scrolled out of the window are dropped and fetched again when scrolled back to
+HISTORY_PAGE_SIZE = 200
+HISTORY_WINDOW_ROWS = 1000
+
+# Background /info poller for saved devices (started with the GUI)
+device_poller = None
+
+# Live mDNS registry of devices announcing _ota._tcp (started with the GUI)
+device_browser = None
+
+# Set while a network scan runs; setting the event cancels it
+scan_cancel = None
+
+# Main window and the widgets the handlers below update (created by main())
+root = None
+ip_tree = ip_entry = file_entry = details_text = None
+scan_btn = check_btn = upload_btn = progress_bar = None
+status_label = progress_label = None
+
+# Layout: outer padding, padding inside cards and spacing between widgets
+PADDING = 16
+INNER_PADDING = 12
+SPACING = 8
 
 # Color schemes
 THEMES = {
@@ -43,126 +78,59 @@ THEMES = {
 }
 
 # ============= UTILITY FUNCTIONS =============
-def load_config():
-    """Load app configuration."""
-    try:
-        if os.path.exists(CONFIG_FILE):
-            with open(CONFIG_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
-    except Exception:
-        pass
-    return {'theme': 'dark', 'verify_checksum': True}
-
-def save_config(config):
-    """Save app configuration."""
-    try:
-        with open(CONFIG_FILE, "w", encoding="utf-8") as f:
-            json.dump(config, f, indent=2)
-    except Exception:
-        pass
-
-def calculate_checksum(file_path):
-    """Calculate SHA256 checksum of a file."""
-    sha256 = hashlib.sha256()
-    with open(file_path, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            sha256.update(chunk)
-    return sha256.hexdigest()
-
-def load_device_versions():
-    """Load cached device versions."""
+def post_ui(key, fn, *args):
+    """Run ``fn(*args)`` on the Tk thread at the next frame; safe from any thread.
+
+    Events posted with the same non-None ``key`` within one frame coalesce,
+    so only the latest one runs. Use ``key=None`` for events that must all
+    run (button state changes, row inserts).
+    """
+    _ui_events.put((key, fn, args))
+
+def _drain_ui_events():
+    """Apply queued UI events (latest per key) and reschedule at UI_FRAME_MS."""
+    pending = {}
     try:
-        if os.path.exists(VERSION_CACHE_FILE):
-            with open(VERSION_CACHE_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
-    except Exception:
+        while True:
+            key, fn, args = _ui_events.get_nowait()
+            if key is None:
+                key = object()
+            else:
+                pending.pop(key, None)
+            pending[key] = (fn, args)
+    except queue.Empty:
         pass
-    return {}
-
-def save_device_versions(versions):
-    """Save device versions cache."""
-    try:
-        with open(VERSION_CACHE_FILE, "w", encoding="utf-8") as f:
-            json.dump(versions, f, indent=2)
-    except Exception:
-        pass
-
-def load_history():
-    """Load upload history."""
-    try:
-        if os.path.exists(HISTORY_FILE):
-            with open(HISTORY_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                if isinstance(data, list):
-                    return data
-    except Exception:
-        pass
-    return []
-
-def save_history(history):
-    """Save upload history."""
-    try:
-        with open(HISTORY_FILE, "w", encoding="utf-8") as f:
-            json.dump(history, f, indent=2)
-    except Exception:
-        pass
-
-def log_upload(ip, status, file_name, error=None, checksum=None):
-    """Log an upload attempt."""
-    history = load_history()
-    entry = {
-        'timestamp': datetime.now().isoformat(),
-        'ip': ip,
-        'status': status,
-        'file': file_name,
-        'checksum': checksum,
-        'error': error
-    }
-    history.append(entry)
-    save_history(history)
-
-def check_device_online(ip):
-    """Check if device is online via status endpoint."""
-    try:
-        r = requests.get(f"http://{ip}/status", timeout=3)
-        return r.status_code == 200
-    except Exception:
-        return False
-
-def get_device_info(ip):
-    """Get device info (version, name, etc.)."""
-    try:
-        r = requests.get(f"http://{ip}/info", timeout=5)
-        if r.status_code == 200:
-            return r.json()
-    except Exception:
-        pass
-    return None
-
-def scan_network_for_devices():
-    """Scan local network for ESP32 devices."""
-    devices = []
-    try:
-        local_ip = socket.gethostbyname(socket.gethostname())
-        base_ip = ".".join(local_ip.split(".")[:-1])
-        
-        for i in range(1, 255):
-            ip = f"{base_ip}.{i}"
-            if check_device_online(ip):
-                info = get_device_info(ip)
-                devices.append({'ip': ip, 'info': info})
-    except Exception:
-        pass
-    return devices
+    with hot_path("gui.events"):
+        for fn, args in pending.values():
+            try:
+                fn(*args)
+            except tk.TclError:
+                # The target widget was destroyed (e.g. its window was closed)
+                pass
+    root.after(UI_FRAME_MS, _drain_ui_events)
 
-def update_status(text, color, progress_text=""):
-    """Update status label with optional progress text."""
+def _apply_status(text, color, progress_text):
     status_label.config(text=text, fg=color)
     if progress_text:
         progress_label.config(text=progress_text, fg=COLORS['text_dim'])
     else:
         progress_label.config(text="")
-    root.update()
+
+def update_status(text, color, progress_text=""):
+    """Update status label with optional progress text (coalesced to the frame rate)."""
+    post_ui('status', _apply_status, text, color, progress_text)
+
+def _set_progress(sent, total):
+    if str(progress_bar.cget('mode')) != 'determinate':
+        progress_bar.stop()
+        progress_bar.config(mode='determinate', maximum=total)
+    progress_bar.config(value=sent)
+
+def _reset_upload_controls():
+    upload_btn.config(state=tk.NORMAL, text="🚀 Upload Firmware", bg=COLORS['highlight'])
+    progress_bar.stop()
+    progress_bar.config(mode='indeterminate', value=0)
+    progress_bar.pack_forget()
 
 # ============= UPLOAD & CORE FUNCTIONS =============
 def upload_firmware():
@@ -182,113 +150,169 @@ def upload_firmware():
     progress_bar.pack(pady=(5, 0))
     progress_bar.start(10)
     update_status("⏳ Uploading firmware...", COLORS['text'])
-    root.update()
 
     thread = threading.Thread(target=_upload_firmware_thread, args=(ip, file_path))
     thread.daemon = True
     thread.start()
 
 def _upload_firmware_thread(ip, file_path):
-    """Thread function for uploading firmware with enhanced error handling."""
-    url = f"http://{ip}/update"
+    """Thread function for uploading firmware; the upload itself runs in ota.upload."""
     file_name = os.path.basename(file_path)
-    checksum = None
-    start_time = datetime.now()
-    
+    verify_checksum = app_config.get('verify_checksum', True)
+
     try:
         # Get file size
         file_size = os.path.getsize(file_path)
         file_size_mb = file_size / (1024 * 1024)
         update_status(f"📦 Preparing upload: {file_name} ({file_size_mb:.2f} MB)", COLORS['text'])
-        
-        # Calculate checksum if enabled
-        if app_config.get('verify_checksum', True):
-            update_status("📊 Calculating checksum...", COLORS['text'], "This may take a moment...")
-            checksum = calculate_checksum(file_path)
-            update_status(f"📊 Checksum: {checksum[:16]}...", COLORS['text'])
-        
-        # Check device connectivity
-        update_status(f"🔍 Connecting to {ip}...", COLORS['text'], "Verifying device is online...")
-        if not check_device_online(ip):
-            raise ConnectionError(f"Device at {ip} is offline or unreachable. Please check the IP address and network connection.")
-        
-        update_status(f"📤 Uploading to {ip}...", COLORS['text'], f"Uploading {file_size_mb:.2f} MB...")
-        
-        # Upload firmware with error handling
-        with open(file_path, "rb") as f:
-            files = {"file": f}
-            try:
-                r = requests.post(url, files=files, timeout=120)
-            except requests.exceptions.Timeout:
-                raise TimeoutError(f"Upload timed out after 120 seconds. The firmware file may be too large or the connection is slow.")
-            except requests.exceptions.ConnectionError:
-                raise ConnectionError(f"Connection lost during upload. Device may have reset or network connection was interrupted.")
-            except requests.exceptions.RequestException as e:
-                raise Exception(f"Network error: {str(e)}")
-
-        # Calculate upload time and speed
-        elapsed_time = (datetime.now() - start_time).total_seconds()
-        upload_speed = file_size_mb / elapsed_time if elapsed_time > 0 else 0
-        
-        # Check response status
-        if r.status_code == 200:
+    except OSError:
+        # upload_to_device() reports and logs missing or unreadable files
+        pass
+
+    def on_state(ip, state, detail):
+        if state == "checking":
+            update_status(f"🔍 Connecting to {ip}{' and calculating checksum' if verify_checksum else ''}...",
+                          COLORS['text'], detail)
+
+    def on_progress(meter):
+        post_ui('progress', _set_progress, meter.sent, meter.total)
+        update_status(f"📤 Uploading to {ip}...", COLORS['text'], meter.describe())
+
+    result = None
+    try:
+        result = upload_to_device(ip, file_path, on_state=on_state, on_progress=on_progress,
+                                  compute_checksum=verify_checksum, verify=False)
+        error_msg, error_type = result['error'], result['error_type']
+        if result['status'] == "success":
             update_status(
                 f"✅ Upload successful! ESP32 rebooting...", 
                 COLORS['success'],
-                f"Uploaded {file_size_mb:.2f} MB in {elapsed_time:.1f}s ({upload_speed:.2f} MB/s)"
+                f"Uploaded {result['bytes'] / (1024 * 1024):.2f} MB in {result['transfer_elapsed']:.1f}s ({format_rate(result['transfer_rate'])})"
+                + (f" • {result['encoding']}: {result['wire_bytes'] / (1024 * 1024):.2f} MB sent" if result['encoding'] else "")
+                + f" • pre-flight {result['timings']['preflight']:.1f}s"
+                + (f"\nChecksum: {result['checksum'][:16]}..." if result['checksum'] else "")
             )
-            log_upload(ip, "success", file_name, checksum=checksum)
-        elif r.status_code == 400:
-            error_msg = "Invalid firmware file or corrupted upload"
-            update_status(f"❌ Upload failed: {error_msg}", COLORS['highlight'], f"HTTP {r.status_code}")
-            log_upload(ip, "failed", file_name, error=error_msg)
-        elif r.status_code == 413:
-            error_msg = "Firmware file too large for device"
-            update_status(f"❌ Upload failed: {error_msg}", COLORS['highlight'], f"HTTP {r.status_code}")
-            log_upload(ip, "failed", file_name, error=error_msg)
-        elif r.status_code == 500:
-            error_msg = "Device internal error during upload"
-            update_status(f"❌ Upload failed: {error_msg}", COLORS['highlight'], f"HTTP {r.status_code}")
-            log_upload(ip, "failed", file_name, error=error_msg)
+        elif error_type == "HTTPError":
+            detail = f"HTTP {result['http_status']}" if result['http_status'] in UPLOAD_ERROR_MESSAGES else f"Response: {result['response'] or 'No details'}"
+            update_status(f"❌ Upload failed: {error_msg}", COLORS['highlight'], detail)
+        elif error_type == "FileNotFoundError":
+            update_status(f"❌ Error: {error_msg}", COLORS['highlight'], "Please select a valid firmware file.")
+        elif error_type == "PermissionError":
+            update_status(f"❌ Error: {error_msg}", COLORS['highlight'], "Check file permissions.")
+        elif error_type == "ConnectionError":
+            update_status(f"❌ Connection Error", COLORS['highlight'], error_msg)
+        elif error_type == "TimeoutError":
+            update_status(f"❌ Timeout Error", COLORS['highlight'], error_msg)
         else:
-            error_msg = f"Unexpected response (HTTP {r.status_code})"
-            update_status(f"❌ Upload failed: {error_msg}", COLORS['highlight'], f"Response: {r.text[:50] if r.text else 'No details'}")
-            log_upload(ip, "failed", file_name, error=error_msg)
-
-    except FileNotFoundError as e:
-        error_msg = f"Firmware file not found: {file_name}"
-        update_status(f"❌ Error: {error_msg}", COLORS['highlight'], "Please select a valid firmware file.")
-        log_upload(ip, "failed", file_name, error=error_msg)
-    except ConnectionError as e:
-        update_status(f"❌ Connection Error", COLORS['highlight'], str(e))
-        log_upload(ip, "failed", file_name, error=str(e))
-    except TimeoutError as e:
-        update_status(f"❌ Timeout Error", COLORS['highlight'], str(e))
-        log_upload(ip, "failed", file_name, error=str(e))
-    except PermissionError as e:
-        error_msg = f"Permission denied: Cannot read {file_name}"
-        update_status(f"❌ Error: {error_msg}", COLORS['highlight'], "Check file permissions.")
-        log_upload(ip, "failed", file_name, error=error_msg)
-    except Exception as e:
-        error_msg = str(e)
-        update_status(f"❌ Unexpected Error", COLORS['highlight'], error_msg[:100])
-        log_upload(ip, "failed", file_name, error=error_msg)
+            update_status(f"❌ Unexpected Error", COLORS['highlight'], error_msg[:100])
 
     finally:
-        upload_btn.config(state=tk.NORMAL, text="🚀 Upload Firmware", bg=COLORS['highlight'])
-        progress_bar.stop()
-        progress_bar.pack_forget()
-        root.update()
+        post_ui(None, _reset_upload_controls)
+
+    # Reboot tracking runs after the controls are released, so another upload can start meanwhile
+    if result and result['status'] == "success" and app_config.get('verify_reboot', True):
+        _verify_reboot(result)
+
+def _verify_reboot(result):
+    """Wait for a flashed device to come back and report the version it booted into."""
+    ip = result['ip']
+
+    def on_state(ip, state, detail):
+        if state == "rebooting":
+            update_status(f"🔄 Waiting for {ip} to reboot...", COLORS['text'], detail)
+
+    reboot = verify_update(result, result['device_info'], on_state=on_state)
+    if reboot['status'] == "verified":
+        changed = f" (was v{reboot['previous_version']})" if reboot['version_changed'] else " (version unchanged)"
+        update_status(f"✅ {ip} back online running v{reboot['version']}", COLORS['success'],
+                      f"Rebooted in {reboot['time_to_online']:.1f}s{changed}")
+    elif reboot['status'] == "not_rebooted":
+        update_status(f"⚠️ {ip} did not reboot", COLORS['highlight'], f"Still running v{reboot['version']}")
+    else:
+        update_status(f"⚠️ {ip} did not come back online", COLORS['highlight'],
+                      "Check the device; the new firmware may have failed to boot.")
+    if device_poller:
+        device_poller.poll_now([ip])
+
+def _ip_row(ip, version, state):
+    """Treeview values and tags for one saved device."""
+    if state is not None:
+        version = state.get('version') or version
+        return (ip, version), ('online',) if state['online'] else ('offline',)
+    return (ip, version), ()
 
 def refresh_ip_tree():
-    """Refresh IP Treeview."""
+    """Refresh IP Treeview: saved devices, then discovered devices that are not saved yet."""
     ips = load_ips()
     for i in ip_tree.get_children():
         ip_tree.delete(i)
     versions = load_device_versions()
-    for ip in ips:
+    for ip in dict.fromkeys(ips):
         ver = versions.get(ip, {}).get('version', '')
-        ip_tree.insert('', 'end', values=(ip, ver))
+        values, tags = _ip_row(ip, ver, device_poller.get(ip) if device_poller else None)
+        ip_tree.insert('', 'end', iid=ip, values=values, tags=tags)
+    for device in cached_devices():
+        if not ip_tree.exists(device['ip']):
+            ip_tree.insert('', 'end', iid=device['ip'], values=(device['ip'], (device['info'] or {}).get('version', '')),
+                           tags=('discovered',))
+
+def _apply_poll_changes(changes):
+    """Update only the ip_tree rows (and details panel) whose device state changed."""
+    for ip, state in changes.items():
+        if not ip_tree.exists(ip):
+            continue
+        values, tags = _ip_row(ip, ip_tree.item(ip, 'values')[1], state)
+        if tuple(ip_tree.item(ip, 'values')) != values or tuple(ip_tree.item(ip, 'tags')) != tags:
+            ip_tree.item(ip, values=values, tags=tags)
+    selection = ip_tree.selection()
+    if selection and selection[0] in changes:
+        show_device_details(selection[0])
+
+def on_poll_changes(changes):
+    """DevicePoller callback (poller thread): hand the changes to the Tk thread."""
+    for ip, state in changes.items():
+        post_ui(('poll', ip), _apply_poll_changes, {ip: state})
+
+def on_mdns_changes(changes):
+    """MdnsBrowser callback (browser thread): cache announced devices and re-poll the saved ones."""
+    devices = [device for device in changes.values() if device]
+    remember_devices(devices, source="mdns")
+    saved = set(load_ips())
+    announced = [device['ip'] for device in devices if device['ip'] in saved]
+    if announced and device_poller:
+        device_poller.poll_now(announced)
+    if len(announced) < len(devices):
+        post_ui('ip_tree', refresh_ip_tree)
+
+def show_device_details(ip):
+    """Show the poller's latest view of a device in the details panel."""
+    state = device_poller.get(ip) if device_poller else None
+    cached = load_device_versions().get(ip, {})
+    lines = [f"📡 {ip}"]
+    if state is None:
+        lines.append("   Not polled yet")
+    else:
+        lines.append(f"   Status: {'🟢 online' if state['online'] else '🔴 offline'}")
+    name = (state or {}).get('name') or cached.get('name')
+    version = (state or {}).get('version') or cached.get('version')
+    if name:
+        lines.append(f"   Device: {name}")
+    if version:
+        lines.append(f"   Version: {version}")
+    if state and state['online']:
+        lines.append(f"   Uptime: {state.get('uptime')} s")
+        lines.append(f"   RSSI: {state.get('rssi')} dBm")
+    lines.append(f"   Checked: {(state or {}).get('checked') or cached.get('checked', 'never')}")
+    details_text.config(state=tk.NORMAL)
+    details_text.delete('1.0', tk.END)
+    details_text.insert(tk.END, "\n".join(lines))
+    details_text.config(state=tk.DISABLED)
+
+def on_ip_select(event=None):
+    """Show details for the first selected saved device."""
+    selection = ip_tree.selection()
+    if selection:
+        show_device_details(selection[0])
 
 def save_current_ip():
     """Save current IP to list."""
@@ -296,13 +320,12 @@ def save_current_ip():
     if not ip:
         update_status("⚠️ Enter an IP to save.", COLORS['highlight'])
         return
-    ips = load_ips()
-    if ip in ips:
+    if not merge_ips([ip]):
         update_status("ℹ️ IP already saved.", COLORS['text_dim'])
         return
-    ips.append(ip)
-    save_ips(ips)
     refresh_ip_tree()
+    if device_poller:
+        device_poller.poll_now([ip])
     update_status(f"✅ IP {ip} saved!", COLORS['success'])
 
 def remove_selected_ip():
@@ -313,10 +336,11 @@ def remove_selected_ip():
         return
     item = selection[0]
     ip = ip_tree.item(item, 'values')[0]
-    ips = load_ips()
     try:
-        ips.remove(ip)
-        save_ips(ips)
+        if 'discovered' in ip_tree.item(item, 'tags'):
+            forget_devices([ip])
+        else:
+            remove_ips([ip])
         refresh_ip_tree()
         update_status(f"🗑️ IP removed.", COLORS['text_dim'])
     except Exception:
@@ -333,26 +357,6 @@ def use_selected_ip(event=None):
     ip_entry.insert(0, ip)
     update_status(f"✅ IP loaded: {ip}", COLORS['success'])
 
-def load_ips():
-    """Load saved IPs from file."""
-    try:
-        if os.path.exists(IPS_FILE):
-            with open(IPS_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                if isinstance(data, list):
-                    return data
-    except Exception:
-        pass
-    return []
-
-def save_ips(ips):
-    """Save IPs to file."""
-    try:
-        with open(IPS_FILE, "w", encoding="utf-8") as f:
-            json.dump(ips, f, indent=2)
-    except Exception:
-        pass
-
 def browse_file():
     """Browse for firmware file."""
     path = filedialog.askopenfilename(filetypes=[("Binary files", "*.bin"), ("All files", "*.*")])
@@ -361,25 +365,81 @@ def browse_file():
         file_entry.insert(0, path)
         update_status(f"📁 File selected", COLORS['success'])
 
-def scan_devices_thread():
-    """Scan for devices in background thread."""
-    scan_btn.config(state=tk.DISABLED, text="🔍 Scanning...")
-    update_status("🔍 Scanning network for ESP32 devices...", COLORS['text_dim'])
-    root.update()
-    
-    devices = scan_network_for_devices()
-    
+def scan_devices_thread(cancel):
+    """Scan for devices in background thread; setting ``cancel`` stops the sweep early."""
+    found = []
+
+    def on_found(device):
+        found.append(device)
+        name = device['info'].get('name', 'Unknown') if device['info'] else 'Unknown'
+        update_status("🔍 Scanning network for ESP32 devices...", COLORS['text_dim'],
+                      f"📡 Found {device['ip']} ({name})")
+
+    def on_progress(done, total):
+        update_status(f"🔍 Scanning network for ESP32 devices... {done * 100 // total}%", COLORS['text_dim'],
+                      f"{done}/{total} hosts, {len(found)} device(s) found")
+
+    # mDNS answers in milliseconds without touching other hosts; sweep only if nothing answered
+    mode = app_config.get('discovery', 'auto')
+    devices = []
+    try:
+        if mode in ('auto', 'mdns'):
+            devices = discover_devices(
+                timeout=app_config.get('mdns_timeout', MDNS_DISCOVERY_TIMEOUT),
+                interfaces=app_config.get('mdns_interfaces'),
+                on_found=on_found,
+            )
+            remember_devices(devices, source="mdns")
+        # The cache answers repeat scans; fresh devices are not re-probed, known and ARP hosts go first
+        if mode == 'sweep' or (mode == 'auto' and not devices and not cancel.is_set()):
+            devices = cached_scan(
+                on_found=on_found,
+                concurrency=app_config.get('scan_concurrency', DEFAULT_SCAN_CONCURRENCY),
+                probe_timeout=app_config.get('scan_probe_timeout', DEFAULT_SCAN_PROBE_TIMEOUT),
+                targets=app_config.get('scan_targets'),
+                rate=app_config.get('scan_rate', DEFAULT_SCAN_RATE),
+                on_progress=on_progress,
+                cancel=cancel,
+            )
+    except ValueError as e:
+        update_status(f"❌ {e}", COLORS['highlight'])
+        post_ui(None, _scan_finished)
+        return
+    except Exception as e:
+        update_status(f"❌ Scan failed: {e}", COLORS['highlight'])
+        post_ui(None, _scan_finished)
+        return
+
+    post_ui('ip_tree', refresh_ip_tree)
     if devices:
         device_list = "\n".join([f"  📡 {d['ip']}" + (f" ({d['info'].get('name', 'Unknown')})" if d['info'] else "") for d in devices])
-        update_status(f"✅ Found {len(devices)} device(s):\n{device_list}", COLORS['success'])
+        prefix = "⏹ Scan cancelled; found" if cancel.is_set() else "✅ Found"
+        detail = http_stats.describe()
+        if app_config.get('scan_merge_ips', False):
+            added = merge_ips([d['ip'] for d in devices])
+            detail = f"💾 Saved {len(added)} new device(s)  {detail}"
+        update_status(f"{prefix} {len(devices)} device(s):\n{device_list}", COLORS['success'], detail)
     else:
-        update_status("❌ No devices found", COLORS['highlight'])
-    
+        update_status("⏹ Scan cancelled" if cancel.is_set() else "❌ No devices found", COLORS['highlight'])
+
+    post_ui(None, _scan_finished)
+
+def _scan_finished():
+    global scan_cancel
+    scan_cancel = None
     scan_btn.config(state=tk.NORMAL, text="🔍 Scan Network")
 
 def scan_devices():
-    """Start network scan in separate thread."""
-    thread = threading.Thread(target=scan_devices_thread)
+    """Start network scan in separate thread, or cancel the one that is running."""
+    global scan_cancel
+    if scan_cancel is not None:
+        scan_cancel.set()
+        scan_btn.config(state=tk.DISABLED, text="⏹ Cancelling...")
+        return
+    scan_cancel = threading.Event()
+    scan_btn.config(text="⏹ Cancel Scan")
+    update_status("🔍 Scanning network for ESP32 devices...", COLORS['text_dim'])
+    thread = threading.Thread(target=scan_devices_thread, args=(scan_cancel,))
     thread.daemon = True
     thread.start()
 
@@ -392,7 +452,6 @@ def check_device_version():
     
     check_btn.config(state=tk.DISABLED, text="⏳ Checking...")
     update_status("⏳ Checking device version...", COLORS['text_dim'])
-    root.update()
     
     thread = threading.Thread(target=_check_version_thread, args=(ip,))
     thread.daemon = True
@@ -401,47 +460,134 @@ def check_device_version():
 def _check_version_thread(ip):
     """Thread function for checking version."""
     try:
-        info = get_device_info(ip)
+        info = refresh_device_version(ip)
+        if device_poller:
+            device_poller.poll_now([ip])
         if info:
             version = info.get('version', 'Unknown')
             name = info.get('name', 'ESP32')
-            versions = load_device_versions()
-            versions[ip] = {'version': version, 'name': name, 'checked': datetime.now().isoformat()}
-            save_device_versions(versions)
             update_status(f"✅ {name} v{version} @ {ip}", COLORS['success'])
         else:
             update_status(f"❌ Could not connect to {ip}", COLORS['highlight'])
     except Exception as e:
         update_status(f"❌ Error: {str(e)[:50]}", COLORS['highlight'])
     finally:
-        check_btn.config(state=tk.NORMAL, text="ℹ️ Check Version")
+        post_ui(None, lambda: check_btn.config(state=tk.NORMAL, text="ℹ️ Check Version"))
 
 def show_upload_history():
-    """Display upload history in a new window."""
-    history = load_history()
-    
-    if not history:
-        messagebox.showinfo("Upload History", "No uploads recorded yet.")
-        return
-    
-    hist_window = tk.Toplevel(root)
-    hist_window.title("📋 Upload History")
-    hist_window.geometry("700x400")
-    hist_window.configure(bg=COLORS['bg'])
-    
-    text_widget = scrolledtext.ScrolledText(hist_window, wrap=tk.WORD, bg=COLORS['card'], fg=COLORS['text'], font=('Consolas', 9))
-    text_widget.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
-    
-    for entry in reversed(history[-50:]):
-        timestamp = entry.get('timestamp', 'Unknown')
-        ip = entry.get('ip', 'Unknown')
-        status = entry.get('status', 'Unknown')
-        file_name = entry.get('file', 'Unknown')
-        
-        status_icon = "✅" if status == "success" else "❌"
-        text_widget.insert(tk.END, f"{status_icon} [{timestamp}] {ip} - {file_name}\n")
-    
-    text_widget.config(state=tk.DISABLED)
+    """Browse upload history, filtered and sorted by the indexed store and paged in and out as you scroll."""
+    win = tk.Toplevel(root)
+    win.title("📋 Upload History")
+    win.geometry("980x520")
+    win.configure(bg=COLORS['bg'])
+
+    filters_row = tk.Frame(win, bg=COLORS['bg'])
+    filters_row.pack(fill=tk.X, padx=10, pady=(10, SPACING))
+    filter_vars = {}
+    for key, label, width in (('ip', 'IP', 15), ('file', 'File', 16), ('checksum', 'SHA256', 10),
+                              ('since', 'From', 11), ('until', 'To', 11)):
+        tk.Label(filters_row, text=label, bg=COLORS['bg'], fg=COLORS['text_dim']).pack(side=tk.LEFT)
+        filter_vars[key] = tk.StringVar()
+        entry = ttk.Entry(filters_row, textvariable=filter_vars[key], width=width)
+        entry.pack(side=tk.LEFT, padx=(4, SPACING))
+        entry.bind('<Return>', lambda e: reload())
+    tk.Label(filters_row, text='Status', bg=COLORS['bg'], fg=COLORS['text_dim']).pack(side=tk.LEFT)
+    status_var = tk.StringVar(value='any')
+    status_box = ttk.Combobox(filters_row, textvariable=status_var, values=('any', 'success', 'failed'),
+                              width=8, state='readonly')
+    status_box.pack(side=tk.LEFT, padx=(4, SPACING))
+    status_box.bind('<<ComboboxSelected>>', lambda e: reload())
+    ttk.Button(filters_row, text='🔍 Filter', command=lambda: reload()).pack(side=tk.RIGHT)
+
+    columns = ('timestamp', 'ip', 'status', 'file', 'version', 'checksum', 'error')
+    titles = {'timestamp': 'Time', 'ip': 'IP', 'status': 'Status', 'file': 'File', 'version': 'Version',
+              'checksum': 'SHA256', 'error': 'Error'}
+    table = tk.Frame(win, bg=COLORS['bg'])
+    table.pack(fill=tk.BOTH, expand=True, padx=10)
+    tree = ttk.Treeview(table, columns=columns, show='headings')
+    scrollbar = ttk.Scrollbar(table, orient=tk.VERTICAL, command=tree.yview)
+    for column, width in zip(columns, (150, 120, 70, 180, 70, 110, 240)):
+        tree.heading(column, text=titles[column])
+        tree.column(column, width=width, anchor='w')
+    tree.tag_configure('failed', foreground=COLORS['highlight'])
+    scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+    tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+    summary_label = tk.Label(win, text='', bg=COLORS['bg'], fg=COLORS['text_dim'], font=('Segoe UI', 9))
+    summary_label.pack(anchor='w', padx=10, pady=SPACING)
+
+    # The table holds entries [first, end) of the filtered, sorted history
+    view = {'filters': {}, 'sort': 'timestamp', 'descending': True, 'first': 0, 'end': 0, 'total': 0}
+
+    def insert_rows(entries, index):
+        for i, entry in enumerate(entries):
+            status = entry.get('status') or ''
+            tree.insert('', 'end' if index is None else index + i, values=(
+                entry.get('timestamp') or '', entry.get('ip') or '', f"{'✅' if status == 'success' else '❌'} {status}",
+                entry.get('file') or '', entry.get('version') or '', (entry.get('checksum') or '')[:12],
+                entry.get('error') or ''), tags=(status,))
+
+    def show_summary():
+        shown = f"{view['first'] + 1}–{view['end']}" if view['end'] else "0"
+        summary_label.config(text=f"Showing {shown} of {view['total']} entries")
+
+    def load_next():
+        """Append the next page, dropping rows above the window."""
+        top_row = tree.yview()[0] * len(tree.get_children())
+        entries = query_history(HISTORY_PAGE_SIZE, view['end'], view['filters'], view['sort'], view['descending'])
+        insert_rows(entries, None)
+        view['end'] += len(entries)
+        rows = tree.get_children()
+        excess = len(rows) - HISTORY_WINDOW_ROWS
+        if excess > 0:
+            tree.delete(*rows[:excess])
+            view['first'] += excess
+            tree.yview_moveto(max(0.0, top_row - excess) / (len(rows) - excess))
+        show_summary()
+
+    def load_previous():
+        """Prepend the page before the window, dropping rows below it."""
+        count = min(HISTORY_PAGE_SIZE, view['first'])
+        top_row = tree.yview()[0] * len(tree.get_children())
+        entries = query_history(count, view['first'] - count, view['filters'], view['sort'], view['descending'])
+        insert_rows(entries, 0)
+        view['first'] -= len(entries)
+        rows = tree.get_children()
+        excess = len(rows) - HISTORY_WINDOW_ROWS
+        if excess > 0:
+            tree.delete(*rows[-excess:])
+            view['end'] -= excess
+        tree.yview_moveto((top_row + len(entries)) / (len(rows) - max(excess, 0)))
+        show_summary()
+
+    def on_scroll(first, last):
+        scrollbar.set(first, last)
+        if float(last) > 0.9 and view['end'] < view['total']:
+            load_next()
+        elif float(first) < 0.1 and view['first'] > 0:
+            load_previous()
+
+    def reload():
+        filters = {key: var.get().strip() for key, var in filter_vars.items()}
+        if status_var.get() != 'any':
+            filters['status'] = status_var.get()
+        view.update(filters=filters, first=0, end=0, total=count_history(filters))
+        tree.delete(*tree.get_children())
+        for column in columns:
+            arrow = (' ▼' if view['descending'] else ' ▲') if column == view['sort'] else ''
+            tree.heading(column, text=titles[column] + arrow)
+        load_next()
+        tree.yview_moveto(0)
+
+    def sort_by(column):
+        view['descending'] = not view['descending'] if view['sort'] == column else column == 'timestamp'
+        view['sort'] = column
+        reload()
+
+    for column in HISTORY_SORT_COLUMNS:
+        tree.heading(column, command=lambda c=column: sort_by(c))
+    tree.configure(yscrollcommand=on_scroll)
+    reload()
 
 def show_device_versions():
     """Display cached device versions."""
@@ -463,10 +609,156 @@ def show_device_versions():
         name = data.get('name', 'ESP32')
         version = data.get('version', 'Unknown')
         checked = data.get('checked', 'Unknown')
-        text_widget.insert(tk.END, f"📡 {ip}\n   Device: {name}\n   Version: {version}\n   Checked: {checked}\n\n")
+        image = f"\n   Image: {data.get('image_name')} ({data['image_sha256'][:12]})" if data.get('image_sha256') else ""
+        text_widget.insert(tk.END, f"📡 {ip}\n   Device: {name}\n   Version: {version}\n   Checked: {checked}{image}\n\n")
     
     text_widget.config(state=tk.DISABLED)
 
+def show_rollout_window():
+    """Open the fleet rollout window for the selected (or all) saved devices."""
+    file_path = file_entry.get().strip()
+    if not file_path or not os.path.exists(file_path):
+        update_status("⚠️ Select a firmware file before starting a rollout.", COLORS['highlight'])
+        return
+
+    targets = [ip_tree.item(item, 'values')[0] for item in ip_tree.selection()] or load_ips()
+    if not targets:
+        update_status("⚠️ No saved devices to roll out to.", COLORS['highlight'])
+        return
+
+    win = tk.Toplevel(root)
+    win.title("🚀 Fleet Rollout")
+    win.geometry("720x420")
+    win.configure(bg=COLORS['bg'])
+
+    tk.Label(win, text=f"{os.path.basename(file_path)} → {len(targets)} device(s)", font=('Segoe UI', 11, 'bold'),
+             bg=COLORS['bg'], fg=COLORS['text']).pack(anchor='w', padx=10, pady=(10, 0))
+
+    controls = tk.Frame(win, bg=COLORS['bg'])
+    controls.pack(fill=tk.X, padx=10, pady=SPACING)
+    tk.Label(controls, text='Parallel uploads', bg=COLORS['bg'], fg=COLORS['text_dim']).pack(side=tk.LEFT)
+    parallel_var = tk.IntVar(value=app_config.get('rollout_parallelism', DEFAULT_ROLLOUT_PARALLELISM))
+    tk.Spinbox(controls, from_=1, to=32, width=4, textvariable=parallel_var).pack(side=tk.LEFT, padx=(SPACING, 0))
+    adaptive_var = tk.BooleanVar(value=app_config.get('rollout_strategy', 'adaptive') == 'adaptive')
+    tk.Checkbutton(controls, text='Adaptive (canary first, parallel uploads as maximum)', variable=adaptive_var,
+                   bg=COLORS['bg'], fg=COLORS['text_dim'], selectcolor=COLORS['bg'],
+                   activebackground=COLORS['bg']).pack(side=tk.LEFT, padx=(SPACING, 0))
+    start_btn = ttk.Button(controls, text='🚀 Start Rollout', style='Accent.TButton')
+    start_btn.pack(side=tk.RIGHT)
+    # Applies to running uploads too, while typing or clicking: the shaper re-reads
+    # upload_rate_limit while sending. The setting is saved once editing is done.
+    limit_var = tk.StringVar(value=str(global_rate_limit() // 1024))
+    limit_box = tk.Spinbox(controls, from_=0, to=100000, increment=64, width=7, textvariable=limit_var)
+    limit_box.pack(side=tk.RIGHT, padx=(0, SPACING))
+    tk.Label(controls, text='Limit KB/s (0 = none)', bg=COLORS['bg'], fg=COLORS['text_dim']).pack(side=tk.RIGHT, padx=(SPACING, SPACING))
+    saved_limit = [app_config.get('upload_rate_limit', 0)]
+
+    def on_limit_change(*_):
+        try:
+            app_config['upload_rate_limit'] = max(0, int(float(limit_var.get() or 0) * 1024))
+        except ValueError:
+            pass
+
+    def save_limit(event=None):
+        if app_config.get('upload_rate_limit', 0) != saved_limit[0]:
+            saved_limit[0] = app_config.get('upload_rate_limit', 0)
+            save_config(app_config)
+
+    limit_var.trace_add('write', on_limit_change)
+    for sequence in ('<FocusOut>', '<Return>', '<Destroy>'):
+        limit_box.bind(sequence, save_limit)
+
+    tree = ttk.Treeview(win, columns=('ip', 'state', 'detail'), show='headings')
+    tree.heading('ip', text='IP')
+    tree.heading('state', text='State')
+    tree.heading('detail', text='Detail')
+    tree.column('ip', width=130, anchor='w')
+    tree.column('state', width=90, anchor='center')
+    tree.column('detail', width=440, anchor='w')
+    tree.pack(fill=tk.BOTH, expand=True, padx=10)
+    for ip in targets:
+        tree.insert('', 'end', iid=ip, values=(ip, 'queued', ''))
+
+    summary_label = tk.Label(win, text='', bg=COLORS['bg'], fg=COLORS['text_dim'], font=('Segoe UI', 9))
+    summary_label.pack(anchor='w', padx=10, pady=SPACING)
+
+    def start():
+        try:
+            parallelism = max(1, int(parallel_var.get()))
+        except (tk.TclError, ValueError):
+            parallelism = DEFAULT_ROLLOUT_PARALLELISM
+        app_config['rollout_parallelism'] = parallelism
+        app_config['rollout_strategy'] = 'adaptive' if adaptive_var.get() else 'fixed'
+        save_config(app_config)
+        start_btn.config(state=tk.DISABLED)
+        thread = threading.Thread(target=_rollout_thread,
+                                  args=(targets, file_path, parallelism, tree, summary_label, adaptive_var.get(),
+                                        start_btn))
+        thread.daemon = True
+        thread.start()
+
+    start_btn.config(command=start)
+
+def _rollout_thread(targets, file_path, parallelism, tree, summary_label, adaptive=False, start_btn=None):
+    """Thread function for a fleet rollout; marshals per-device state back to Tk.
+
+    If the rollout cannot run (e.g. the image was moved after it was picked)
+    the error is shown and ``start_btn`` is enabled again for a retry.
+    """
+    start_time = time.monotonic()
+    done = {'count': 0, 'bytes': 0}
+    done_lock = threading.Lock()
+
+    def set_row(ip, state, detail):
+        if tree.winfo_exists():
+            tree.item(ip, values=(ip, state, detail))
+
+    def set_summary(text, color):
+        if summary_label.winfo_exists():
+            summary_label.config(text=text, fg=color)
+
+    def on_state(ip, state, detail):
+        post_ui(('rollout', str(tree), ip), set_row, ip, state, detail)
+        if state in ("success", "failed", "skipped"):
+            with done_lock:
+                done['count'] += 1
+                if state == "success":
+                    done['bytes'] += file_size
+                count, sent = done['count'], done['bytes']
+            elapsed = time.monotonic() - start_time
+            rate = sent / (1024 * 1024) / elapsed if elapsed > 0 else 0
+            post_ui(('rollout', str(summary_label)), set_summary, f"⏳ {count}/{len(targets)} done • aggregate {rate:.2f} MB/s", COLORS['text_dim'])
+
+    compute_checksum = app_config.get('verify_checksum', True)
+    try:
+        file_size = os.path.getsize(file_path)
+        if adaptive:
+            update_status(f"🚀 Rolling out to {len(targets)} device(s)...", COLORS['text'],
+                          f"canary wave first, then up to {parallelism} parallel upload(s)")
+            summary = adaptive_rollout(targets, file_path, max_parallelism=parallelism, on_state=on_state,
+                                       compute_checksum=compute_checksum)
+        else:
+            update_status(f"🚀 Rolling out to {len(targets)} device(s)...", COLORS['text'], f"{parallelism} parallel upload(s)")
+            summary = rollout_firmware(targets, file_path, parallelism=parallelism, on_state=on_state,
+                                       compute_checksum=compute_checksum)
+    except Exception as e:
+        text = f"❌ Rollout failed: {e}"
+        post_ui(('rollout', str(summary_label)), set_summary, text, COLORS['highlight'])
+        update_status("❌ Rollout failed", COLORS['highlight'], str(e))
+        if start_btn is not None:
+            post_ui(None, lambda: start_btn.config(state=tk.NORMAL))
+        return
+
+    text = (f"{'✅' if summary['succeeded'] == len(targets) else '⚠️'} "
+            + describe_rollout(summary, len(targets), app_config.get('verify_reboot', True)))
+    if summary.get('stopped'):
+        text += f"\n🛑 Stopped: {summary['stopped']} ({len(summary['skipped'])} skipped)"
+    elif adaptive:
+        text += f" • concurrency peaked at {max(limit for _, limit in summary['concurrency'])}"
+    color = COLORS['success'] if summary['succeeded'] == len(targets) else COLORS['highlight']
+    post_ui(('rollout', str(summary_label)), set_summary, text, color)
+    update_status(text, color, http_stats.describe())
+
 def toggle_theme():
     """Toggle between dark and light theme."""
     current_theme = app_config.get('theme', 'dark')
@@ -476,44 +768,57 @@ def toggle_theme():
     messagebox.showinfo("Theme", f"Theme changed to {new_theme.upper()}. Please restart the application.")
 
 def export_config_window():
-    """Export configuration."""
-    save_path = filedialog.asksaveasfilename(defaultextension=".json", filetypes=[("JSON files", "*.json")])
+    """Export settings, devices and history to a JSON Lines file in the background."""
+    save_path = filedialog.asksaveasfilename(defaultextension=".jsonl.gz",
+                                             filetypes=[("Compressed export", "*.jsonl.gz"), ("Export", "*.jsonl")])
     if save_path:
-        try:
-            config_data = {
-                'ips': load_ips(),
-                'history': load_history(),
-                'versions': load_device_versions(),
-                'settings': app_config
-            }
-            with open(save_path, "w") as f:
-                json.dump(config_data, f, indent=2)
-            messagebox.showinfo("Success", f"Configuration exported to {save_path}")
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to export: {str(e)}")
+        update_status("💾 Exporting configuration...", COLORS['text'])
+        thread = threading.Thread(target=_export_config_thread, args=(save_path,))
+        thread.daemon = True
+        thread.start()
+
+def _export_config_thread(save_path):
+    """Thread function for export_config_window()."""
+    def on_progress(done, total):
+        update_status("💾 Exporting configuration...", COLORS['text'], f"{done}/{total} history entries")
+
+    try:
+        summary = export_config(save_path, on_progress=on_progress)
+    except Exception as e:
+        update_status("❌ Export failed", COLORS['highlight'], str(e))
+        post_ui(None, messagebox.showerror, "Error", f"Failed to export: {str(e)}")
+        return
+    text = f"✅ Exported {summary['history']} history entries ({summary['bytes'] / 1024:.0f} KB)"
+    update_status(text, COLORS['success'], save_path)
+    post_ui(None, messagebox.showinfo, "Success", f"Configuration exported to {save_path}")
 
 def import_config_window():
-    """Import configuration."""
-    load_path = filedialog.askopenfilename(filetypes=[("JSON files", "*.json")])
+    """Merge an exported configuration (or an older .json export) in the background."""
+    load_path = filedialog.askopenfilename(filetypes=[("Exports", "*.jsonl.gz *.jsonl *.json"), ("All files", "*.*")])
     if load_path:
-        try:
-            with open(load_path, "r") as f:
-                config_data = json.load(f)
-            
-            if 'ips' in config_data:
-                save_ips(config_data['ips'])
-            if 'history' in config_data:
-                save_history(config_data['history'])
-            if 'versions' in config_data:
-                save_device_versions(config_data['versions'])
-            if 'settings' in config_data:
-                app_config.update(config_data['settings'])
-                save_config(app_config)
-            
-            refresh_ip_tree()
-            messagebox.showinfo("Success", "Configuration imported successfully!")
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to import: {str(e)}")
+        update_status("📂 Importing configuration...", COLORS['text'])
+        thread = threading.Thread(target=_import_config_thread, args=(load_path,))
+        thread.daemon = True
+        thread.start()
+
+def _import_config_thread(load_path):
+    """Thread function for import_config_window()."""
+    def on_progress(done, total):
+        update_status("📂 Importing configuration...", COLORS['text'], f"{done * 100 // max(total, 1)}%")
+
+    try:
+        summary = import_config(load_path, on_progress=on_progress)
+    except Exception as e:
+        update_status("❌ Import failed", COLORS['highlight'], str(e))
+        post_ui(None, messagebox.showerror, "Error", f"Failed to import: {str(e)}")
+        return
+    post_ui(None, refresh_ip_tree)
+    text = (f"{summary['history_added']} history entries added, {summary['history_duplicates']} already present, "
+            f"{summary['ips_added']} new device(s), {summary['versions']} device record(s) merged")
+    if summary['invalid'] or not summary['complete']:
+        text += f"\n⚠️ {summary['invalid']} unreadable line(s)" + ("; the file ends early" if not summary['complete'] else "")
+    update_status("✅ Configuration imported", COLORS['success'], text.split("\n")[0])
+    post_ui(None, messagebox.showinfo, "Success", f"Configuration imported.\n\n{text}")
 
 def on_enter(e):
     """Hover enter effect."""
@@ -524,137 +829,163 @@ def on_leave(e, original_bg):
     e.widget.config(bg=original_bg, fg=COLORS['text'])
 
 # ============= MAIN GUI SETUP =============
-app_config = load_config()
 COLORS = THEMES[app_config.get('theme', 'dark')]
 
-root = tk.Tk()
-root.title("⚡ OTA Uploader Pro")
-root.geometry("1000x700")
-root.minsize(900, 600)
-root.configure(bg=COLORS['bg'])
-
-# Use ttk styles for a modern look
-style = ttk.Style(root)
-try:
-    style.theme_use('clam')
-except Exception:
-    pass
-style.configure('Card.TFrame', background=COLORS['card'])
-style.configure('Accent.TButton', background=COLORS['accent'], foreground=COLORS['text'], borderwidth=0, focusthickness=0)
-style.map('Accent.TButton', background=[('active', COLORS['button_hover'])])
-style.configure('TLabel', background=COLORS['bg'], foreground=COLORS['text'])
-
-# Layout: Sidebar (left), Main (center), Details (right)
-PADDING = 16
-INNER_PADDING = 12
-SPACING = 8
-
-container = tk.Frame(root, bg=COLORS['bg'])
-container.pack(fill=tk.BOTH, expand=True, padx=PADDING, pady=PADDING)
-
-sidebar = tk.Frame(container, bg=COLORS['card'], width=260)
-sidebar.pack(side=tk.LEFT, fill=tk.Y, padx=(0, PADDING), pady=0)
-sidebar.pack_propagate(False)
-
-main_area = tk.Frame(container, bg=COLORS['bg'])
-main_area.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=(0, PADDING), pady=0)
-
-details = tk.Frame(container, bg=COLORS['card'], width=260)
-details.pack(side=tk.RIGHT, fill=tk.Y, padx=(0, 0), pady=0)
-details.pack_propagate(False)
-
-# Sidebar: Header + saved devices
-sb_header = tk.Label(sidebar, text="Saved Devices", font=('Segoe UI', 14, 'bold'), bg=COLORS['card'], fg=COLORS['text'])
-sb_header.pack(anchor='w', padx=INNER_PADDING, pady=(INNER_PADDING, SPACING))
-
-ip_tree = ttk.Treeview(sidebar, columns=('ip','version'), show='headings', selectmode='browse', height=16)
-ip_tree.heading('ip', text='IP')
-ip_tree.heading('version', text='Version')
-ip_tree.column('ip', width=130, anchor='w')
-ip_tree.column('version', width=80, anchor='center')
-ip_tree.pack(fill=tk.BOTH, expand=True, padx=INNER_PADDING, pady=(0, SPACING))
-ip_tree.bind('<Double-1>', lambda e: use_selected_ip())
-
-sb_btn_frame = tk.Frame(sidebar, bg=COLORS['card'])
-sb_btn_frame.pack(fill=tk.X, padx=INNER_PADDING, pady=(0, SPACING))
-
-ttk.Button(sb_btn_frame, text='Add IP', style='Accent.TButton', command=save_current_ip).pack(side=tk.LEFT, expand=True, fill=tk.X, padx=(0, SPACING//2))
-ttk.Button(sb_btn_frame, text='Remove', style='Accent.TButton', command=remove_selected_ip).pack(side=tk.LEFT, expand=True, fill=tk.X, padx=(SPACING//2, 0))
-
-ttk.Separator(sidebar, orient='horizontal').pack(fill=tk.X, padx=INNER_PADDING, pady=(SPACING, SPACING))
-ttk.Button(sidebar, text='📋 History', style='Accent.TButton', command=show_upload_history).pack(fill=tk.X, padx=INNER_PADDING, pady=(0, SPACING))
-ttk.Button(sidebar, text='ℹ️ Versions', style='Accent.TButton', command=show_device_versions).pack(fill=tk.X, padx=INNER_PADDING, pady=(0, SPACING))
-
-# Main Area: Toolbar + Card for upload
-toolbar = tk.Frame(main_area, bg=COLORS['bg'])
-toolbar.pack(fill=tk.X, pady=(0, SPACING))
-
-ttk.Button(toolbar, text='🔍 Scan', style='Accent.TButton', command=scan_devices).pack(side=tk.LEFT, padx=(0, SPACING))
-ttk.Button(toolbar, text='🎨 Theme', style='Accent.TButton', command=toggle_theme).pack(side=tk.LEFT, padx=(0, SPACING))
-ttk.Button(toolbar, text='💾 Export', style='Accent.TButton', command=export_config_window).pack(side=tk.LEFT, padx=(0, SPACING))
-ttk.Button(toolbar, text='📂 Import', style='Accent.TButton', command=import_config_window).pack(side=tk.LEFT, padx=(0, 0))
-
-card = ttk.Frame(main_area, style='Card.TFrame', padding=(INNER_PADDING, INNER_PADDING))
-card.pack(fill=tk.BOTH, expand=True)
-
-# Center all card elements
-title = tk.Label(card, text='⚡ OTA Uploader', font=('Segoe UI', 16, 'bold'), bg=COLORS['card'], fg=COLORS['text'])
-title.pack(anchor='center')
-
-desc = tk.Label(card, text='Upload firmware to ESP32 devices with ease', font=('Segoe UI', 10), bg=COLORS['card'], fg=COLORS['text_dim'])
-desc.pack(anchor='center', pady=(SPACING, INNER_PADDING))
-
-form = tk.Frame(card, bg=COLORS['card'])
-form.pack(anchor='center', pady=(SPACING, 0))
-
-tk.Label(form, text='Device IP', bg=COLORS['card'], fg=COLORS['text_dim']).grid(row=0, column=0, sticky='w')
-ip_entry = ttk.Entry(form, width=36)
-ip_entry.grid(row=1, column=0, sticky='we', pady=(SPACING, INNER_PADDING))
-
-tk.Label(form, text='Firmware (.bin)', bg=COLORS['card'], fg=COLORS['text_dim']).grid(row=2, column=0, sticky='w')
-file_frame = tk.Frame(form, bg=COLORS['card'])
-file_frame.grid(row=3, column=0, sticky='we', pady=(SPACING, INNER_PADDING))
-file_entry = ttk.Entry(file_frame)
-file_entry.pack(side=tk.LEFT, fill=tk.X, expand=True)
-ttk.Button(file_frame, text='Browse', command=browse_file).pack(side=tk.LEFT, padx=(SPACING, 0))
-
-action_row = tk.Frame(card, bg=COLORS['card'])
-action_row.pack(anchor='center', pady=(SPACING, INNER_PADDING))
-scan_btn = ttk.Button(action_row, text='🔍 Scan Network', command=scan_devices)
-scan_btn.pack(side=tk.LEFT)
-check_btn = ttk.Button(action_row, text='ℹ️ Check Version', command=check_device_version)
-check_btn.pack(side=tk.LEFT, padx=(SPACING, 0))
+def main():
+    """Build the main window, start the background services and run the Tk loop."""
+    global root, ip_tree, ip_entry, file_entry, details_text, scan_btn, check_btn, upload_btn, progress_bar
+    global status_label, progress_label, device_poller, device_browser
+    root = tk.Tk()
+    root.title("⚡ OTA Uploader Pro")
+    root.geometry("1000x700")
+    root.minsize(900, 600)
+    root.configure(bg=COLORS['bg'])
+
+    # Use ttk styles for a modern look
+    style = ttk.Style(root)
+    try:
+        style.theme_use('clam')
+    except Exception:
+        pass
+    style.configure('Card.TFrame', background=COLORS['card'])
+    style.configure('Accent.TButton', background=COLORS['accent'], foreground=COLORS['text'], borderwidth=0, focusthickness=0)
+    style.map('Accent.TButton', background=[('active', COLORS['button_hover'])])
+    style.configure('TLabel', background=COLORS['bg'], foreground=COLORS['text'])
+
+    # Layout: Sidebar (left), Main (center), Details (right)
+    container = tk.Frame(root, bg=COLORS['bg'])
+    container.pack(fill=tk.BOTH, expand=True, padx=PADDING, pady=PADDING)
+
+    sidebar = tk.Frame(container, bg=COLORS['card'], width=260)
+    sidebar.pack(side=tk.LEFT, fill=tk.Y, padx=(0, PADDING), pady=0)
+    sidebar.pack_propagate(False)
+
+    main_area = tk.Frame(container, bg=COLORS['bg'])
+    main_area.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=(0, PADDING), pady=0)
+
+    details = tk.Frame(container, bg=COLORS['card'], width=260)
+    details.pack(side=tk.RIGHT, fill=tk.Y, padx=(0, 0), pady=0)
+    details.pack_propagate(False)
+
+    # Sidebar: Header + saved devices
+    sb_header = tk.Label(sidebar, text="Saved Devices", font=('Segoe UI', 14, 'bold'), bg=COLORS['card'], fg=COLORS['text'])
+    sb_header.pack(anchor='w', padx=INNER_PADDING, pady=(INNER_PADDING, SPACING))
+
+    ip_tree = ttk.Treeview(sidebar, columns=('ip','version'), show='headings', selectmode='extended', height=16)
+    ip_tree.heading('ip', text='IP')
+    ip_tree.heading('version', text='Version')
+    ip_tree.column('ip', width=130, anchor='w')
+    ip_tree.column('version', width=80, anchor='center')
+    ip_tree.pack(fill=tk.BOTH, expand=True, padx=INNER_PADDING, pady=(0, SPACING))
+    ip_tree.bind('<Double-1>', lambda e: use_selected_ip())
+    ip_tree.bind('<<TreeviewSelect>>', on_ip_select)
+    ip_tree.tag_configure('offline', foreground=COLORS['text_dim'])
+    ip_tree.tag_configure('online', foreground=COLORS['success'])
+    ip_tree.tag_configure('discovered', foreground=COLORS['text_dim'], font=('Segoe UI', 9, 'italic'))
+
+    sb_btn_frame = tk.Frame(sidebar, bg=COLORS['card'])
+    sb_btn_frame.pack(fill=tk.X, padx=INNER_PADDING, pady=(0, SPACING))
+
+    ttk.Button(sb_btn_frame, text='Add IP', style='Accent.TButton', command=save_current_ip).pack(side=tk.LEFT, expand=True, fill=tk.X, padx=(0, SPACING//2))
+    ttk.Button(sb_btn_frame, text='Remove', style='Accent.TButton', command=remove_selected_ip).pack(side=tk.LEFT, expand=True, fill=tk.X, padx=(SPACING//2, 0))
+
+    ttk.Separator(sidebar, orient='horizontal').pack(fill=tk.X, padx=INNER_PADDING, pady=(SPACING, SPACING))
+    ttk.Button(sidebar, text='📋 History', style='Accent.TButton', command=show_upload_history).pack(fill=tk.X, padx=INNER_PADDING, pady=(0, SPACING))
+    ttk.Button(sidebar, text='ℹ️ Versions', style='Accent.TButton', command=show_device_versions).pack(fill=tk.X, padx=INNER_PADDING, pady=(0, SPACING))
+    ttk.Button(sidebar, text='🚀 Rollout', style='Accent.TButton', command=show_rollout_window).pack(fill=tk.X, padx=INNER_PADDING, pady=(0, SPACING))
+
+    # Main Area: Toolbar + Card for upload
+    toolbar = tk.Frame(main_area, bg=COLORS['bg'])
+    toolbar.pack(fill=tk.X, pady=(0, SPACING))
+
+    ttk.Button(toolbar, text='🔍 Scan', style='Accent.TButton', command=scan_devices).pack(side=tk.LEFT, padx=(0, SPACING))
+    ttk.Button(toolbar, text='🎨 Theme', style='Accent.TButton', command=toggle_theme).pack(side=tk.LEFT, padx=(0, SPACING))
+    ttk.Button(toolbar, text='💾 Export', style='Accent.TButton', command=export_config_window).pack(side=tk.LEFT, padx=(0, SPACING))
+    ttk.Button(toolbar, text='📂 Import', style='Accent.TButton', command=import_config_window).pack(side=tk.LEFT, padx=(0, 0))
+
+    card = ttk.Frame(main_area, style='Card.TFrame', padding=(INNER_PADDING, INNER_PADDING))
+    card.pack(fill=tk.BOTH, expand=True)
+
+    # Center all card elements
+    title = tk.Label(card, text='⚡ OTA Uploader', font=('Segoe UI', 16, 'bold'), bg=COLORS['card'], fg=COLORS['text'])
+    title.pack(anchor='center')
+
+    desc = tk.Label(card, text='Upload firmware to ESP32 devices with ease', font=('Segoe UI', 10), bg=COLORS['card'], fg=COLORS['text_dim'])
+    desc.pack(anchor='center', pady=(SPACING, INNER_PADDING))
+
+    form = tk.Frame(card, bg=COLORS['card'])
+    form.pack(anchor='center', pady=(SPACING, 0))
+
+    tk.Label(form, text='Device IP', bg=COLORS['card'], fg=COLORS['text_dim']).grid(row=0, column=0, sticky='w')
+    ip_entry = ttk.Entry(form, width=36)
+    ip_entry.grid(row=1, column=0, sticky='we', pady=(SPACING, INNER_PADDING))
+
+    tk.Label(form, text='Firmware (.bin)', bg=COLORS['card'], fg=COLORS['text_dim']).grid(row=2, column=0, sticky='w')
+    file_frame = tk.Frame(form, bg=COLORS['card'])
+    file_frame.grid(row=3, column=0, sticky='we', pady=(SPACING, INNER_PADDING))
+    file_entry = ttk.Entry(file_frame)
+    file_entry.pack(side=tk.LEFT, fill=tk.X, expand=True)
+    ttk.Button(file_frame, text='Browse', command=browse_file).pack(side=tk.LEFT, padx=(SPACING, 0))
+
+    action_row = tk.Frame(card, bg=COLORS['card'])
+    action_row.pack(anchor='center', pady=(SPACING, INNER_PADDING))
+    scan_btn = ttk.Button(action_row, text='🔍 Scan Network', command=scan_devices)
+    scan_btn.pack(side=tk.LEFT)
+    check_btn = ttk.Button(action_row, text='ℹ️ Check Version', command=check_device_version)
+    check_btn.pack(side=tk.LEFT, padx=(SPACING, 0))
+
+    upload_btn = tk.Button(card, text='🚀 Upload Firmware', bg=COLORS['highlight'], fg='white', font=('Segoe UI', 10, 'bold'), command=upload_firmware)
+    upload_btn.pack(anchor='center', pady=(INNER_PADDING, SPACING))
+    upload_btn.bind('<Enter>', on_enter)
+    upload_btn.bind('<Leave>', lambda e: on_leave(e, COLORS['highlight']))
+
+    progress_bar = ttk.Progressbar(card, mode='indeterminate')
+    progress_bar.pack(fill=tk.X, pady=(SPACING, 0))
+
+    # Details panel
+    dt_title = tk.Label(details, text='Device Details', font=('Segoe UI', 14, 'bold'), bg=COLORS['card'], fg=COLORS['text'])
+    dt_title.pack(anchor='w', padx=INNER_PADDING, pady=(INNER_PADDING, SPACING))
+
+    details_text = scrolledtext.ScrolledText(details, height=16, bg=COLORS['card'], fg=COLORS['text'], bd=0, font=('Consolas', 9), wrap=tk.WORD)
+    details_text.pack(fill=tk.BOTH, expand=True, padx=INNER_PADDING, pady=(0, INNER_PADDING))
+    details_text.insert(tk.END, 'Select a device or enter an IP and click "Check Version".')
+    details_text.config(state=tk.DISABLED)
+
+    # Status bar at bottom with enhanced information
+    status_frame = tk.Frame(root, bg=COLORS['bg'])
+    status_frame.pack(fill=tk.X, side=tk.BOTTOM, padx=PADDING, pady=(0, PADDING))
+
+    # Main status label
+    status_label = tk.Label(status_frame, text='✅ Ready to upload', bg=COLORS['bg'], fg=COLORS['text_dim'], font=('Segoe UI', 9, 'bold'))
+    status_label.pack(anchor='w', padx=0, pady=(SPACING, 0))
+
+    # Progress/details label
+    progress_label = tk.Label(status_frame, text='', bg=COLORS['bg'], fg=COLORS['text_dim'], font=('Segoe UI', 8))
+    progress_label.pack(anchor='w', padx=0, pady=(2, 0))
+
+    # Populate sidebar list from saved IPs
+    refresh_ip_tree()
 
-upload_btn = tk.Button(card, text='🚀 Upload Firmware', bg=COLORS['highlight'], fg='white', font=('Segoe UI', 10, 'bold'), command=upload_firmware)
-upload_btn.pack(anchor='center', pady=(INNER_PADDING, SPACING))
-upload_btn.bind('<Enter>', on_enter)
-upload_btn.bind('<Leave>', lambda e: on_leave(e, COLORS['highlight']))
+    # Keep the fleet view current in the background
+    if app_config.get('poll_enabled', True):
+        device_poller = DevicePoller(
+            load_ips,
+            interval=app_config.get('poll_interval', DEFAULT_POLL_INTERVAL),
+            concurrency=app_config.get('poll_concurrency', DEFAULT_POLL_CONCURRENCY),
+            on_change=on_poll_changes,
+        ).start()
 
-progress_bar = ttk.Progressbar(card, mode='indeterminate')
-progress_bar.pack(fill=tk.X, pady=(SPACING, 0))
+    # Saved devices that reboot or change version are refreshed as soon as they announce it
+    if app_config.get('mdns_browse', True):
+        device_browser = MdnsBrowser(on_change=on_mdns_changes, interfaces=app_config.get('mdns_interfaces')).start()
 
-# Details panel
-dt_title = tk.Label(details, text='Device Details', font=('Segoe UI', 14, 'bold'), bg=COLORS['card'], fg=COLORS['text'])
-dt_title.pack(anchor='w', padx=INNER_PADDING, pady=(INNER_PADDING, SPACING))
+    # Start draining worker-thread UI events
+    root.after(UI_FRAME_MS, _drain_ui_events)
 
-details_text = scrolledtext.ScrolledText(details, height=16, bg=COLORS['card'], fg=COLORS['text'], bd=0, font=('Consolas', 9), wrap=tk.WORD)
-details_text.pack(fill=tk.BOTH, expand=True, padx=INNER_PADDING, pady=(0, INNER_PADDING))
-details_text.insert(tk.END, 'Select a device or enter an IP and click "Check Version".')
-details_text.config(state=tk.DISABLED)
+    # Rotate old history entries without delaying startup
+    threading.Thread(target=compact_history, args=(app_config.get('history_max_entries', HISTORY_MAX_ENTRIES),), daemon=True).start()
 
-# Status bar at bottom with enhanced information
-status_frame = tk.Frame(root, bg=COLORS['bg'])
-status_frame.pack(fill=tk.X, side=tk.BOTTOM, padx=PADDING, pady=(0, PADDING))
+    root.mainloop()
 
-# Main status label
-status_label = tk.Label(status_frame, text='✅ Ready to upload', bg=COLORS['bg'], fg=COLORS['text_dim'], font=('Segoe UI', 9, 'bold'))
-status_label.pack(anchor='w', padx=0, pady=(SPACING, 0))
-
-# Progress/details label
-progress_label = tk.Label(status_frame, text='', bg=COLORS['bg'], fg=COLORS['text_dim'], font=('Segoe UI', 8))
-progress_label.pack(anchor='w', padx=0, pady=(2, 0))
-
-# Populate sidebar list from saved IPs
-refresh_ip_tree()
-
-root.mainloop()
+if __name__ == "__main__":
+    main()
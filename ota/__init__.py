@@ -0,0 +1,77 @@
+"""Headless core of the OTA uploader: device access, scanning, uploads and history.
+
+Nothing in this package imports tkinter. main.py is a thin GUI over it and
+``python -m ota`` exposes the same operations on the command line.
+
+Public names are re-exported lazily so that ``import ota`` (and CLI commands
+that never touch the network) do not pay for importing requests.
+"""
+from importlib import import_module
+
+__version__ = "2.1.0"
+
+_EXPORTS = {
+    'app_config': 'storage',
+    'load_config': 'storage',
+    'save_config': 'storage',
+    'load_ips': 'storage',
+    'save_ips': 'storage',
+    'merge_ips': 'storage',
+    'load_device_versions': 'storage',
+    'save_device_versions': 'storage',
+    'calculate_checksum': 'checksum',
+    'store_artifact': 'artifacts',
+    'find_artifact': 'artifacts',
+    'list_artifacts': 'artifacts',
+    'make_delta': 'delta',
+    'apply_delta': 'delta',
+    'TokenBucket': 'shaping',
+    'UploadShaper': 'shaping',
+    'parse_rate': 'shaping',
+    'profile_operation': 'profiling',
+    'hot_path': 'profiling',
+    'recent_reports': 'profiling',
+    'set_profiling_override': 'profiling',
+    'export_config': 'backup',
+    'import_config': 'backup',
+    'log_upload': 'history',
+    'load_history': 'history',
+    'save_history': 'history',
+    'query_history': 'history',
+    'count_history': 'history',
+    'compact_history': 'history',
+    'record_spans': 'history',
+    'query_spans': 'history',
+    'collect_metrics': 'metrics',
+    'format_prometheus': 'metrics',
+    'check_device_online': 'device',
+    'get_device_info': 'device',
+    'refresh_device_version': 'device',
+    'http_stats': 'device',
+    'scan_network_for_devices': 'scan',
+    'plan_scan_targets': 'scan',
+    'sweep_hosts': 'scan',
+    'cached_scan': 'discovery',
+    'cached_devices': 'discovery',
+    'discover_devices': 'mdns',
+    'MdnsBrowser': 'mdns',
+    'interface_addresses': 'netif',
+    'upload_to_device': 'upload',
+    'rollout_firmware': 'upload',
+    'adaptive_rollout': 'rollout',
+    'describe_rollout': 'rollout',
+    'TransferMeter': 'upload',
+    'format_rate': 'upload',
+    'wait_for_reboot': 'verify',
+    'verify_update': 'verify',
+}
+
+__all__ = sorted(_EXPORTS)
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(f".{module}", __name__), name)
+    globals()[name] = value
+    return value
@@ -0,0 +1,6 @@
+"""Allow ``python -m ota``."""
+import sys
+
+from .cli import main
+
+sys.exit(main())
@@ -0,0 +1,123 @@
+"""Content-addressed store of flashed firmware images, keyed by SHA-256.
+
+Every image that is uploaded successfully is copied to
+artifacts/<sha256>.bin and listed in artifacts/index.json with its file
+name, size and MD5. The MD5 is what the sketch reports as ``sketch_md5`` in
+/info, so a device's running image can be traced back to an artifact
+(recorded as ``image_sha256`` in device_versions.json) and used as the base
+of a delta upload (see ota.delta).
+
+Images are copied rather than hard-linked: build tools rewrite firmware.bin
+in place, which would change a linked artifact under its digest.
+"""
+import hashlib
+import os
+import threading
+from datetime import datetime
+
+from .checksum import CHECKSUM_BUFFER_SIZE, calculate_checksum
+from .profiling import timed
+from .storage import DATA_DIR, JsonStore, app_config, load_device_versions
+
+ARTIFACT_DIR = os.path.join(DATA_DIR, "artifacts")
+ARTIFACT_INDEX_FILE = os.path.join(ARTIFACT_DIR, "index.json")
+
+# Artifact store tuning (overridable via app_config.json)
+ARTIFACT_MAX_COUNT = 20
+
+_artifact_lock = threading.Lock()
+_index_store = JsonStore(ARTIFACT_INDEX_FILE, dict, lambda data: isinstance(data, dict))
+
+def artifact_path(sha256):
+    return os.path.join(ARTIFACT_DIR, f"{sha256}.bin")
+
+def load_artifact_index():
+    """Load the artifact index: ``{sha256: {'name', 'size', 'md5', 'added', 'used'}}``."""
+    return _index_store.load()
+
+def save_artifact_index(index):
+    os.makedirs(ARTIFACT_DIR, exist_ok=True)
+    _index_store.save(index)
+
+def _copy_hashed(file_path, out_path):
+    """Copy a file and return the SHA-256 and MD5 of what was copied."""
+    sha256, md5 = hashlib.sha256(), hashlib.md5()
+    with open(file_path, "rb") as src, open(out_path, "wb") as dst:
+        while True:
+            data = src.read(CHECKSUM_BUFFER_SIZE)
+            if not data:
+                break
+            sha256.update(data)
+            md5.update(data)
+            dst.write(data)
+    return sha256.hexdigest(), md5.hexdigest()
+
+@timed("artifacts.store")
+def store_artifact(file_path, checksum=None):
+    """Add an image to the store (a no-op if its digest is already there) and return its entry.
+
+    ``checksum`` is the image's SHA-256 (looked up with calculate_checksum()
+    if not given); the digest of the bytes actually copied wins if the file
+    changed in between. The store keeps at most ``artifact_max_count``
+    images besides those a device is recorded as running, dropping the
+    least recently used.
+    """
+    now = datetime.now().isoformat()
+    checksum = checksum or calculate_checksum(file_path)
+    with _artifact_lock:
+        def touch(index):
+            if checksum not in index:
+                return None
+            index[checksum]['used'] = now
+            return dict(index[checksum])
+
+        entry = _index_store.update(touch) if os.path.exists(artifact_path(checksum)) else None
+        if entry:
+            return dict(entry, sha256=checksum, path=artifact_path(checksum))
+
+        os.makedirs(ARTIFACT_DIR, exist_ok=True)
+        tmp_path = os.path.join(ARTIFACT_DIR, f".{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            sha256, md5 = _copy_hashed(file_path, tmp_path)
+            os.replace(tmp_path, artifact_path(sha256))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        size = os.path.getsize(artifact_path(sha256))
+
+        def add(index):
+            index[sha256] = {'name': os.path.basename(file_path), 'size': size, 'md5': md5,
+                             'added': index.get(sha256, {}).get('added', now), 'used': now}
+            _prune(index, app_config.get('artifact_max_count', ARTIFACT_MAX_COUNT))
+            return dict(index[sha256])
+
+        return dict(_index_store.update(add), sha256=sha256, path=artifact_path(sha256))
+
+def _prune(index, max_count):
+    running = {entry.get('image_sha256') for entry in load_device_versions().values()}
+    spare = sorted((sha256 for sha256 in index if sha256 not in running), key=lambda sha256: index[sha256]['used'])
+    for sha256 in spare[:max(0, len(index) - max_count)]:
+        del index[sha256]
+        try:
+            os.remove(artifact_path(sha256))
+        except OSError:
+            pass
+
+def find_artifact(sha256=None, md5=None):
+    """Entry (with ``sha256`` and ``path``) for a stored image by SHA-256 or MD5, or None."""
+    def lookup(index):
+        key = sha256
+        if key is None and md5:
+            key = next((k for k, entry in index.items() if entry.get('md5') == md5), None)
+        return key, dict(index[key]) if key in index else None
+
+    key, entry = _index_store.read(lookup)
+    if entry is None or not os.path.exists(artifact_path(key)):
+        return None
+    return dict(entry, sha256=key, path=artifact_path(key))
+
+def list_artifacts():
+    """Stored images, most recently used first."""
+    index = load_artifact_index()
+    entries = [dict(entry, sha256=sha256, path=artifact_path(sha256)) for sha256, entry in index.items()]
+    return sorted(entries, key=lambda entry: entry['used'], reverse=True)
@@ -0,0 +1,209 @@
+"""Streaming export and import of settings, saved devices, device versions and upload history.
+
+An export is JSON Lines, gzip-compressed when the file name ends in .gz:
+
+  {"type": "header", "format": "ota-export", "version": 1, "exported": "<ISO time>"}
+  {"type": "settings", "data": {...}}       app_config.json
+  {"type": "ips", "data": [...]}            saved device addresses
+  {"type": "versions", "data": {...}}       device_versions.json
+  {"type": "history", "entry": {...}}       one line per upload, oldest first
+  {"type": "end", "history": <entries>}
+
+History is read from the database and merged back into it in batches, so
+memory use does not grow with its size. An import merges rather than
+replaces: addresses are added, each device keeps whichever version record
+is newer, and history entries already stored (see
+ota.history.merge_history()) are skipped, so two stations can swap exports
+repeatedly. Settings are applied unless ``settings=False``. The single JSON
+document written by older versions can still be imported, but it is loaded
+whole.
+"""
+import gzip
+import io
+import json
+import os
+from datetime import datetime
+
+from .history import HISTORY_BATCH_SIZE, count_history, iter_history, merge_history
+from .storage import app_config, load_device_versions, load_ips, merge_ips, save_config, update_device_versions
+
+EXPORT_FORMAT = "ota-export"
+EXPORT_VERSION = 1
+GZIP_MAGIC = b"\x1f\x8b"
+
+def _line(record):
+    return json.dumps(record, separators=(",", ":")) + "\n"
+
+def export_config(path, on_progress=None, cancel=None):
+    """Write an export to ``path`` (gzip if it ends in .gz) and return a summary dict.
+
+    ``on_progress(entries, total)`` follows the history entries written.
+    Setting the ``cancel`` event stops the export and leaves no file behind
+    (``cancelled`` in the summary). The file is written under a temporary
+    name and renamed when complete.
+    """
+    total = count_history()
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    summary = {'path': path, 'history': 0, 'bytes': 0, 'cancelled': False}
+    try:
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(tmp_path, "wt", encoding="utf-8") as f:
+            f.write(_line({'type': "header", 'format': EXPORT_FORMAT, 'version': EXPORT_VERSION,
+                           'exported': datetime.now().isoformat()}))
+            f.write(_line({'type': "settings", 'data': dict(app_config)}))
+            f.write(_line({'type': "ips", 'data': load_ips()}))
+            f.write(_line({'type': "versions", 'data': load_device_versions()}))
+            for entry in iter_history():
+                f.write(_line({'type': "history", 'entry': entry}))
+                summary['history'] += 1
+                if summary['history'] % HISTORY_BATCH_SIZE == 0:
+                    if cancel is not None and cancel.is_set():
+                        summary['cancelled'] = True
+                        return summary
+                    if on_progress:
+                        on_progress(summary['history'], max(total, summary['history']))
+            f.write(_line({'type': "end", 'history': summary['history']}))
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    if on_progress:
+        on_progress(summary['history'], summary['history'])
+    summary['bytes'] = os.path.getsize(path)
+    return summary
+
+def _version_stamp(entry):
+    return max(str(entry.get(field) or "") for field in ('checked', 'flashed', 'last_update'))
+
+def _merge_versions(imported):
+    """Merge imported device records; the newer record's fields win. Returns the number of devices."""
+    imported = {ip: entry for ip, entry in imported.items() if isinstance(entry, dict)}
+
+    def merge(versions):
+        for ip, entry in imported.items():
+            current = versions.get(ip) or {}
+            if _version_stamp(entry) >= _version_stamp(current):
+                versions[ip] = dict(current, **entry)
+            else:
+                versions[ip] = dict(entry, **current)
+
+    update_device_versions(merge)
+    return len(imported)
+
+class _Importer:
+    """Applies import records, batching history entries for merge_history()."""
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.batch = []
+        self.summary = {'settings': False, 'ips_added': 0, 'versions': 0, 'history_added': 0,
+                        'history_duplicates': 0, 'invalid': 0, 'complete': False, 'cancelled': False}
+
+    def settings_record(self, data):
+        if self.settings and isinstance(data, dict):
+            app_config.update(data)
+            save_config(app_config)
+            self.summary['settings'] = True
+
+    def ips_record(self, data):
+        if isinstance(data, list):
+            self.summary['ips_added'] += len(merge_ips([ip for ip in data if isinstance(ip, str)]))
+
+    def versions_record(self, data):
+        if isinstance(data, dict):
+            self.summary['versions'] += _merge_versions(data)
+
+    def history_entry(self, entry):
+        if not isinstance(entry, dict) or not isinstance(entry.get('timestamp'), str):
+            self.summary['invalid'] += 1
+            return
+        self.batch.append(entry)
+        if len(self.batch) >= HISTORY_BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.batch:
+            added, duplicates = merge_history(self.batch)
+            self.summary['history_added'] += added
+            self.summary['history_duplicates'] += duplicates
+            self.batch = []
+
+def _import_legacy(path, importer):
+    """Import the single JSON document that export_config_window() used to write."""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if not isinstance(data, dict):
+        raise ValueError("Not an OTA configuration export")
+    importer.settings_record(data.get('settings'))
+    importer.ips_record(data.get('ips'))
+    importer.versions_record(data.get('versions'))
+    for entry in data.get('history') or []:
+        importer.history_entry(entry)
+    importer.flush()
+    importer.summary['complete'] = True
+
+def import_config(path, on_progress=None, cancel=None, settings=True):
+    """Merge an export (see module docstring) into the local stores and return a summary dict.
+
+    ``on_progress(done, total)`` follows the bytes of the file consumed.
+    Setting the ``cancel`` event stops after the current batch; what was
+    merged so far stays. The summary counts added addresses, merged device
+    records, added and duplicate history entries and ``invalid`` lines, and
+    ``complete`` is False if the file ended without its ``end`` record (an
+    interrupted export). Raises ValueError for a file that is not an export.
+    """
+    importer = _Importer(settings)
+    total = os.path.getsize(path)
+    with open(path, "rb") as raw:
+        compressed = raw.read(2) == GZIP_MAGIC
+        raw.seek(0)
+        text = io.TextIOWrapper(gzip.GzipFile(fileobj=raw) if compressed else raw, encoding="utf-8")
+        first = text.readline()
+        try:
+            header = json.loads(first)
+        except ValueError:
+            header = None
+        if not isinstance(header, dict) or header.get('type') != "header":
+            if compressed or not first.lstrip().startswith("{"):
+                raise ValueError("Not an OTA configuration export")
+            text.detach()
+            _import_legacy(path, importer)
+            if on_progress:
+                on_progress(total, total)
+            return importer.summary
+        if header.get('format') != EXPORT_FORMAT or not isinstance(header.get('version'), int) \
+                or header['version'] > EXPORT_VERSION:
+            raise ValueError(f"Unsupported export format: {header.get('format')} version {header.get('version')}")
+
+        handlers = {'settings': importer.settings_record, 'ips': importer.ips_record,
+                    'versions': importer.versions_record}
+        lines = 0
+        try:
+            for line in text:
+                lines += 1
+                try:
+                    record = json.loads(line)
+                    kind = record.get('type')
+                except (ValueError, AttributeError):
+                    importer.summary['invalid'] += 1
+                    continue
+                if kind == "history":
+                    importer.history_entry(record.get('entry'))
+                elif kind in handlers:
+                    handlers[kind](record.get('data'))
+                elif kind == "end":
+                    importer.summary['complete'] = True
+                else:
+                    importer.summary['invalid'] += 1
+                if lines % HISTORY_BATCH_SIZE == 0:
+                    if cancel is not None and cancel.is_set():
+                        importer.summary['cancelled'] = True
+                        break
+                    if on_progress:
+                        on_progress(min(raw.tell(), total), total)
+        except (EOFError, gzip.BadGzipFile, UnicodeDecodeError):
+            importer.summary['invalid'] += 1  # truncated or corrupt compressed stream
+        importer.flush()
+    if on_progress:
+        on_progress(total, total)
+    return importer.summary
@@ -0,0 +1,74 @@
+"""SHA256 firmware checksums with a persistent (path, size, mtime, inode) cache."""
+import hashlib
+import os
+
+from .profiling import timed
+from .storage import DATA_DIR, JsonStore
+
+CHECKSUM_CACHE_FILE = os.path.join(DATA_DIR, "checksum_cache.json")
+
+# Checksum cache tuning
+CHECKSUM_BUFFER_SIZE = 1024 * 1024
+CHECKSUM_CACHE_MAX_ENTRIES = 256
+
+_checksum_store = JsonStore(CHECKSUM_CACHE_FILE, dict, lambda data: isinstance(data, dict))
+
+@timed("checksum.hash")
+def hash_file(file_path):
+    """Hash a file with SHA256 using a reusable 1 MiB buffer."""
+    sha256 = hashlib.sha256()
+    buf = bytearray(CHECKSUM_BUFFER_SIZE)
+    view = memoryview(buf)
+    with open(file_path, "rb", buffering=0) as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            sha256.update(view[:n])
+    return sha256.hexdigest()
+
+def _file_signature(file_path):
+    """Identity of a file's current contents: size, mtime and inode."""
+    st = os.stat(file_path)
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'inode': st.st_ino}
+
+def load_checksum_cache():
+    """Load the persistent checksum cache."""
+    return _checksum_store.load()
+
+def save_checksum_cache(cache):
+    """Save the checksum cache."""
+    _checksum_store.save(cache)
+
+def clear_checksum_cache():
+    """Forget every cached digest; the emptied cache file is written like any other change."""
+    _checksum_store.update(lambda cache: cache.clear())
+
+@timed("checksum")
+def calculate_checksum(file_path, use_cache=True):
+    """Calculate SHA256 checksum of a file.
+
+    Digests are cached in checksum_cache.json, keyed by absolute path and
+    validated against size, mtime_ns and inode, so an unchanged image is
+    only hashed once no matter how many devices it is flashed to.
+    """
+    if not use_cache:
+        return hash_file(file_path)
+
+    key = os.path.abspath(file_path)
+    signature = _file_signature(file_path)
+    entry = _checksum_store.read(lambda cache: dict(cache.get(key) or {}))
+    if entry and all(entry.get(k) == v for k, v in signature.items()):
+        return entry['sha256']
+
+    digest = hash_file(file_path)
+
+    def remember(cache):
+        cache.pop(key, None)
+        cache[key] = dict(signature, sha256=digest)
+        # Dicts keep insertion order, so the oldest entries are dropped first
+        for stale in list(cache)[:-CHECKSUM_CACHE_MAX_ENTRIES]:
+            del cache[stale]
+
+    _checksum_store.update(remember)
+    return digest
@@ -0,0 +1,456 @@
+"""Command line entry point: ``python -m ota upload|scan|discover|versions|artifacts|history|metrics|export|import|mock``.
+
+Commands import the network stack lazily, so ``versions`` and ``history``
+start without loading requests.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from .shaping import parse_rate
+
+def _print_json(data):
+    json.dump(data, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+def cmd_upload(args):
+    """Flash one file to one or more devices."""
+    from .storage import app_config
+    from .rollout import adaptive_rollout, describe_rollout
+    from .upload import DEFAULT_ROLLOUT_PARALLELISM, rollout_firmware
+
+    if not os.path.exists(args.file):
+        print(f"Firmware file not found: {args.file}", file=sys.stderr)
+        return 2
+
+    verify_checksum = args.checksum if args.checksum is not None else app_config.get('verify_checksum', True)
+
+    def on_state(ip, state, detail):
+        if not args.quiet:
+            print(f"{ip:<16} {state:<10} {detail}", file=sys.stderr)
+
+    if args.rate_limit is not None:
+        app_config['upload_rate_limit'] = args.rate_limit
+    if args.device_rate_limit is not None:
+        app_config['upload_device_rate_limit'] = args.device_rate_limit
+    options = dict(on_state=on_state, compression=args.compression, compute_checksum=verify_checksum,
+                   verify=args.verify, expected_version=args.expect_version, delta=args.delta)
+    adaptive = (args.strategy or app_config.get('rollout_strategy', 'adaptive')) == "adaptive"
+    if adaptive and len(args.ip) > 1:
+        summary = adaptive_rollout(args.ip, args.file, max_parallelism=args.parallel, canary=args.canary,
+                                   max_failure_rate=args.max_failure_rate, **options)
+    else:
+        parallelism = args.parallel or app_config.get('rollout_parallelism', DEFAULT_ROLLOUT_PARALLELISM)
+        summary = rollout_firmware(args.ip, args.file, parallelism=parallelism, **options)
+    if summary['checksum']:
+        print(f"sha256 {summary['checksum']}", file=sys.stderr)
+    verify = args.verify if args.verify is not None else app_config.get('verify_reboot', True)
+    print(describe_rollout(summary, len(args.ip), verify), file=sys.stderr)
+    if summary.get('stopped'):
+        skipped = f"; skipped {', '.join(summary['skipped'])}" if summary['skipped'] else ""
+        print(f"rollout stopped: {summary['stopped']}{skipped}", file=sys.stderr)
+    if args.json:
+        _print_json(summary)
+    ok = summary['verified'] if verify else summary['succeeded']
+    return 0 if ok == len(args.ip) else 1
+
+def cmd_scan(args):
+    """Scan the local /24, or the given CIDRs, ranges and interfaces, for devices."""
+    import threading
+
+    from .discovery import cached_scan
+    from .scan import (DEVICE_PORT, DEFAULT_SCAN_CONCURRENCY, DEFAULT_SCAN_PROBE_TIMEOUT, DEFAULT_SCAN_RATE,
+                       scan_network_for_devices)
+    from .storage import app_config, merge_ips
+
+    show_progress = sys.stderr.isatty() and not args.json
+
+    def on_found(device):
+        if not args.json:
+            if show_progress:
+                sys.stderr.write("\r\033[K")
+            _print_device(device)
+
+    def on_progress(done, total):
+        if show_progress:
+            sys.stderr.write(f"\r{done * 100 // total:3d}% of {total} hosts")
+            sys.stderr.flush()
+
+    cancel = threading.Event()
+    finished = threading.Event()
+    outcome = {}
+
+    def run():
+        scan = scan_network_for_devices if args.no_cache else cached_scan
+        options = {} if args.no_cache else {'full': args.full}
+        try:
+            outcome['devices'] = scan(
+                on_found=on_found,
+                concurrency=args.concurrency or app_config.get('scan_concurrency', DEFAULT_SCAN_CONCURRENCY),
+                probe_timeout=args.timeout or app_config.get('scan_probe_timeout', DEFAULT_SCAN_PROBE_TIMEOUT),
+                port=args.port or DEVICE_PORT,
+                targets=args.target or app_config.get('scan_targets'),
+                rate=args.rate if args.rate is not None else app_config.get('scan_rate', DEFAULT_SCAN_RATE),
+                on_progress=on_progress,
+                cancel=cancel,
+                **options,
+            )
+        except (ValueError, OSError) as e:
+            outcome['error'] = e
+        finally:
+            finished.set()
+
+    # Scan in a worker so Ctrl+C cancels it cleanly and still reports what was found
+    start = time.monotonic()
+    threading.Thread(target=run, daemon=True).start()
+    try:
+        while not finished.wait(0.2):
+            pass
+    except KeyboardInterrupt:
+        cancel.set()
+        finished.wait()
+    if 'error' in outcome:
+        print(outcome['error'], file=sys.stderr)
+        return 2
+    devices = outcome['devices']
+    if show_progress:
+        sys.stderr.write("\r\033[K")
+    if args.json:
+        _print_json(devices)
+    print(f"Found {len(devices)} device(s) in {time.monotonic() - start:.1f}s"
+          + (" (cancelled)" if cancel.is_set() else ""), file=sys.stderr)
+    if args.save:
+        added = merge_ips([device['ip'] for device in devices])
+        print(f"Saved {len(added)} new device(s) to ips.json", file=sys.stderr)
+    return 0
+
+def cmd_versions(args):
+    """Show cached device versions, optionally refreshing them first."""
+    from .storage import load_device_versions, load_ips
+
+    if args.refresh:
+        from concurrent.futures import ThreadPoolExecutor
+        from .device import refresh_device_version
+
+        targets = args.ip or load_ips()
+        with ThreadPoolExecutor(max_workers=max(1, min(32, len(targets) or 1))) as pool:
+            list(pool.map(refresh_device_version, targets))
+
+    versions = load_device_versions()
+    if args.ip:
+        versions = {ip: versions[ip] for ip in args.ip if ip in versions}
+    if args.json:
+        _print_json(versions)
+        return 0
+    for ip, data in versions.items():
+        print(f"{ip:<16} {data.get('name', 'ESP32'):<16} {data.get('version', 'Unknown'):<10} {data.get('checked', '')}"
+              + (f"  {data['image_name']} ({data['image_sha256'][:12]})" if data.get('image_sha256') else ""))
+    return 0
+
+def cmd_artifacts(args):
+    """List the firmware artifact store, optionally adding images to it first."""
+    from .artifacts import list_artifacts, store_artifact
+    from .storage import load_device_versions
+
+    for path in args.add or []:
+        if not os.path.exists(path):
+            print(f"Firmware file not found: {path}", file=sys.stderr)
+            return 2
+        entry = store_artifact(path)
+        print(f"stored {entry['sha256'][:12]} {entry['name']}", file=sys.stderr)
+
+    running = {}
+    for ip, data in load_device_versions().items():
+        running.setdefault(data.get('image_sha256'), []).append(ip)
+    artifacts = [dict(entry, devices=running.get(entry['sha256'], [])) for entry in list_artifacts()]
+    if args.json:
+        _print_json(artifacts)
+        return 0
+    for entry in artifacts:
+        print(f"{entry['sha256'][:12]}  {entry['name']:<24} {entry['size'] / 1024:8.1f} KB  {entry['used'][:19]}"
+              + (f"  {', '.join(entry['devices'])}" if entry['devices'] else ""))
+    return 0
+
+def _progress_printer(args, unit):
+    """on_progress callback that rewrites one stderr line, at most a few times per second."""
+    last = [0.0, None]
+
+    def on_progress(done, total):
+        now = time.monotonic()
+        if args.quiet or done == last[1] or (now - last[0] < 0.2 and done < total):
+            return
+        last[:] = [now, done]
+        print(f"\r{done}/{total} {unit}", end="\n" if done >= total else "", file=sys.stderr, flush=True)
+
+    return on_progress
+
+def cmd_export(args):
+    """Write settings, saved devices, device versions and history as (gzipped) JSON Lines."""
+    from .backup import export_config
+
+    summary = export_config(args.output, on_progress=_progress_printer(args, "history entries"))
+    if args.json:
+        _print_json(summary)
+    else:
+        print(f"exported {summary['history']} history entries to {args.output} ({summary['bytes'] / 1024:.0f} KB)",
+              file=sys.stderr)
+    return 0
+
+def cmd_import(args):
+    """Merge an export into the local stores."""
+    from .backup import import_config
+
+    if not os.path.exists(args.input):
+        print(f"Export file not found: {args.input}", file=sys.stderr)
+        return 2
+    try:
+        summary = import_config(args.input, on_progress=_progress_printer(args, "bytes"), settings=args.settings)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    if args.json:
+        _print_json(summary)
+    else:
+        print(f"{summary['history_added']} history entries added, {summary['history_duplicates']} already present, "
+              f"{summary['ips_added']} new device(s), {summary['versions']} device record(s) merged"
+              + (", settings applied" if summary['settings'] else ""), file=sys.stderr)
+    if summary['invalid'] or not summary['complete']:
+        print(f"warning: {summary['invalid']} unreadable line(s)"
+              + ("; the file ends early (interrupted export?)" if not summary['complete'] else ""), file=sys.stderr)
+        return 1
+    return 0
+
+def cmd_history(args):
+    """Print the most recent (or filtered and sorted) upload history entries."""
+    from .history import HISTORY_FILTERS, query_history
+
+    filters = {key: getattr(args, key) for key in HISTORY_FILTERS}
+    history = query_history(limit=args.limit, offset=args.offset, filters=filters, sort=args.sort,
+                            descending=not args.ascending)
+    if args.json:
+        _print_json(history)
+        return 0
+    for entry in history:
+        icon = "OK " if entry.get('status') == "success" else "ERR"
+        print(f"{icon} [{entry.get('timestamp')}] {entry.get('ip')} - {entry.get('file')}"
+              + (f"  ({entry['error']})" if entry.get('error') else ""))
+    return 0
+
+def cmd_metrics(args):
+    """Export phase latency percentiles from the stored spans."""
+    from .history import query_spans
+    from .metrics import collect_metrics, format_prometheus, write_metrics
+
+    if args.raw:
+        _print_json(query_spans(kind=args.kind))
+        return 0
+    fmt = "json" if args.json else args.format
+    metrics = collect_metrics(since_hours=args.since, kind=args.kind)
+    if args.output:
+        write_metrics(args.output, metrics, fmt)
+        print(f"{metrics['spans']} spans summarised into {args.output}", file=sys.stderr)
+    elif fmt == "json":
+        _print_json(metrics)
+    else:
+        sys.stdout.write(format_prometheus(metrics))
+    return 0
+
+def _print_device(device):
+    info = device['info'] or {}
+    print(f"{device['ip']:<16} {info.get('name', 'Unknown'):<16} {info.get('version', '')}")
+
+def cmd_discover(args):
+    """Find devices by mDNS (``_ota._tcp``) instead of sweeping the subnet."""
+    from .discovery import remember_devices
+    from .mdns import MDNS_DISCOVERY_TIMEOUT, MdnsBrowser, discover_devices
+    from .storage import app_config
+
+    interfaces = args.interface or app_config.get('mdns_interfaces')
+    if args.watch:
+        def on_change(changes):
+            for instance, device in changes.items():
+                if args.json:
+                    _print_json({'instance': instance, 'device': device})
+                elif device:
+                    _print_device(device)
+                else:
+                    print(f"{'-':<16} {instance} left")
+            sys.stdout.flush()
+
+        browser = MdnsBrowser(on_change=on_change, interfaces=interfaces).start()
+        print("Watching for mDNS announcements; Ctrl+C to stop", file=sys.stderr)
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            browser.stop()
+        return 0
+
+    start = time.monotonic()
+    devices = discover_devices(
+        timeout=args.timeout or app_config.get('mdns_timeout', MDNS_DISCOVERY_TIMEOUT),
+        interfaces=interfaces,
+        on_found=None if args.json else _print_device,
+    )
+    remember_devices(devices, source="mdns")
+    if args.json:
+        _print_json(devices)
+    print(f"Found {len(devices)} device(s) in {time.monotonic() - start:.1f}s", file=sys.stderr)
+    return 0
+
+def cmd_mock(args):
+    """Serve a fleet of mock ESP32 devices until interrupted."""
+    from .mock import MockFleet
+
+    fleet = MockFleet(
+        args.devices, first_host=args.first_host, port=args.port,
+        shared_bandwidth=parse_rate(args.shared_bandwidth) if args.shared_bandwidth else 0,
+        latency=args.latency, bandwidth=parse_rate(args.bandwidth) if args.bandwidth else 0,
+        fail_status=args.fail_status, fail_rate=args.fail_rate, reset_rate=args.reset_rate,
+        reboot_seconds=args.reboot, version_after_update=args.version_after_update, mdns=args.mdns,
+    ).start()
+    if args.json:
+        _print_json(fleet.addresses)
+    else:
+        for address in fleet.addresses:
+            print(address)
+    print(f"Serving {len(fleet.devices)} mock device(s); Ctrl+C to stop", file=sys.stderr)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fleet.stop()
+    return 0
+
+def build_parser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--json", action="store_true", help="machine readable output on stdout")
+    common.add_argument("--profile", nargs="?", const="timers", choices=("off", "timers", "cprofile", "memory", "full"),
+                        help="write a profile report per upload, scan or rollout (default mode: timers; "
+                             "see the profiling setting)")
+    parser = argparse.ArgumentParser(prog="ota", description="ESP32 OTA uploader (headless)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("upload", parents=[common], help="upload a firmware image to one or more devices")
+    p.add_argument("--ip", action="append", required=True, help="device IP (repeat for several devices)")
+    p.add_argument("--file", required=True, help="firmware .bin")
+    p.add_argument("--parallel", type=int, help="concurrent uploads (the upper bound with --adaptive)")
+    p.add_argument("--adaptive", dest="strategy", action="store_const", const="adaptive", default=None,
+                   help="canary wave, then AIMD concurrency (default: rollout_strategy setting)")
+    p.add_argument("--fixed", dest="strategy", action="store_const", const="fixed",
+                   help="always run --parallel uploads at once")
+    p.add_argument("--canary", type=int, help="devices in the canary wave (adaptive)")
+    p.add_argument("--max-failure-rate", type=float, help="stop once this fraction of devices failed (adaptive)")
+    p.add_argument("--checksum", dest="checksum", action="store_true", default=None, help="record SHA256 (default: verify_checksum setting)")
+    p.add_argument("--no-checksum", dest="checksum", action="store_false")
+    p.add_argument("--compress", dest="compression", action="store_const", const="auto", default=None,
+                   help="gzip the image for devices that support it (default: compression setting)")
+    p.add_argument("--no-compress", dest="compression", action="store_const", const="off")
+    p.add_argument("--delta", dest="delta", action="store_const", const="auto", default=None,
+                   help="send a delta against the device's running image when possible (default: delta_uploads setting)")
+    p.add_argument("--no-delta", dest="delta", action="store_const", const="off")
+    p.add_argument("--rate-limit", type=parse_rate, help="cap for all uploads together, e.g. 500k or 2M bytes/s "
+                   "(default: upload_rate_limit setting)")
+    p.add_argument("--device-rate-limit", type=parse_rate, help="cap for each device (default: upload_device_rate_limit)")
+    p.add_argument("--verify", dest="verify", action="store_true", default=None,
+                   help="wait for each device to reboot and check its version (default: verify_reboot setting)")
+    p.add_argument("--no-verify", dest="verify", action="store_false")
+    p.add_argument("--expect-version", help="fail verification unless devices report this version")
+    p.add_argument("-q", "--quiet", action="store_true", help="do not print per-device state changes")
+    p.set_defaults(func=cmd_upload)
+
+    p = sub.add_parser("scan", parents=[common], help="scan the local network for devices")
+    p.add_argument("--target", action="append",
+                   help="CIDR, a.b.c.d-e.f.g.h range, address or interface name (repeat; default: local /24)")
+    p.add_argument("--rate", type=float, help="new probes per second, 0 for no limit")
+    p.add_argument("--save", action="store_true", help="add found devices to ips.json")
+    p.add_argument("--full", action="store_true", help="sweep every target even if swept recently")
+    p.add_argument("--no-cache", action="store_true", help="ignore and do not update the discovery cache")
+    p.add_argument("--concurrency", type=int, help="hosts probed in parallel")
+    p.add_argument("--timeout", type=float, help="TCP pre-probe timeout in seconds")
+    p.add_argument("--port", type=int, help="device HTTP port (default 80)")
+    p.set_defaults(func=cmd_scan)
+
+    p = sub.add_parser("discover", parents=[common], help="find devices that advertise _ota._tcp over mDNS")
+    p.add_argument("--timeout", type=float, help="seconds to collect answers (default 1)")
+    p.add_argument("--interface", action="append", help="local IPv4 address to query from (repeat; default: all)")
+    p.add_argument("--watch", action="store_true", help="keep listening and print devices as they come and go")
+    p.set_defaults(func=cmd_discover)
+
+    p = sub.add_parser("versions", parents=[common], help="show cached device versions")
+    p.add_argument("--ip", action="append", help="limit to these IPs")
+    p.add_argument("--refresh", action="store_true", help="query /info before printing")
+    p.set_defaults(func=cmd_versions)
+
+    p = sub.add_parser("artifacts", parents=[common], help="list stored firmware images and the devices running them")
+    p.add_argument("--add", action="append", help="store this image first, e.g. the one devices already run (repeat)")
+    p.set_defaults(func=cmd_artifacts)
+
+    p = sub.add_parser("history", parents=[common], help="show recent upload history")
+    p.add_argument("--limit", type=int, default=20)
+    p.add_argument("--offset", type=int, default=0, help="skip this many matching entries")
+    p.add_argument("--ip", help="device address, or a prefix such as 192.168.2.")
+    p.add_argument("--status", choices=["success", "failed"])
+    p.add_argument("--file", help="substring of the firmware file name")
+    p.add_argument("--checksum", help="SHA256 prefix")
+    p.add_argument("--since", help="ISO date or timestamp (inclusive)")
+    p.add_argument("--until", help="ISO date or timestamp (inclusive)")
+    p.add_argument("--sort", choices=["timestamp", "ip", "status", "file"], default="timestamp")
+    p.add_argument("--ascending", action="store_true", help="oldest (or A-Z) first")
+    p.set_defaults(func=cmd_history)
+
+    p = sub.add_parser("metrics", parents=[common], help="export per-phase latency metrics")
+    p.add_argument("--format", choices=["prom", "json"], default="prom", help="Prometheus text (default) or JSON")
+    p.add_argument("--output", help="write to this file atomically instead of stdout")
+    p.add_argument("--since", type=float, help="only spans from the last N hours")
+    p.add_argument("--kind", choices=["upload", "scan", "version"], help="only this kind of span")
+    p.add_argument("--raw", action="store_true", help="dump the stored spans as JSON")
+    p.set_defaults(func=cmd_metrics)
+
+    p = sub.add_parser("export", parents=[common], help="export settings, devices and history (streamed JSON Lines)")
+    p.add_argument("output", help="file to write; gzip-compressed if it ends in .gz, e.g. station1.jsonl.gz")
+    p.add_argument("-q", "--quiet", action="store_true", help="do not print progress")
+    p.set_defaults(func=cmd_export)
+
+    p = sub.add_parser("import", parents=[common], help="merge an export into this station's settings, devices and history")
+    p.add_argument("input", help="export file (.jsonl, .jsonl.gz, or an older .json export)")
+    p.add_argument("--no-settings", dest="settings", action="store_false", help="keep this station's settings")
+    p.add_argument("-q", "--quiet", action="store_true", help="do not print progress")
+    p.set_defaults(func=cmd_import)
+
+    p = sub.add_parser("mock", parents=[common], help="serve mock ESP32 devices for testing")
+    p.add_argument("--devices", type=int, default=5)
+    p.add_argument("--first-host", default="127.0.0.10", help="address of the first device (Linux)")
+    p.add_argument("--port", type=int, default=8080)
+    p.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    p.add_argument("--bandwidth", help="per-device upload cap, e.g. 200k or 1M (bytes/s)")
+    p.add_argument("--shared-bandwidth", help="cap shared by all devices, like one access point")
+    p.add_argument("--fail-status", type=int, choices=sorted([400, 413, 500]), help="fail every upload with this status")
+    p.add_argument("--fail-rate", type=float, default=0.0, help="fraction of uploads answered with HTTP 500")
+    p.add_argument("--reset-rate", type=float, default=0.0, help="fraction of uploads reset halfway through")
+    p.add_argument("--reboot", type=float, default=0.0, help="seconds offline after a successful update")
+    p.add_argument("--version-after-update", help="version reported after a successful update")
+    p.add_argument("--mdns", action="store_true", help="answer mDNS queries for _ota._tcp on 127.0.0.1")
+    p.set_defaults(func=cmd_mock)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.profile:
+        from .profiling import set_profiling_override
+
+        set_profiling_override(args.profile)
+    try:
+        return args.func(args)
+    finally:
+        if args.profile:
+            from .profiling import recent_reports
+
+            for path in recent_reports():
+                print(f"profile: {path}", file=sys.stderr)
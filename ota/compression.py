@@ -0,0 +1,59 @@
+"""Gzip-compressed OTA images, cached by content and negotiated via /info caps."""
+import gzip
+import os
+import shutil
+import threading
+
+from .checksum import calculate_checksum
+from .profiling import timed
+from .storage import DATA_DIR
+
+COMPRESSION_CACHE_DIR = os.path.join(DATA_DIR, "firmware_cache")
+COMPRESSION_LEVEL = 9
+# Send the raw image unless gzip saves at least this fraction of the bytes
+MIN_COMPRESSION_SAVING = 0.05
+
+_compression_lock = threading.Lock()
+
+def device_capabilities(info):
+    """Set of optional features a device advertises in /info ``caps`` (empty for old sketches)."""
+    caps = (info or {}).get('caps') or []
+    return set(caps) if isinstance(caps, list) else set()
+
+@timed("compress.gzip")
+def gzip_file(src_path, out_path):
+    """Write a gzip copy of ``src_path`` to ``out_path`` unless it already exists; returns out_path.
+
+    The gzip header carries no file name or timestamp, so the sketch only has
+    to skip the fixed 10-byte header before inflating.
+    """
+    with _compression_lock:
+        if os.path.exists(out_path):
+            return out_path
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        tmp_path = out_path + ".tmp"
+        with open(src_path, "rb") as src, open(tmp_path, "wb") as raw:
+            with gzip.GzipFile(filename="", mode="wb", fileobj=raw, compresslevel=COMPRESSION_LEVEL, mtime=0) as gz:
+                shutil.copyfileobj(src, gz, 1024 * 1024)
+        os.replace(tmp_path, out_path)
+    return out_path
+
+def gzip_image(file_path, checksum=None):
+    """Path of a gzip copy of the image, created once per content digest."""
+    checksum = checksum or calculate_checksum(file_path)
+    return gzip_file(file_path, os.path.join(COMPRESSION_CACHE_DIR, f"{checksum}.bin.gz"))
+
+def choose_upload_image(file_path, info, mode="auto", checksum=None):
+    """Return ``(path, encoding)`` to send to a device.
+
+    With mode ``auto`` the cached gzip copy is used when the device lists
+    ``gzip`` in its caps and compression saves at least
+    MIN_COMPRESSION_SAVING; otherwise (or with mode ``off``) the raw image is
+    sent with encoding None.
+    """
+    if mode == "off" or "gzip" not in device_capabilities(info):
+        return file_path, None
+    gz_path = gzip_image(file_path, checksum)
+    if os.path.getsize(gz_path) > os.path.getsize(file_path) * (1 - MIN_COMPRESSION_SAVING):
+        return file_path, None
+    return gz_path, "gzip"
@@ -0,0 +1,214 @@
+"""Binary delta images against the firmware a device is already running.
+
+A delta is a 48-byte header followed by ops the sketch replays while it
+writes the new image:
+
+  header  "OTAD", version, 3 reserved bytes, base size (u32), base MD5,
+          target size (u32), target MD5
+  COPY    0x01, base offset (u32), length (u32) - bytes from the running partition
+  INSERT  0x02, length (u32), then that many literal bytes
+  END     0x00
+
+Integers are little-endian. The sketch refuses a delta whose base size and
+MD5 differ from its running image and verifies the target MD5 before
+switching partitions. Deltas are sent with encoding ``delta`` (or
+``delta-gzip`` for a gzipped delta, inflated first).
+"""
+import hashlib
+import os
+import struct
+import threading
+
+from .artifacts import find_artifact
+from .checksum import calculate_checksum
+from .compression import COMPRESSION_CACHE_DIR, device_capabilities, gzip_file
+from .profiling import timed
+
+DELTA_MAGIC = b"OTAD"
+DELTA_VERSION = 1
+DELTA_HEADER = struct.Struct("<4sB3xI16sI16s")
+DELTA_END = 0x00
+DELTA_COPY = 0x01
+DELTA_INSERT = 0x02
+_COPY = struct.Struct("<BII")
+_INSERT = struct.Struct("<BI")
+
+# Delta tuning: base blocks are indexed every DELTA_BLOCK_SIZE bytes, and a
+# delta is only sent if it is at least DELTA_MIN_SAVING smaller than the
+# best full image (raw or gzip)
+DELTA_BLOCK_SIZE = 16
+DELTA_MIN_SAVING = 0.1
+
+_delta_lock = threading.Lock()
+
+class DeltaError(ValueError):
+    """Malformed delta, or one made against a different base image."""
+
+@timed("delta.make")
+def make_delta(base, target, block_size=DELTA_BLOCK_SIZE):
+    """Encode ``target`` (bytes) as COPY/INSERT ops against ``base``.
+
+    Every aligned ``block_size`` block of the base is indexed; the target is
+    scanned byte by byte for those blocks and each hit is extended in both
+    directions, so shifted code and data are found at any offset.
+    """
+    index = {}
+    for offset in range(0, len(base) - block_size + 1, block_size):
+        index.setdefault(base[offset:offset + block_size], offset)
+
+    out = bytearray(DELTA_HEADER.pack(DELTA_MAGIC, DELTA_VERSION, len(base), hashlib.md5(base).digest(),
+                                      len(target), hashlib.md5(target).digest()))
+    pending = 0  # first target byte not covered by an op yet
+    pos = 0
+    last = len(target) - block_size
+    while pos <= last:
+        offset = index.get(target[pos:pos + block_size])
+        if offset is None:
+            pos += 1
+            continue
+        start, base_start = pos, offset
+        while start > pending and base_start > 0 and target[start - 1] == base[base_start - 1]:
+            start -= 1
+            base_start -= 1
+        stop, base_stop = pos + block_size, offset + block_size
+        for step in (4096, 256, 16, 1):
+            while (stop + step <= len(target) and base_stop + step <= len(base)
+                   and target[stop:stop + step] == base[base_stop:base_stop + step]):
+                stop += step
+                base_stop += step
+        if start > pending:
+            out += _INSERT.pack(DELTA_INSERT, start - pending) + target[pending:start]
+        out += _COPY.pack(DELTA_COPY, base_start, stop - start)
+        pending = pos = stop
+    if pending < len(target):
+        out += _INSERT.pack(DELTA_INSERT, len(target) - pending) + target[pending:]
+    out.append(DELTA_END)
+    return bytes(out)
+
+class DeltaDecoder:
+    """Streaming patcher: feed() delta bytes, get the target bytes they produce.
+
+    Works the way the sketch does, so ota.mock can apply deltas too. Raises
+    DeltaError for a malformed stream or a delta against another base.
+    """
+
+    def __init__(self, base):
+        self.base = base
+        self.header = None
+        self.done = False
+        self._buf = bytearray()
+        self._insert = 0  # literal bytes still to come for the current INSERT
+        self._md5 = hashlib.md5()
+        self._size = 0
+
+    def feed(self, data):
+        self._buf += data
+        buf, pos, out = self._buf, 0, bytearray()
+        while pos < len(buf):
+            if self.header is None:
+                if len(buf) < DELTA_HEADER.size:
+                    break
+                self._read_header(bytes(buf[:DELTA_HEADER.size]))
+                pos = DELTA_HEADER.size
+            elif self.done:
+                raise DeltaError("Data after the end of the delta")
+            elif self._insert:
+                n = min(self._insert, len(buf) - pos)
+                out += buf[pos:pos + n]
+                self._insert -= n
+                pos += n
+            elif buf[pos] == DELTA_END:
+                self.done = True
+                pos += 1
+            elif buf[pos] == DELTA_INSERT:
+                if len(buf) - pos < _INSERT.size:
+                    break
+                self._insert = _INSERT.unpack_from(buf, pos)[1]
+                pos += _INSERT.size
+            elif buf[pos] == DELTA_COPY:
+                if len(buf) - pos < _COPY.size:
+                    break
+                _, offset, length = _COPY.unpack_from(buf, pos)
+                if offset + length > len(self.base):
+                    raise DeltaError("COPY beyond the end of the base image")
+                out += self.base[offset:offset + length]
+                pos += _COPY.size
+            else:
+                raise DeltaError(f"Unknown delta op 0x{buf[pos]:02x}")
+        del buf[:pos]
+        self._md5.update(out)
+        self._size += len(out)
+        return bytes(out)
+
+    def _read_header(self, data):
+        magic, version, base_size, base_md5, target_size, target_md5 = DELTA_HEADER.unpack(data)
+        if magic != DELTA_MAGIC or version != DELTA_VERSION:
+            raise DeltaError("Not a delta image")
+        if base_size != len(self.base) or base_md5 != hashlib.md5(self.base).digest():
+            raise DeltaError("Delta was made against a different base image")
+        self.header = {'base_size': base_size, 'target_size': target_size, 'target_md5': target_md5}
+
+    def finish(self):
+        """True if the delta ended and produced exactly the target image."""
+        return (self.done and not self._buf and self._size == self.header['target_size']
+                and self._md5.digest() == self.header['target_md5'])
+
+def apply_delta(base, delta):
+    """Return the target image a delta produces from ``base``; raises DeltaError."""
+    decoder = DeltaDecoder(base)
+    target = decoder.feed(delta)
+    if not decoder.finish():
+        raise DeltaError("Delta is truncated or does not reproduce the target image")
+    return target
+
+def delta_image(base_path, target_path, base_sha256, target_sha256):
+    """Path of a cached delta from one image to another, created once per digest pair.
+
+    The delta is applied back to the base before it is cached, so a bad
+    encoding raises DeltaError here instead of reaching a device.
+    """
+    out_path = os.path.join(COMPRESSION_CACHE_DIR, f"{target_sha256}.from-{base_sha256[:16]}.delta")
+    with _delta_lock:
+        if os.path.exists(out_path):
+            return out_path
+        with open(base_path, "rb") as f:
+            base = f.read()
+        with open(target_path, "rb") as f:
+            target = f.read()
+        delta = make_delta(base, target)
+        if apply_delta(base, delta) != target:
+            raise DeltaError("Delta does not reproduce the target image")
+        os.makedirs(COMPRESSION_CACHE_DIR, exist_ok=True)
+        tmp_path = out_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(delta)
+        os.replace(tmp_path, out_path)
+    return out_path
+
+def choose_delta_image(file_path, info, checksum=None, compress=True, limit=None):
+    """Return ``(path, encoding)`` for a delta upload, or None to send a full image.
+
+    A delta needs a device that lists ``delta`` in its caps and reports the
+    ``sketch_md5`` of its running image, and that image in the artifact
+    store (see ota.artifacts). With ``compress`` and the ``gzip`` cap the
+    gzipped delta is used when it is smaller. The result must undercut
+    ``limit`` (the size of the full image that would be sent otherwise) by
+    DELTA_MIN_SAVING.
+    """
+    caps = device_capabilities(info)
+    md5 = (info or {}).get('sketch_md5')
+    if "delta" not in caps or not md5:
+        return None
+    base = find_artifact(md5=md5)
+    if base is None or base['size'] != info.get('sketch_size', base['size']):
+        return None
+    checksum = checksum or calculate_checksum(file_path)
+    delta_path = delta_image(base['path'], file_path, base['sha256'], checksum)
+    candidates = [(delta_path, "delta")]
+    if compress and "gzip" in caps:
+        candidates.append((gzip_file(delta_path, delta_path + ".gz"), "delta-gzip"))
+    path, encoding = min(candidates, key=lambda candidate: os.path.getsize(candidate[0]))
+    limit = limit if limit is not None else os.path.getsize(file_path)
+    if os.path.getsize(path) > limit * (1 - DELTA_MIN_SAVING):
+        return None
+    return path, encoding
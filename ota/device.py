@@ -0,0 +1,200 @@
+"""HTTP access to ESP32 devices over a shared, pooled keep-alive session."""
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool
+from urllib3.util.retry import Retry
+
+from .artifacts import find_artifact
+from .history import record_spans
+from .profiling import hot_path
+from .storage import app_config, update_device_versions
+
+# HTTP session tuning (overridable via app_config.json)
+HTTP_CONNECT_TIMEOUT = 3
+HTTP_READ_TIMEOUT = 5
+HTTP_RETRIES = 2
+HTTP_RETRY_BACKOFF = 0.3
+HTTP_POOL_HOSTS = 64
+HTTP_POOL_SIZE = 4
+HTTP_LATENCY_SAMPLES = 1000
+
+_session = None
+_session_lock = threading.Lock()
+
+class HttpStats:
+    """Thread-safe request latency and connection reuse counters for the shared session."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.errors = 0
+            self.connections = 0
+            self.latencies = deque(maxlen=HTTP_LATENCY_SAMPLES)
+            self.per_host = {}
+
+    def record_connection(self):
+        with self._lock:
+            self.connections += 1
+
+    def record_request(self, host, seconds, ok):
+        with self._lock:
+            self.requests += 1
+            if not ok:
+                self.errors += 1
+            self.latencies.append(seconds)
+            host_stats = self.per_host.setdefault(host, {'requests': 0, 'total': 0.0, 'max': 0.0})
+            host_stats['requests'] += 1
+            host_stats['total'] += seconds
+            host_stats['max'] = max(host_stats['max'], seconds)
+
+    def snapshot(self):
+        """Return a dict of counters, reuse rate and latency percentiles (seconds)."""
+        with self._lock:
+            latencies = sorted(self.latencies)
+            requests_made = self.requests
+
+            def percentile(p):
+                return latencies[min(len(latencies) - 1, int(p * len(latencies)))] if latencies else 0.0
+
+            return {
+                'requests': requests_made,
+                'errors': self.errors,
+                'connections': self.connections,
+                'reuse_rate': max(0.0, 1 - self.connections / requests_made) if requests_made else 0.0,
+                'latency_avg': sum(latencies) / len(latencies) if latencies else 0.0,
+                'latency_p50': percentile(0.50),
+                'latency_p95': percentile(0.95),
+                'per_host': {host: dict(v) for host, v in self.per_host.items()},
+            }
+
+    def describe(self):
+        """One-line summary, e.g. for progress_label."""
+        snap = self.snapshot()
+        return (f"HTTP: {snap['requests']} req • {snap['reuse_rate'] * 100:.0f}% conn reuse • "
+                f"p50 {snap['latency_p50'] * 1000:.0f} ms • p95 {snap['latency_p95'] * 1000:.0f} ms")
+
+http_stats = HttpStats()
+
+class _CountingHTTPConnectionPool(HTTPConnectionPool):
+    """Connection pool that counts every new TCP connection it opens."""
+
+    def _new_conn(self):
+        http_stats.record_connection()
+        return super()._new_conn()
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose per-host pools report new connections to http_stats."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = dict(self.poolmanager.pool_classes_by_scheme,
+                                                       http=_CountingHTTPConnectionPool)
+
+def get_session():
+    """Return the shared keep-alive session used for all device calls.
+
+    One HTTPAdapter keeps a connection pool per device, so /status, /info
+    and uploads to the same host reuse sockets. Idempotent requests are
+    retried with exponential backoff; uploads are never retried here.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            retries = Retry(
+                total=app_config.get('http_retries', HTTP_RETRIES),
+                backoff_factor=HTTP_RETRY_BACKOFF,
+                status_forcelist=(502, 503, 504),
+                allowed_methods=frozenset(['GET', 'HEAD']),
+                raise_on_status=False,
+            )
+            adapter = PooledHTTPAdapter(pool_connections=HTTP_POOL_HOSTS, pool_maxsize=HTTP_POOL_SIZE, max_retries=retries)
+            session = requests.Session()
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+def http_timeout(read_timeout=None):
+    """(connect, read) timeout tuple from app_config with module defaults."""
+    return (app_config.get('http_connect_timeout', HTTP_CONNECT_TIMEOUT),
+            read_timeout if read_timeout is not None else app_config.get('http_read_timeout', HTTP_READ_TIMEOUT))
+
+def http_request(method, url, timeout=None, **kwargs):
+    """Send a request on the shared session and record its latency."""
+    host = urlsplit(url).netloc
+    start = time.perf_counter()
+    try:
+        with hot_path("http." + method.lower()):
+            r = get_session().request(method, url, timeout=timeout or http_timeout(), **kwargs)
+    except Exception:
+        http_stats.record_request(host, time.perf_counter() - start, ok=False)
+        raise
+    http_stats.record_request(host, time.perf_counter() - start, ok=True)
+    return r
+
+def check_device_online(ip):
+    """Check if device is online via status endpoint."""
+    try:
+        r = http_request("GET", f"http://{ip}/status", timeout=http_timeout(3))
+        return r.status_code == 200
+    except Exception:
+        return False
+
+def get_device_info(ip):
+    """Get device info (version, name, etc.)."""
+    try:
+        r = http_request("GET", f"http://{ip}/info")
+        if r.status_code == 200:
+            return r.json()
+    except Exception:
+        pass
+    return None
+
+def record_device_info(ip, info, **extra):
+    """Record a device's name and version from an /info response in device_versions.json.
+
+    ``extra`` fields (e.g. the last update's reboot time) are stored too and
+    kept by later refreshes. When the sketch reports ``sketch_md5`` the
+    running image is looked up in the artifact store and its digest stored
+    as ``image_sha256`` (None for an image that was never uploaded from here).
+    """
+    md5 = info.get('sketch_md5')
+    if md5:
+        artifact = find_artifact(md5=md5)
+        extra = dict({'image_md5': md5, 'image_sha256': artifact['sha256'] if artifact else None,
+                      'image_name': artifact['name'] if artifact else None}, **extra)
+    fields = dict({'version': info.get('version', 'Unknown'), 'name': info.get('name', 'ESP32'),
+                   'checked': datetime.now().isoformat()}, **extra)
+    update_device_versions(lambda versions: versions.setdefault(ip, {}).update(fields))
+
+def record_device_image(ip, artifact):
+    """Record the artifact (see ota.artifacts.store_artifact) a device was just flashed with.
+
+    Used for sketches that do not report ``sketch_md5``; the version and
+    ``checked`` time are left to the next /info refresh.
+    """
+    fields = {'image_sha256': artifact['sha256'], 'image_md5': artifact['md5'], 'image_name': artifact['name'],
+              'flashed': datetime.now().isoformat()}
+    update_device_versions(lambda versions: versions.setdefault(ip, {}).update(fields))
+
+def refresh_device_version(ip):
+    """Query /info and record the device's name and version in device_versions.json.
+
+    The request time is stored as a ``version`` span. Returns the info dict,
+    or None if the device did not answer.
+    """
+    start = time.monotonic()
+    info = get_device_info(ip)
+    record_spans("version", [(ip, "info", time.monotonic() - start, info is not None)])
+    if info:
+        record_device_info(ip, info)
+    return info
@@ -0,0 +1,204 @@
+"""Persistent discovery cache, so repeat scans start from what is already known.
+
+Every device found by a scan or an mDNS query is remembered in
+discovery_cache.json with the time it was last seen. cached_scan() then
+works outward from the most likely hosts:
+  1. devices seen within ``discovery_ttl`` are reported straight from the cache
+  2. older cached devices are re-probed first
+  3. hosts in the system ARP/neighbour table are probed next
+  4. the rest of the plan is swept only if those targets have not been fully
+     swept within ``discovery_sweep_ttl``, or when a full sweep is forced
+Devices that miss DISCOVERY_MAX_MISSES re-probes in a row are forgotten.
+"""
+import ipaddress
+import os
+import re
+import socket
+import subprocess
+import sys
+import time
+
+from .profiling import profiled, timed
+from .scan import DEVICE_PORT, SCAN_MAX_HOSTS, device_address, plan_scan_targets, sweep_hosts
+from .storage import DATA_DIR, JsonStore, app_config
+
+DISCOVERY_CACHE_FILE = os.path.join(DATA_DIR, "discovery_cache.json")
+ARP_TABLE_FILE = "/proc/net/arp"
+
+# Discovery cache tuning (overridable via app_config.json)
+DISCOVERY_TTL = 300
+DISCOVERY_SWEEP_TTL = 3600
+DISCOVERY_MAX_MISSES = 3
+DISCOVERY_CACHE_MAX_ENTRIES = 4096
+
+_cache_store = JsonStore(DISCOVERY_CACHE_FILE, lambda: {'devices': {}, 'sweeps': {}},
+                         lambda data: isinstance(data, dict) and isinstance(data.get('devices'), dict)
+                         and isinstance(data.get('sweeps'), dict))
+
+def load_discovery_cache():
+    """Load the discovery cache: ``{'devices': {address: entry}, 'sweeps': {plan: time}}``."""
+    return _cache_store.load()
+
+def _trim(cache):
+    devices = cache['devices']
+    if len(devices) > DISCOVERY_CACHE_MAX_ENTRIES:
+        keep = sorted(devices, key=lambda address: devices[address]['seen'])[-DISCOVERY_CACHE_MAX_ENTRIES:]
+        cache['devices'] = {address: devices[address] for address in keep}
+
+def save_discovery_cache(cache):
+    """Save the discovery cache, keeping the most recently seen entries."""
+    _trim(cache)
+    _cache_store.save(cache)
+
+def _sort_key(device):
+    return socket.inet_aton(device['ip'].split(":")[0])
+
+def remember_devices(devices, source="scan"):
+    """Record found devices (scan or mDNS results) as seen now."""
+    if not devices:
+        return
+    now = time.time()
+
+    def remember(cache):
+        for device in devices:
+            previous = cache['devices'].get(device['ip'], {})
+            cache['devices'][device['ip']] = {
+                'info': device.get('info') or previous.get('info'),
+                'source': device.get('source', source),
+                'seen': now,
+                'misses': 0,
+            }
+        _trim(cache)
+
+    _cache_store.update(remember)
+
+def forget_devices(addresses):
+    """Drop devices from the cache, e.g. when the user removes them from the sidebar."""
+    def forget(cache):
+        for address in addresses:
+            cache['devices'].pop(address, None)
+
+    _cache_store.update(forget)
+
+def cached_devices(max_age=None):
+    """Cached devices (optionally only those seen within ``max_age`` seconds), sorted by address.
+
+    Each is a scan-style dict with ``ip`` and ``info``, plus ``source``
+    (``cache``), ``found_by`` and ``age`` in seconds.
+    """
+    now = time.time()
+    devices = _cache_store.read(lambda cache: [
+        {'ip': address, 'info': entry['info'], 'source': "cache", 'found_by': entry['source'],
+         'age': now - entry['seen']}
+        for address, entry in cache['devices'].items() if max_age is None or now - entry['seen'] < max_age])
+    return sorted(devices, key=_sort_key)
+
+@timed("scan.arp")
+def arp_neighbors():
+    """IPv4 addresses with a resolved entry in the system ARP/neighbour table.
+
+    Reads /proc/net/arp on Linux and parses ``arp -a`` elsewhere; returns
+    an empty list if neither is available.
+    """
+    addresses = []
+    if os.path.exists(ARP_TABLE_FILE):
+        try:
+            with open(ARP_TABLE_FILE, "r", encoding="utf-8") as f:
+                next(f, None)  # header
+                for line in f:
+                    fields = line.split()
+                    # Flags 0x0 is an incomplete entry; an all-zero MAC never resolved
+                    if len(fields) >= 4 and int(fields[2], 16) & 0x2 and fields[3] != "00:00:00:00:00:00":
+                        addresses.append(fields[0])
+        except (OSError, ValueError):
+            pass
+    else:
+        try:
+            output = subprocess.run(["arp", "-a"], capture_output=True, text=True, timeout=5,
+                                    creationflags=getattr(subprocess, "CREATE_NO_WINDOW", 0)
+                                    if sys.platform == "win32" else 0).stdout
+        except (OSError, subprocess.SubprocessError):
+            output = ""
+        for line in output.splitlines():
+            if "incomplete" in line.lower():
+                continue
+            match = re.search(r"\b(\d{1,3}(?:\.\d{1,3}){3})\b", line)
+            if match:
+                addresses.append(match.group(1))
+    neighbors = []
+    for address in addresses:
+        try:
+            ip = ipaddress.IPv4Address(address)
+        except ValueError:
+            continue
+        if not (ip.is_multicast or ip.is_loopback or ip.is_unspecified or address.endswith(".255")
+                or address in neighbors):
+            neighbors.append(address)
+    return neighbors
+
+@profiled("scan")
+def cached_scan(on_found=None, targets=None, port=DEVICE_PORT, full=False, ttl=None, sweep_ttl=None,
+                on_progress=None, cancel=None, **scan_options):
+    """Scan ``targets`` (see plan_scan_targets()) starting from the cache (see module docstring).
+
+    ``on_found``, ``on_progress`` and ``cancel`` behave as in
+    scan_network_for_devices(); other keyword arguments are passed on to
+    sweep_hosts(), which does the probing. Devices reported from the cache have
+    ``source`` ``cache``. Raises ValueError for invalid targets, and
+    OSError if no targets are given and this machine's address cannot be
+    determined. A cancelled or interrupted sweep does not count against
+    cached devices that did not answer, and is not remembered as a sweep.
+    """
+    ttl = ttl if ttl is not None else app_config.get('discovery_ttl', DISCOVERY_TTL)
+    sweep_ttl = sweep_ttl if sweep_ttl is not None else app_config.get('discovery_sweep_ttl', DISCOVERY_SWEEP_TTL)
+    plan = plan_scan_targets(targets, app_config.get('scan_max_hosts', SCAN_MAX_HOSTS))
+    planned = set(plan)
+    plan_key = f"{','.join(sorted(targets)) if targets else 'local'}:{port}"
+    now = time.time()
+    last_sweep = _cache_store.read(lambda cache: cache['sweeps'].get(plan_key, 0))
+
+    found = {}
+
+    def report(device):
+        if device['ip'] not in found:
+            found[device['ip']] = device
+            if on_found:
+                on_found(device)
+
+    stale = []
+    for entry in cached_devices():
+        host = entry['ip'].split(":")[0]
+        if host not in planned or entry['ip'] != device_address(host, port):
+            continue
+        if entry['age'] < ttl:
+            report(entry)
+        else:
+            stale.append(host)
+
+    # Probe order: known devices, then ARP neighbours, then (if due) everything else
+    queued = set(stale)
+    arp = [ip for ip in arp_neighbors() if ip in planned and ip not in queued
+           and device_address(ip, port) not in found]
+    queued.update(arp)
+    sweep_due = full or now - last_sweep >= sweep_ttl
+    rest = [ip for ip in plan if ip not in queued and device_address(ip, port) not in found] if sweep_due else []
+    probed, swept = sweep_hosts(stale + arp + rest, on_found=report, port=port, on_progress=on_progress,
+                                cancel=cancel, **scan_options)
+
+    remember_devices(probed)
+    if swept:
+        answered = {device['ip'] for device in probed}
+
+        def record_misses(cache):
+            for host in stale:
+                address = device_address(host, port)
+                entry = cache['devices'].get(address)
+                if entry and address not in answered:
+                    entry['misses'] = entry.get('misses', 0) + 1
+                    if entry['misses'] >= DISCOVERY_MAX_MISSES:
+                        del cache['devices'][address]
+            if sweep_due:
+                cache['sweeps'][plan_key] = now
+
+        _cache_store.update(record_misses)
+    return sorted(found.values(), key=_sort_key)
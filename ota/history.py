@@ -0,0 +1,395 @@
+"""Upload history: an indexed SQLite store with rotation into a gzip archive.
+
+The same database keeps timing spans (one row per phase of an upload, scan
+or version check) for ota.metrics.
+"""
+import gzip
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+from .profiling import timed
+from .storage import DATA_DIR, app_config
+
+HISTORY_FILE = os.path.join(DATA_DIR, "upload_history.json")
+HISTORY_DB_FILE = os.path.join(DATA_DIR, "upload_history.db")
+HISTORY_ARCHIVE_FILE = os.path.join(DATA_DIR, "upload_history.archive.jsonl.gz")
+
+# History store tuning
+HISTORY_MAX_ENTRIES = 100000
+HISTORY_COMPACT_EVERY = 1000
+HISTORY_FIELDS = ('timestamp', 'ip', 'status', 'file', 'checksum', 'error', 'version', 'reboot_seconds')
+HISTORY_SORT_COLUMNS = ('timestamp', 'ip', 'status', 'file')
+HISTORY_FILTERS = ('ip', 'status', 'file', 'checksum', 'since', 'until')
+HISTORY_BATCH_SIZE = 1000
+# An imported entry with the same values in these fields is already in the history
+HISTORY_IDENTITY = ('timestamp', 'ip', 'status', 'file')
+SPAN_FIELDS = ('upload_id', 'timestamp', 'kind', 'ip', 'phase', 'seconds', 'ok')
+SPANS_MAX_ENTRIES = 1000000
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS uploads (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL,
+    ip TEXT,
+    status TEXT,
+    file TEXT,
+    checksum TEXT,
+    error TEXT,
+    version TEXT,
+    reboot_seconds REAL
+);
+CREATE INDEX IF NOT EXISTS idx_uploads_ip_timestamp ON uploads (ip, timestamp);
+CREATE INDEX IF NOT EXISTS idx_uploads_timestamp ON uploads (timestamp);
+CREATE INDEX IF NOT EXISTS idx_uploads_status_timestamp ON uploads (status, timestamp);
+CREATE INDEX IF NOT EXISTS idx_uploads_file_timestamp ON uploads (file, timestamp);
+CREATE INDEX IF NOT EXISTS idx_uploads_checksum ON uploads (checksum);
+CREATE TABLE IF NOT EXISTS spans (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    upload_id INTEGER,
+    timestamp TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    ip TEXT,
+    phase TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    ok INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS idx_spans_timestamp ON spans (timestamp);
+CREATE INDEX IF NOT EXISTS idx_spans_upload ON spans (upload_id);
+"""
+
+# Serializes access to the shared SQLite history connection
+_history_lock = threading.Lock()
+_history_db = None
+_history_inserts = 0
+
+def _history_connection():
+    """Open the SQLite history store once, migrating the legacy JSON file on first use.
+
+    Callers must hold _history_lock.
+    """
+    global _history_db
+    if _history_db is None:
+        conn = sqlite3.connect(HISTORY_DB_FILE, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(HISTORY_SCHEMA)
+        _add_missing_columns(conn)
+        _migrate_json_history(conn)
+        _history_db = conn
+    return _history_db
+
+def _add_missing_columns(conn):
+    """Add columns introduced after a database was created (ALTER TABLE ... ADD COLUMN)."""
+    existing = {row['name'] for row in conn.execute("PRAGMA table_info(uploads)")}
+    for column, sql_type in (('version', 'TEXT'), ('reboot_seconds', 'REAL')):
+        if column not in existing:
+            conn.execute(f"ALTER TABLE uploads ADD COLUMN {column} {sql_type}")
+
+def _migrate_json_history(conn):
+    """One-time import of upload_history.json into the SQLite store.
+
+    The file is renamed to .migrated once its entries are stored. A file
+    that cannot be read or is not a list of entries is left where it is.
+    """
+    if not os.path.exists(HISTORY_FILE):
+        return
+    try:
+        with open(HISTORY_FILE, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return
+    if not isinstance(data, list):
+        return
+    try:
+        with conn:
+            _insert_history(conn, [entry for entry in data if isinstance(entry, dict) and entry.get('timestamp')])
+    except sqlite3.Error:
+        return
+    os.replace(HISTORY_FILE, HISTORY_FILE + ".migrated")
+
+def _insert_history(conn, entries):
+    """Insert history entries (dicts) in one statement batch."""
+    conn.executemany(
+        f"INSERT INTO uploads ({', '.join(HISTORY_FIELDS)}) VALUES ({', '.join('?' * len(HISTORY_FIELDS))})",
+        ([entry.get(field) for field in HISTORY_FIELDS] for entry in entries if isinstance(entry, dict)),
+    )
+
+def _insert_spans(conn, kind, spans, upload_id=None, timestamp=None):
+    """Insert ``(ip, phase, seconds, ok)`` tuples as spans of one ``kind``."""
+    timestamp = timestamp or datetime.now().isoformat()
+    conn.executemany(
+        f"INSERT INTO spans ({', '.join(SPAN_FIELDS)}) VALUES ({', '.join('?' * len(SPAN_FIELDS))})",
+        ((upload_id, timestamp, kind, ip, phase, float(seconds), int(bool(ok))) for ip, phase, seconds, ok in spans),
+    )
+
+def _history_entry(row):
+    """Convert a history row to the dict shape used across the app."""
+    return {field: row[field] for field in HISTORY_FIELDS}
+
+def load_history():
+    """Load upload history (oldest first)."""
+    try:
+        with _history_lock:
+            rows = _history_connection().execute(
+                f"SELECT {', '.join(HISTORY_FIELDS)} FROM uploads ORDER BY id").fetchall()
+        return [_history_entry(row) for row in rows]
+    except Exception:
+        return []
+
+def _history_where(filters):
+    """WHERE clause and parameters for history filters (see query_history())."""
+    clauses, params = [], []
+    filters = {key: value for key, value in (filters or {}).items() if value}
+    unknown = set(filters) - set(HISTORY_FILTERS)
+    if unknown:
+        raise ValueError(f"unknown history filter(s): {', '.join(sorted(unknown))}")
+    ip = filters.get('ip')
+    if ip and (ip.count(".") == 3 and not ip.endswith(".")):
+        clauses.append("ip = ?")
+        params.append(ip)
+    elif ip:
+        # A partial address matches many rows: walk the sort index and filter
+        # (unary + keeps SQLite from sorting every match in a temp B-tree)
+        clauses.append("+ip >= ? AND +ip < ?")
+        params += [ip, ip + "\uffff"]
+    if 'checksum' in filters:
+        clauses.append("checksum >= ? AND checksum < ?")
+        params += [filters['checksum'], filters['checksum'] + "\uffff"]
+    if 'status' in filters:
+        clauses.append("status = ?")
+        params.append(filters['status'])
+    if 'file' in filters:
+        pattern = filters['file'].replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        clauses.append("file LIKE ? ESCAPE '\\'")
+        params.append(f"%{pattern}%")
+    if 'since' in filters:
+        clauses.append("timestamp >= ?")
+        params.append(filters['since'])
+    if 'until' in filters:
+        # Inclusive: "2026-01-20" covers the whole day
+        clauses.append("timestamp <= ?")
+        params.append(filters['until'] + "\uffff")
+    return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+def query_history(limit=50, offset=0, filters=None, sort='timestamp', descending=True):
+    """Return a page of upload history, newest first by default.
+
+    ``filters`` may hold ``ip`` (a full address, or a prefix such as
+    ``192.168.2.``), ``checksum`` (prefix), ``status``
+    (exact), ``file`` (substring) and ``since``/``until`` (ISO timestamps or
+    dates, inclusive). ``sort`` is one of HISTORY_SORT_COLUMNS. Sorting and
+    every filter except ``file`` use an index, so the first page is cheap
+    however large the history grows.
+    """
+    if sort not in HISTORY_SORT_COLUMNS:
+        raise ValueError(f"cannot sort history by {sort!r}")
+    where, params = _history_where(filters)
+    direction = "DESC" if descending else "ASC"
+    # Ties are broken by time, matching the (column, timestamp) indexes
+    order = ", ".join(f"{column} {direction}" for column in dict.fromkeys((sort, 'timestamp', 'id')))
+    try:
+        with _history_lock:
+            rows = _history_connection().execute(
+                f"SELECT {', '.join(HISTORY_FIELDS)} FROM uploads{where} ORDER BY {order} LIMIT ? OFFSET ?",
+                params + [limit, offset]).fetchall()
+        return [_history_entry(row) for row in rows]
+    except sqlite3.Error:
+        return []
+
+def count_history(filters=None):
+    """Number of entries in the upload history (matching ``filters``, see query_history())."""
+    where, params = _history_where(filters)
+    try:
+        with _history_lock:
+            return _history_connection().execute(f"SELECT COUNT(*) FROM uploads{where}", params).fetchone()[0]
+    except sqlite3.Error:
+        return 0
+
+def save_history(history):
+    """Replace the whole upload history (used by config import)."""
+    try:
+        with _history_lock:
+            conn = _history_connection()
+            with conn:
+                conn.execute("DELETE FROM uploads")
+                _insert_history(conn, history)
+    except Exception:
+        pass
+
+def iter_history(batch_size=HISTORY_BATCH_SIZE):
+    """Yield history entries oldest first, reading ``batch_size`` rows at a time.
+
+    The database lock is only held while a batch is read, so uploads keep
+    logging while a large history is exported.
+    """
+    last_id = 0
+    while True:
+        try:
+            with _history_lock:
+                rows = _history_connection().execute(
+                    f"SELECT id, {', '.join(HISTORY_FIELDS)} FROM uploads WHERE id > ? ORDER BY id LIMIT ?",
+                    (last_id, batch_size)).fetchall()
+        except sqlite3.Error:
+            return
+        for row in rows:
+            yield _history_entry(row)
+        if len(rows) < batch_size:
+            return
+        last_id = rows[-1]['id']
+
+def merge_history(entries):
+    """Add history entries that are not stored yet; returns ``(added, duplicates)``.
+
+    Entries match on HISTORY_IDENTITY. A match only fills in the checksum,
+    version and reboot time if the stored entry lacks them. Entries are
+    looked up by timestamp, so a batch costs one indexed query however
+    large the history is. Raises sqlite3.Error if the database cannot be
+    written.
+    """
+    entries = [entry for entry in entries if isinstance(entry, dict) and entry.get('timestamp')]
+    added, duplicates, fills = [], 0, []
+    with _history_lock:
+        conn = _history_connection()
+        with conn:
+            known = {}
+            timestamps = sorted({entry['timestamp'] for entry in entries})
+            for first in range(0, len(timestamps), 500):  # stay below SQLite's bound-parameter limit
+                chunk = timestamps[first:first + 500]
+                for row in conn.execute(f"SELECT id, {', '.join(HISTORY_IDENTITY)} FROM uploads "
+                                        f"WHERE timestamp IN ({', '.join('?' * len(chunk))})", chunk):
+                    known[tuple(row[field] for field in HISTORY_IDENTITY)] = row['id']
+            for entry in entries:
+                key = tuple(entry.get(field) for field in HISTORY_IDENTITY)
+                if key not in known:
+                    known[key] = None
+                    added.append(entry)
+                    continue
+                duplicates += 1
+                if known[key] is not None and any(entry.get(field) is not None
+                                                  for field in ('checksum', 'version', 'reboot_seconds')):
+                    fills.append((entry.get('checksum'), entry.get('version'), entry.get('reboot_seconds'), known[key]))
+            _insert_history(conn, added)
+            conn.executemany("UPDATE uploads SET checksum = COALESCE(checksum, ?), version = COALESCE(version, ?), "
+                             "reboot_seconds = COALESCE(reboot_seconds, ?) WHERE id = ?", fills)
+    return len(added), duplicates
+
+def compact_history(max_entries=HISTORY_MAX_ENTRIES):
+    """Rotate entries beyond the newest ``max_entries`` into the gzip archive.
+
+    Archived rows are appended as JSON Lines to upload_history.archive.jsonl.gz
+    (one gzip member per rotation) together with their spans, which are not
+    archived; spans beyond SPANS_MAX_ENTRIES are dropped as well. Freed pages
+    are returned to the OS.
+    Returns the number of rotated entries.
+    """
+    try:
+        with _history_lock:
+            conn = _history_connection()
+            row = conn.execute("SELECT id FROM uploads ORDER BY id DESC LIMIT 1 OFFSET ?", (max_entries,)).fetchone()
+            if row is None:
+                with conn:
+                    _trim_spans(conn)
+                return 0
+            cutoff = row['id']
+            rows = conn.execute(
+                f"SELECT {', '.join(HISTORY_FIELDS)} FROM uploads WHERE id <= ? ORDER BY id", (cutoff,)).fetchall()
+            with gzip.open(HISTORY_ARCHIVE_FILE, "at", encoding="utf-8") as archive:
+                for r in rows:
+                    archive.write(json.dumps(_history_entry(r)) + "\n")
+            with conn:
+                conn.execute("DELETE FROM uploads WHERE id <= ?", (cutoff,))
+                conn.execute("DELETE FROM spans WHERE upload_id <= ?", (cutoff,))
+                _trim_spans(conn)
+            conn.execute("PRAGMA incremental_vacuum")
+            return len(rows)
+    except Exception:
+        return 0
+
+def _trim_spans(conn):
+    """Drop the oldest spans beyond SPANS_MAX_ENTRIES (scan and version spans have no upload to rotate with)."""
+    row = conn.execute("SELECT id FROM spans ORDER BY id DESC LIMIT 1 OFFSET ?", (SPANS_MAX_ENTRIES,)).fetchone()
+    if row is not None:
+        conn.execute("DELETE FROM spans WHERE id <= ?", (row['id'],))
+
+@timed("history.spans")
+def record_spans(kind, spans, upload_id=None):
+    """Store timing spans, given as ``(ip, phase, seconds, ok)`` tuples."""
+    try:
+        with _history_lock:
+            conn = _history_connection()
+            with conn:
+                _insert_spans(conn, kind, list(spans), upload_id)
+    except Exception:
+        pass
+
+def query_spans(kind=None, since=None, ip=None):
+    """Stored spans as dicts, oldest first; ``since`` is an ISO timestamp."""
+    clauses, params = [], []
+    for column, value in (('kind', kind), ('ip', ip)):
+        if value is not None:
+            clauses.append(f"{column} = ?")
+            params.append(value)
+    if since is not None:
+        clauses.append("timestamp >= ?")
+        params.append(since)
+    where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+    try:
+        with _history_lock:
+            rows = _history_connection().execute(
+                f"SELECT {', '.join(SPAN_FIELDS)} FROM spans{where} ORDER BY id", params).fetchall()
+        return [{field: row[field] for field in SPAN_FIELDS} for row in rows]
+    except Exception:
+        return []
+
+@timed("history.update")
+def update_upload(upload_id, **fields):
+    """Fill in columns of an existing history entry (e.g. the version it booted into)."""
+    fields = {k: v for k, v in fields.items() if k in HISTORY_FIELDS}
+    if upload_id is None or not fields:
+        return
+    try:
+        with _history_lock:
+            conn = _history_connection()
+            with conn:
+                conn.execute(f"UPDATE uploads SET {', '.join(f'{k} = ?' for k in fields)} WHERE id = ?",
+                             (*fields.values(), upload_id))
+    except Exception:
+        pass
+
+@timed("history.log")
+def log_upload(ip, status, file_name, error=None, checksum=None, timings=None):
+    """Log an upload attempt (a single indexed INSERT).
+
+    ``timings`` (phase -> seconds) is stored as spans linked to the entry.
+    Returns the entry's id, or None if it could not be written.
+    """
+    global _history_inserts
+    entry = {
+        'timestamp': datetime.now().isoformat(),
+        'ip': ip,
+        'status': status,
+        'file': file_name,
+        'checksum': checksum,
+        'error': error
+    }
+    try:
+        with _history_lock:
+            conn = _history_connection()
+            with conn:
+                _insert_history(conn, [entry])
+                upload_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+                if timings:
+                    _insert_spans(conn, "upload", ((ip, phase, seconds, status == "success")
+                                                   for phase, seconds in timings.items()),
+                                  upload_id, entry['timestamp'])
+            _history_inserts += 1
+            compact_due = _history_inserts % HISTORY_COMPACT_EVERY == 0
+        if compact_due:
+            compact_history(app_config.get('history_max_entries', HISTORY_MAX_ENTRIES))
+        return upload_id
+    except Exception:
+        return None
@@ -0,0 +1,436 @@
+"""mDNS / DNS-SD discovery of devices advertising the ``_ota._tcp`` service.
+
+The bundled sketch announces itself with ESPmDNS as an ``_ota._tcp``
+service on port 80. Its TXT record carries ``name``, ``version`` and
+``caps``. Instead of sweeping a /24, discover_devices() sends one PTR query
+to 224.0.0.251:5353 on every interface and collects the answers.
+Responders normally reply within milliseconds, and no other host on the
+network is contacted. MdnsBrowser keeps a live registry. It listens for the
+announcements devices send when they boot or change, re-queries with
+backoff, and drops devices whose records expire or that say goodbye
+(TTL 0).
+
+Only the small part of RFC 6762/6763 needed for browsing is implemented:
+IPv4, PTR/SRV/TXT/A records and name compression. Queries come from an
+ephemeral port, so responders answer by unicast ("legacy unicast"), and
+this works even when another mDNS daemon owns port 5353.
+"""
+import random
+import selectors
+import socket
+import struct
+import threading
+import time
+
+from .netif import interface_addresses, primary_ipv4_address
+
+MDNS_ADDRESS = "224.0.0.251"
+MDNS_PORT = 5353
+OTA_SERVICE = "_ota._tcp.local"
+
+# mDNS discovery tuning (overridable via app_config.json)
+MDNS_DISCOVERY_TIMEOUT = 1.0
+MDNS_REQUERY_INITIAL = 1.0
+MDNS_REQUERY_MAX = 60.0
+
+TYPE_A = 1
+TYPE_PTR = 12
+TYPE_TXT = 16
+TYPE_SRV = 33
+CLASS_IN = 1
+CACHE_FLUSH = 0x8000
+FLAG_RESPONSE = 0x8400  # QR + authoritative answer
+MAX_POINTER_JUMPS = 32
+
+def encode_name(name):
+    """DNS wire format of a dotted name (no compression)."""
+    out = bytearray()
+    for label in name.rstrip(".").split("."):
+        raw = label.encode("utf-8")
+        if not 0 < len(raw) < 64:
+            raise ValueError(f"invalid DNS label in {name!r}")
+        out += bytes([len(raw)]) + raw
+    return bytes(out + b"\0")
+
+def _read_name(data, offset):
+    """Decode a possibly compressed name; returns (name, offset after it)."""
+    labels = []
+    end = None
+    for _ in range(MAX_POINTER_JUMPS):
+        length = data[offset]
+        if length & 0xC0 == 0xC0:
+            if end is None:
+                end = offset + 2
+            offset = ((length & 0x3F) << 8) | data[offset + 1]
+            continue
+        if length == 0:
+            return ".".join(labels), (end if end is not None else offset + 1)
+        labels.append(data[offset + 1:offset + 1 + length].decode("utf-8", "replace"))
+        offset += 1 + length
+    raise ValueError("DNS name compression loop")
+
+def _parse_txt(rdata):
+    txt = {}
+    i = 0
+    while i < len(rdata):
+        length = rdata[i]
+        entry = rdata[i + 1:i + 1 + length].decode("utf-8", "replace")
+        i += 1 + length
+        if entry:
+            key, _, value = entry.partition("=")
+            txt.setdefault(key.lower(), value)
+    return txt
+
+def _encode_txt(txt):
+    out = bytearray()
+    for key, value in txt.items():
+        entry = f"{key}={value}".encode("utf-8")[:255]
+        out += bytes([len(entry)]) + entry
+    return bytes(out or b"\0")
+
+def build_message(questions=(), answers=(), additional=(), response=False, message_id=0):
+    """Encode a DNS message.
+
+    ``questions`` are ``(name, type)`` pairs. Records are dicts with
+    ``name``, ``type``, ``ttl`` and ``data``, in the form parse_message()
+    returns them.
+    """
+    out = bytearray(struct.pack("!HHHHHH", message_id, FLAG_RESPONSE if response else 0,
+                                len(questions), len(answers), 0, len(additional)))
+    for name, qtype in questions:
+        out += encode_name(name) + struct.pack("!HH", qtype, CLASS_IN)
+    for record in list(answers) + list(additional):
+        data = record['data']
+        if record['type'] == TYPE_PTR:
+            rdata = encode_name(data)
+        elif record['type'] == TYPE_SRV:
+            rdata = struct.pack("!HHH", 0, 0, data['port']) + encode_name(data['target'])
+        elif record['type'] == TYPE_TXT:
+            rdata = _encode_txt(data)
+        elif record['type'] == TYPE_A:
+            rdata = socket.inet_aton(data)
+        else:
+            raise ValueError(f"unsupported record type {record['type']}")
+        rclass = CLASS_IN | (CACHE_FLUSH if record.get('flush') else 0)
+        out += encode_name(record['name']) + struct.pack("!HHIH", record['type'], rclass, record['ttl'], len(rdata))
+        out += rdata
+    return bytes(out)
+
+def parse_message(data):
+    """Decode a DNS message into ``{'id', 'response', 'questions', 'records'}``.
+
+    ``records`` holds the answer, authority and additional sections; record
+    types other than PTR, SRV, TXT and A are skipped. Raises ValueError for
+    malformed packets.
+    """
+    try:
+        message_id, flags, qdcount, ancount, nscount, arcount = struct.unpack_from("!HHHHHH", data)
+        offset = 12
+        questions = []
+        for _ in range(qdcount):
+            name, offset = _read_name(data, offset)
+            qtype, _ = struct.unpack_from("!HH", data, offset)
+            offset += 4
+            questions.append((name, qtype))
+        records = []
+        for _ in range(ancount + nscount + arcount):
+            name, offset = _read_name(data, offset)
+            rtype, _, ttl, rdlength = struct.unpack_from("!HHIH", data, offset)
+            offset += 10
+            rdata_offset, offset = offset, offset + rdlength
+            if offset > len(data):
+                raise IndexError("record data runs past the end of the packet")
+            if rtype == TYPE_PTR:
+                value = _read_name(data, rdata_offset)[0]
+            elif rtype == TYPE_SRV:
+                port = struct.unpack_from("!HHH", data, rdata_offset)[2]
+                value = {'port': port, 'target': _read_name(data, rdata_offset + 6)[0]}
+            elif rtype == TYPE_TXT:
+                value = _parse_txt(data[rdata_offset:offset])
+            elif rtype == TYPE_A and rdlength == 4:
+                value = socket.inet_ntoa(data[rdata_offset:offset])
+            else:
+                continue
+            records.append({'name': name, 'type': rtype, 'ttl': ttl, 'data': value})
+    except (struct.error, IndexError, UnicodeError) as e:
+        raise ValueError(f"malformed DNS message: {e}") from None
+    return {'id': message_id, 'response': bool(flags & 0x8000), 'questions': questions, 'records': records}
+
+class _ServiceCache:
+    """PTR/SRV/TXT/A records for one service type, with expiry."""
+
+    def __init__(self, service):
+        self.service = service.lower().rstrip(".")
+        self.instances = {}  # instance -> (label, expires)
+        self.srv = {}        # instance -> (target, port, expires)
+        self.txt = {}        # instance -> (dict, expires)
+        self.addresses = {}  # host -> (ip, expires)
+        self.sources = {}    # instance -> packet source address, if no A record arrives
+
+    def add(self, records, source, now):
+        for record in records:
+            name = record['name'].lower().rstrip(".")
+            expires = now + record['ttl']
+            if record['type'] == TYPE_PTR and name == self.service:
+                instance = record['data'].rstrip(".")
+                label = instance[:-len(self.service) - 1] if instance.lower().endswith("." + self.service) else instance
+                self.instances[instance.lower()] = (label, expires)
+                self.sources[instance.lower()] = source
+            elif record['type'] == TYPE_SRV:
+                self.srv[name] = (record['data']['target'].lower().rstrip("."), record['data']['port'], expires)
+            elif record['type'] == TYPE_TXT:
+                self.txt[name] = (record['data'], expires)
+            elif record['type'] == TYPE_A:
+                self.addresses[name] = (record['data'], expires)
+
+    def expire(self, now):
+        for table in (self.instances, self.srv, self.txt, self.addresses):
+            for key in [key for key, value in table.items() if value[-1] <= now]:
+                del table[key]
+        for key in [key for key in self.sources if key not in self.instances]:
+            del self.sources[key]
+
+    def next_expiry(self):
+        times = [value[-1] for table in (self.instances, self.srv, self.txt, self.addresses)
+                 for value in table.values()]
+        return min(times) if times else None
+
+    def devices(self):
+        """Resolved instances as ``{instance: device}``; see discover_devices() for the dict."""
+        devices = {}
+        for instance, (label, _) in self.instances.items():
+            if instance not in self.srv:
+                continue
+            target, port, _ = self.srv[instance]
+            ip = self.addresses.get(target, (self.sources.get(instance),))[0]
+            if not ip:
+                continue
+            txt = dict(self.txt.get(instance, ({},))[0])
+            info = {'name': txt.get('name') or label, 'version': txt.get('version'), 'ip': ip}
+            if txt.get('caps'):
+                info['caps'] = [cap for cap in txt['caps'].split(",") if cap]
+            devices[instance] = {
+                'ip': ip if port == 80 else f"{ip}:{port}",
+                'info': info,
+                'instance': label,
+                'host': target,
+                'txt': txt,
+                'source': "mdns",
+            }
+        return devices
+
+def _interface_list(interfaces):
+    if interfaces:
+        return list(interfaces)
+    addresses = [iface['address'] for iface in interface_addresses()]
+    if not addresses:
+        primary = primary_ipv4_address()
+        addresses = [primary] if primary else ["0.0.0.0"]
+    return addresses
+
+def _query_socket():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 255)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+    sock.bind(("", 0))
+    sock.setblocking(False)
+    return sock
+
+def _send_query(sock, service, interfaces):
+    """Send a PTR query out of every interface; returns the addresses it went out on."""
+    query = build_message(questions=[(service, TYPE_PTR)], message_id=random.randrange(1, 0x10000))
+    sent = []
+    for address in interfaces:
+        try:
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(address))
+            sock.sendto(query, (MDNS_ADDRESS, MDNS_PORT))
+            sent.append(address)
+        except OSError:
+            pass  # interface went away or has no multicast route
+    return sent
+
+def _listen_socket():
+    """A socket on 5353 shared with any other mDNS stack; None if the port is taken."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, "SO_REUSEPORT"):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(("", MDNS_PORT))
+    except OSError:
+        sock.close()
+        return None
+    sock.setblocking(False)
+    return sock
+
+def _join_group(sock, address):
+    try:
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                        socket.inet_aton(MDNS_ADDRESS) + socket.inet_aton(address))
+        return True
+    except OSError:
+        return False
+
+def _receive(sock, cache, now):
+    """Feed every datagram waiting on ``sock`` into ``cache``."""
+    while True:
+        try:
+            data, (source, _) = sock.recvfrom(9000)
+        except OSError:  # nothing left to read (BlockingIOError) or the socket closed
+            return
+        try:
+            message = parse_message(data)
+        except ValueError:
+            continue
+        if message['response']:
+            cache.add(message['records'], source, now)
+
+def discover_devices(timeout=MDNS_DISCOVERY_TIMEOUT, interfaces=None, on_found=None, service=OTA_SERVICE):
+    """Find ``service`` instances with one multicast query per interface.
+
+    ``interfaces`` are local IPv4 addresses to query from (default: every
+    non-loopback interface). ``on_found(device)`` is called as soon as each
+    device resolves. The query is repeated once, a third of the way into
+    ``timeout``, in case the first packet was lost.
+
+    Returns devices sorted by address in the same shape as
+    scan_network_for_devices(): ``ip`` (``ip:port`` unless the port is 80)
+    and ``info`` (``name``, ``version``, ``ip`` and ``caps`` from the TXT
+    record), plus ``instance``, ``host``, ``txt`` and ``source`` ("mdns").
+    """
+    interfaces = _interface_list(interfaces)
+    cache = _ServiceCache(service)
+    found = {}
+    sock = _query_socket()
+    try:
+        start = time.monotonic()
+        deadline = start + timeout
+        resend_at = start + timeout / 3
+        _send_query(sock, service, interfaces)
+        with selectors.DefaultSelector() as selector:
+            selector.register(sock, selectors.EVENT_READ)
+            while True:
+                now = time.monotonic()
+                if now >= deadline:
+                    break
+                if resend_at and now >= resend_at:
+                    _send_query(sock, service, interfaces)
+                    resend_at = None
+                if selector.select(min(deadline, resend_at or deadline) - now):
+                    _receive(sock, cache, time.monotonic())
+                    for instance, device in cache.devices().items():
+                        if instance not in found:
+                            found[instance] = device
+                            if on_found:
+                                on_found(device)
+                        else:
+                            found[instance] = device
+    finally:
+        sock.close()
+    return sorted(found.values(), key=lambda d: socket.inet_aton(d['info']['ip']))
+
+class MdnsBrowser:
+    """Live registry of ``service`` instances on every interface.
+
+    A background thread listens on 224.0.0.251:5353 for announcements and
+    goodbyes, and re-queries after 1, 2, 4 ... up to MDNS_REQUERY_MAX
+    seconds. Each query also re-checks the interface list, so new networks
+    (VPN up, laptop docked) are joined without a restart. Records expire
+    after their TTL. ``on_change(changes)`` is called from the browser thread
+    with ``{instance: device}`` for devices that appeared or changed and
+    ``{instance: None}`` for devices that left. The device dicts are the
+    ones discover_devices() returns.
+    """
+
+    def __init__(self, on_change=None, interfaces=None, service=OTA_SERVICE, requery_max=MDNS_REQUERY_MAX):
+        self.on_change = on_change
+        self.interfaces = interfaces
+        self.service = service
+        self.requery_max = requery_max
+        self._cache = _ServiceCache(service)
+        self._devices = {}
+        self._joined = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+        self.passive = False
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="mdns-browser", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def query_now(self):
+        """Send a query at the next opportunity and restart the backoff."""
+        self._wake.set()
+
+    def devices(self):
+        """Currently known devices, sorted by address."""
+        with self._lock:
+            devices = list(self._devices.values())
+        return sorted(devices, key=lambda d: socket.inet_aton(d['info']['ip']))
+
+    def get(self, ip):
+        """The device announced at ``ip`` (as used in device URLs), or None."""
+        with self._lock:
+            return next((dict(d) for d in self._devices.values() if d['ip'] == ip), None)
+
+    def _update(self, now):
+        self._cache.expire(now)
+        current = self._cache.devices()
+        changes = {}
+        with self._lock:
+            for instance, device in current.items():
+                if self._devices.get(instance) != device:
+                    changes[instance] = device
+            for instance in self._devices:
+                if instance not in current:
+                    changes[instance] = None
+            self._devices = current
+        if changes and self.on_change:
+            try:
+                self.on_change(changes)
+            except Exception:
+                pass
+
+    def _run(self):
+        query_sock = _query_socket()
+        listen_sock = _listen_socket()
+        self.passive = listen_sock is not None
+        selector = selectors.DefaultSelector()
+        selector.register(query_sock, selectors.EVENT_READ)
+        if listen_sock:
+            selector.register(listen_sock, selectors.EVENT_READ)
+        interval = MDNS_REQUERY_INITIAL
+        next_query = time.monotonic()
+        try:
+            while not self._stop.is_set():
+                now = time.monotonic()
+                if self._wake.is_set():
+                    self._wake.clear()
+                    interval, next_query = MDNS_REQUERY_INITIAL, now
+                if now >= next_query:
+                    interfaces = _interface_list(self.interfaces)
+                    if listen_sock:
+                        for address in set(interfaces) - self._joined:
+                            if _join_group(listen_sock, address):
+                                self._joined.add(address)
+                    _send_query(query_sock, self.service, interfaces)
+                    next_query = now + interval * random.uniform(0.9, 1.1)
+                    interval = min(interval * 2, self.requery_max)
+                expiry = self._cache.next_expiry()
+                # Wake at least every half second so stop() and query_now() are noticed
+                wait = min(next_query, expiry if expiry is not None else next_query, now + 0.5) - now
+                for key, _ in selector.select(max(0.0, wait)):
+                    _receive(key.fileobj, self._cache, time.monotonic())
+                self._update(time.monotonic())
+        finally:
+            selector.close()
+            query_sock.close()
+            if listen_sock:
+                listen_sock.close()
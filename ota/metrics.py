@@ -0,0 +1,91 @@
+"""Latency percentiles from stored timing spans, exported as Prometheus text or JSON.
+
+Uploads, scans and version checks store one span per phase in the history
+database (see ota.history.record_spans). collect_metrics() groups them by
+kind, phase and device, and format_prometheus() renders the result in the
+text exposition format, e.g. for node_exporter's textfile collector:
+
+    python -m ota metrics --output /var/lib/node_exporter/ota.prom
+"""
+import json
+import math
+import os
+from datetime import datetime, timedelta
+
+from .history import query_spans
+
+METRIC_QUANTILES = (0.5, 0.9, 0.99)
+
+def _quantile_key(q):
+    return f"p{q * 100:g}"
+
+def _quantile(sorted_values, q):
+    """Nearest-rank quantile of an already sorted list."""
+    return sorted_values[max(0, math.ceil(q * len(sorted_values)) - 1)]
+
+def _aggregate(spans, fields):
+    """Count, sum, max, failures and quantiles of span durations grouped by ``fields``."""
+    groups = {}
+    for span in spans:
+        groups.setdefault(tuple(span[field] for field in fields), []).append(span)
+    rows = []
+    for key in sorted(groups, key=lambda k: tuple(str(v) for v in k)):
+        group = groups[key]
+        values = sorted(span['seconds'] for span in group)
+        row = dict(zip(fields, key))
+        row.update({'count': len(values), 'sum': sum(values), 'max': values[-1],
+                    'failures': sum(1 for span in group if not span['ok'])})
+        for q in METRIC_QUANTILES:
+            row[_quantile_key(q)] = _quantile(values, q)
+        rows.append(row)
+    return rows
+
+def collect_metrics(since_hours=None, kind=None):
+    """Per-device and fleet-wide span statistics for each (kind, phase).
+
+    ``since_hours`` limits the window (default: everything still stored).
+    """
+    since = (datetime.now() - timedelta(hours=since_hours)).isoformat() if since_hours else None
+    spans = query_spans(kind=kind, since=since)
+    return {
+        'generated': datetime.now().isoformat(),
+        'since': since,
+        'spans': len(spans),
+        'devices': _aggregate([span for span in spans if span['ip']], ('kind', 'phase', 'ip')),
+        'fleet': _aggregate(spans, ('kind', 'phase')),
+    }
+
+def _labels(row, fields, **extra):
+    values = [(field, row[field]) for field in fields] + list(extra.items())
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in values)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(values, escaped)) + "}"
+
+def _format_summary(lines, name, help_text, rows, fields):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} summary")
+    for row in rows:
+        for q in METRIC_QUANTILES:
+            lines.append(f"{name}{_labels(row, fields, quantile=f'{q:g}')} {row[_quantile_key(q)]:.6f}")
+        lines.append(f"{name}_sum{_labels(row, fields)} {row['sum']:.6f}")
+        lines.append(f"{name}_count{_labels(row, fields)} {row['count']}")
+    lines.append(f"# HELP {name}_failures_total Spans recorded by failed attempts.")
+    lines.append(f"# TYPE {name}_failures_total counter")
+    for row in rows:
+        lines.append(f"{name}_failures_total{_labels(row, fields)} {row['failures']}")
+
+def format_prometheus(metrics):
+    """Render collect_metrics() output in the Prometheus text exposition format."""
+    lines = []
+    _format_summary(lines, "ota_phase_seconds", "Duration of each OTA phase per device.",
+                    metrics['devices'], ('kind', 'phase', 'ip'))
+    _format_summary(lines, "ota_fleet_phase_seconds", "Duration of each OTA phase across all devices.",
+                    metrics['fleet'], ('kind', 'phase'))
+    return "\n".join(lines) + "\n"
+
+def write_metrics(path, metrics, fmt="prom"):
+    """Write metrics atomically (temp file + rename), so scrapers never see a partial file."""
+    text = format_prometheus(metrics) if fmt == "prom" else json.dumps(metrics, indent=2) + "\n"
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
@@ -0,0 +1,543 @@
+"""Local stand-in for the bundled ESP32 sketch, for development and benchmarks.
+
+Each MockDevice serves the same endpoints as esp32/src/main.cpp (/status,
+/info, /update, /update/chunk, /update/status, /config) from a
+ThreadingHTTPServer. Latency, bandwidth
+caps, failure injection (HTTP 400/413/500 and mid-upload connection
+resets) and a reboot window after a successful update can be configured
+per device. A MockFleet starts many devices on 127.0.0.x addresses (Linux)
+or on consecutive ports of 127.0.0.1, optionally sharing one bandwidth cap
+to model a single Wi-Fi access point. With ``mdns=True`` the fleet also
+answers mDNS queries for ``_ota._tcp`` like the sketch's ESPmDNS responder.
+
+Run ``python -m ota mock --devices 10`` to serve a fleet until Ctrl+C.
+"""
+import hashlib
+import json
+import random
+import socket
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from . import mdns
+from .delta import DeltaDecoder, DeltaError
+
+MOCK_READ_SIZE = 4096
+MOCK_CHUNK_MAX = 32 * 1024
+MOCK_FAILURE_MESSAGES = {
+    400: "Invalid firmware",
+    413: "Firmware too large",
+    500: "Update failed",
+}
+
+class Pacer:
+    """Shared bandwidth cap: callers reserve consecutive time slots for their bytes."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def consume(self, n):
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._next = max(self._next, now) + n / self.rate
+            delay = self._next - now
+        if delay > 0:
+            time.sleep(delay)
+
+class _ImageSink:
+    """Extracts the file part of a streamed multipart body and hashes the image.
+
+    ``encoding="gzip"`` inflates the payload first, as the sketch does;
+    ``delta`` (or ``delta-gzip``) applies it as a delta against ``base``.
+    The written image is kept in ``image``.
+    """
+
+    def __init__(self, content_type, length, encoding=None, base=b""):
+        boundary = content_type.split("boundary=", 1)[1].strip('"') if "boundary=" in content_type else None
+        self.tail_len = len(f"\r\n--{boundary}--\r\n") if boundary else 0
+        self.length = length
+        self.payload_left = None if boundary else length
+        self._head = bytearray()
+        codings = (encoding or "").split("-")
+        self.inflater = zlib.decompressobj(16 + zlib.MAX_WBITS) if "gzip" in codings else None
+        self.patcher = DeltaDecoder(base) if "delta" in codings else None
+        self.sha256 = hashlib.sha256()
+        self.image = bytearray()
+        self.size = 0
+
+    def feed(self, chunk):
+        if self.payload_left is None:
+            self._head += chunk
+            end = self._head.find(b"\r\n\r\n")
+            if end < 0:
+                return
+            header_len = end + 4
+            self.payload_left = self.length - header_len - self.tail_len
+            chunk = bytes(self._head[header_len:])
+            self._head = None
+        data = chunk[:max(0, self.payload_left)]
+        self.payload_left -= len(data)
+        self._write(self.inflater.decompress(data) if self.inflater else data)
+
+    def _write(self, data):
+        if self.patcher:
+            data = self.patcher.feed(data)
+        self.sha256.update(data)
+        self.image += data
+        self.size += len(data)
+
+    def finish(self):
+        """True if the whole image arrived (and, for gzip and delta, the stream was complete)."""
+        if self.inflater:
+            self._write(self.inflater.flush())
+            if not self.inflater.eof:
+                return False
+        elif self.payload_left != 0:
+            return False
+        return self.patcher.finish() if self.patcher else True
+
+class MockDevice:
+    """One virtual ESP32 with configurable timing and failure behaviour.
+
+    ``bandwidth`` is in bytes/s (0 for unlimited). ``fail_status`` makes every
+    upload fail with that HTTP status; ``fail_rate`` and ``reset_rate`` make a
+    random fraction of uploads return 500 or drop the connection halfway
+    through. ``reboot_seconds`` takes the device offline after a successful
+    update, and ``version_after_update`` changes the reported version.
+    ``capabilities`` is advertised as /info ``caps``; pass ``()`` to mimic a
+    sketch that predates capability negotiation. ``image`` is the running
+    firmware, whose MD5 and size /info reports as ``sketch_md5`` and
+    ``sketch_size`` when ``delta`` is advertised; a successful update
+    replaces it. For chunked uploads a reset
+    drops the connection once per session without acknowledging the chunk,
+    like a Wi-Fi drop the uploader has to resume from. The SHA256 of the last
+    written image (after decompression) is kept in ``last_image_sha256``.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, name="ESP32_OTA", version="1.0.0", latency=0.0,
+                 bandwidth=0, fail_status=None, fail_rate=0.0, reset_rate=0.0, max_image_size=0,
+                 reboot_seconds=0.0, version_after_update=None, shared_pacer=None, seed=None,
+                 capabilities=("gzip", "chunked", "delta"), image=b""):
+        self.name = name
+        self.version = version
+        self.latency = latency
+        self.fail_status = fail_status
+        self.fail_rate = fail_rate
+        self.reset_rate = reset_rate
+        self.max_image_size = max_image_size
+        self.reboot_seconds = reboot_seconds
+        self.version_after_update = version_after_update
+        self.capabilities = list(capabilities)
+        self.image = bytes(image)
+        self.last_image_sha256 = None
+        self.last_image_size = 0
+        self.chunk_session = None
+        self.pacer = Pacer(bandwidth)
+        self.shared_pacer = shared_pacer
+        self.random = random.Random(seed)
+        self.started_at = time.monotonic()
+        self.offline_until = 0.0
+        self.stats = {'requests': 0, 'uploads': 0, 'failed_uploads': 0, 'resets': 0, 'bytes_received': 0,
+                      'chunks': 0, 'rejected_chunks': 0}
+        self._lock = threading.Lock()
+        self._connections = set()
+        self.server = ThreadingHTTPServer((host, port), self._make_handler())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def host(self):
+        return self.server.server_address[0]
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    @property
+    def address(self):
+        """Address in the form the ota package uses in device URLs."""
+        return self.host if self.port == 80 else f"{self.host}:{self.port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.05},
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving and drop open keep-alive connections, like a device powering off."""
+        self.server.shutdown()
+        self.server.server_close()
+        with self._lock:
+            connections, self._connections = self._connections, set()
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def accepts(self, encoding):
+        """True if every coding in ``encoding`` (e.g. ``delta-gzip``) is advertised."""
+        return all(coding in self.capabilities for coding in encoding.split("-"))
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    def _make_handler(self):
+        device = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def setup(self):
+                super().setup()
+                with device._lock:
+                    device._connections.add(self.connection)
+
+            def finish(self):
+                with device._lock:
+                    device._connections.discard(self.connection)
+                super().finish()
+
+            def _send(self, status, body, content_type="text/plain", close=False):
+                data = body.encode("utf-8") if isinstance(body, str) else body
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                if close:
+                    self.send_header("Connection", "close")
+                    self.close_connection = True
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _begin(self):
+                """Common request prologue; False if the device is 'rebooting'."""
+                device._count('requests')
+                if time.monotonic() < device.offline_until:
+                    self.close_connection = True
+                    self.connection.close()
+                    return False
+                if device.latency:
+                    time.sleep(device.latency)
+                return True
+
+            def _drop(self):
+                self.close_connection = True
+                try:
+                    self.connection.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+            def do_GET(self):
+                if not self._begin():
+                    return
+                path = self.path.split("?", 1)[0]
+                if path == "/status":
+                    self._send(200, "OK")
+                elif path == "/info":
+                    info = {
+                        'name': device.name,
+                        'version': device.version,
+                        'ip': device.host,
+                        'mac': "02:00:00:%02X:%02X:%02X" % (device.port >> 8 & 0xFF, device.port & 0xFF,
+                                                            int(device.host.rsplit(".", 1)[-1]) & 0xFF),
+                        'uptime': int(time.monotonic() - device.started_at),
+                        'rssi': -40 - device.random.randint(0, 30),
+                    }
+                    if device.capabilities:
+                        info['caps'] = device.capabilities
+                    if "chunked" in device.capabilities:
+                        info['chunk_max'] = MOCK_CHUNK_MAX
+                    if "delta" in device.capabilities:
+                        info['sketch_md5'] = hashlib.md5(device.image).hexdigest()
+                        info['sketch_size'] = len(device.image)
+                    self._send(200, json.dumps(info), "application/json")
+                elif path == "/update/status" and "chunked" in device.capabilities:
+                    self._send_chunk_state(200)
+                else:
+                    self._send(404, "Not found")
+
+            def _read_body(self, length, on_chunk, reset_at=None):
+                """Read the request body at the device's pace; False if the connection was dropped."""
+                received = 0
+                while received < length:
+                    chunk = self.rfile.read(min(MOCK_READ_SIZE, length - received))
+                    if not chunk:
+                        break
+                    received += len(chunk)
+                    on_chunk(chunk)
+                    device.pacer.consume(len(chunk))
+                    if device.shared_pacer:
+                        device.shared_pacer.consume(len(chunk))
+                    if reset_at is not None and received >= reset_at:
+                        device._count('resets')
+                        device._count('bytes_received', received)
+                        self._drop()
+                        return False
+                device._count('bytes_received', received)
+                return True
+
+            def _finish_update(self, sink, encoding, size):
+                """Apply failure injection, then reply like the sketch's final /update handler."""
+                status = device.fail_status
+                if status is None and (sink is None or not sink.finish()
+                                       or (encoding and not device.accepts(encoding))):
+                    status = 400
+                if status is None and device.max_image_size and size > device.max_image_size:
+                    status = 413
+                if status is None and device.random.random() < device.fail_rate:
+                    status = 500
+                if status:
+                    device._count('failed_uploads')
+                    self._send(status, MOCK_FAILURE_MESSAGES.get(status, "Update failed"), close=True)
+                    return
+
+                device.image = bytes(sink.image)
+                device.last_image_sha256 = sink.sha256.hexdigest()
+                device.last_image_size = sink.size
+                self._send(200, "Update successful. Rebooting...", close=True)
+                if device.version_after_update:
+                    device.version = device.version_after_update
+                # Like the sketch, restart after every successful update (uptime starts over).
+                device.started_at = time.monotonic() + device.reboot_seconds
+                device.chunk_session = None
+                if device.reboot_seconds:
+                    device.offline_until = device.started_at
+
+            def _send_chunk_state(self, status):
+                state = device.chunk_session or {}
+                self._send(status, json.dumps({'session': state.get('id', ""), 'offset': state.get('offset', 0),
+                                               'total': state.get('total', 0)}), "application/json")
+
+            def _post_chunk(self, params, length):
+                data = bytearray()
+                if length > MOCK_CHUNK_MAX:
+                    self._read_body(length, lambda chunk: None)
+                    self._send(413, "Chunk too large")
+                    return
+                offset, total = int(params.get("offset", 0)), int(params.get("total", 0))
+                state = device.chunk_session
+                reset_at = None
+                if state and state['id'] == params.get("session") and state['reset_at'] is not None \
+                        and offset < state['reset_at'] <= offset + length:
+                    reset_at = max(1, state['reset_at'] - offset)
+                    state['reset_at'] = None
+                if not self._read_body(length, data.extend, reset_at):
+                    return
+                device._count('chunks')
+
+                if offset == 0:
+                    # A new (or restarted) session discards any half-written image.
+                    encoding = params.get("encoding")
+                    if device.max_image_size and encoding is None and total > device.max_image_size:
+                        device._count('failed_uploads')
+                        self._send(413, MOCK_FAILURE_MESSAGES[413])
+                        return
+                    device._count('uploads')
+                    device.chunk_session = state = {
+                        'id': params.get("session"), 'offset': 0, 'total': total, 'encoding': encoding,
+                        'sink': _ImageSink("", total, encoding if encoding and device.accepts(encoding) else None,
+                                           device.image),
+                        'reset_at': total // 2 if device.random.random() < device.reset_rate else None,
+                    }
+                if not state or state['id'] != params.get("session") or state['offset'] != offset:
+                    device._count('rejected_chunks')
+                    self._send_chunk_state(409)
+                    return
+                if zlib.crc32(data) != int(params.get("crc", "0"), 16):
+                    device._count('rejected_chunks')
+                    self._send_chunk_state(422)
+                    return
+                try:
+                    state['sink'].feed(bytes(data))
+                except (zlib.error, DeltaError):
+                    state['sink'] = None
+                state['offset'] += len(data)
+                if state['sink'] is not None and state['offset'] < state['total']:
+                    self._send_chunk_state(200)
+                    return
+                device.chunk_session = None
+                self._finish_update(state['sink'], state['encoding'], state['sink'].size if state['sink'] else 0)
+
+            def do_POST(self):
+                if not self._begin():
+                    return
+                path, _, query = self.path.partition("?")
+                params = dict(p.partition("=")[::2] for p in query.split("&") if p)
+                length = int(self.headers.get("Content-Length") or 0)
+                if path == "/config":
+                    self.rfile.read(length)
+                    self._send(200, "Config received")
+                    return
+                if path == "/update/chunk" and "chunked" in device.capabilities:
+                    self._post_chunk(params, length)
+                    return
+                if path != "/update":
+                    self.rfile.read(length)
+                    self._send(404, "Not found")
+                    return
+
+                device._count('uploads')
+                encoding = params.get("encoding")
+                sink = _ImageSink(self.headers.get("Content-Type", ""), length,
+                                  encoding if encoding and device.accepts(encoding) else None, device.image)
+
+                def feed(chunk):
+                    nonlocal sink
+                    try:
+                        if sink:
+                            sink.feed(chunk)
+                    except (zlib.error, DeltaError):
+                        sink = None
+
+                reset_at = length // 2 if device.random.random() < device.reset_rate else None
+                if self._read_body(length, feed, reset_at):
+                    self._finish_update(sink, encoding, length)
+
+        return Handler
+
+class MockMdnsResponder:
+    """Answers ``_ota._tcp`` PTR queries for a set of MockDevices on one interface.
+
+    Queries from port 5353 are answered by multicast, others by unicast to
+    the querier (legacy unicast). start() announces every device and stop()
+    sends goodbyes (TTL 0), as ESPmDNS does when a device joins or leaves.
+    """
+
+    def __init__(self, devices, interface="127.0.0.1", ttl=120):
+        self.devices = list(devices)
+        self.interface = interface
+        self.ttl = ttl
+        self.queries = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, "SO_REUSEPORT"):
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.sock.bind(("", mdns.MDNS_PORT))
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                             socket.inet_aton(mdns.MDNS_ADDRESS) + socket.inet_aton(interface))
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(interface))
+        self.sock.settimeout(0.2)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _records(self, device, ttl):
+        label = f"{device.name}-{device.host.rsplit('.', 1)[-1]}-{device.port}"
+        instance = f"{label}.{mdns.OTA_SERVICE}"
+        host = f"esp32-ota-{device.host.replace('.', '-')}-{device.port}.local"
+        answers = [{'name': mdns.OTA_SERVICE, 'type': mdns.TYPE_PTR, 'ttl': ttl, 'data': instance}]
+        additional = [
+            {'name': instance, 'type': mdns.TYPE_SRV, 'ttl': ttl, 'flush': True,
+             'data': {'port': device.port, 'target': host}},
+            {'name': instance, 'type': mdns.TYPE_TXT, 'ttl': ttl, 'flush': True,
+             'data': {'name': device.name, 'version': device.version, 'caps': ",".join(device.capabilities)}},
+            {'name': host, 'type': mdns.TYPE_A, 'ttl': ttl, 'flush': True, 'data': device.host},
+        ]
+        return answers, additional
+
+    def _message(self, ttl, questions=(), message_id=0):
+        answers, additional = [], []
+        for device in self.devices:
+            a, extra = self._records(device, ttl)
+            answers += a
+            additional += extra
+        return mdns.build_message(questions, answers, additional, response=True, message_id=message_id)
+
+    def announce(self, ttl=None):
+        self.sock.sendto(self._message(self.ttl if ttl is None else ttl), (mdns.MDNS_ADDRESS, mdns.MDNS_PORT))
+
+    def _serve(self):
+        while not self._stop.is_set():
+            try:
+                data, source = self.sock.recvfrom(9000)
+                message = mdns.parse_message(data)
+            except (socket.timeout, ValueError):
+                continue
+            except OSError:
+                return
+            questions = [(name, qtype) for name, qtype in message['questions']
+                         if qtype == mdns.TYPE_PTR and name.lower().rstrip(".") == mdns.OTA_SERVICE]
+            if message['response'] or not questions:
+                continue
+            self.queries += 1
+            if source[1] == mdns.MDNS_PORT:
+                self.announce()
+            else:
+                self.sock.sendto(self._message(self.ttl, questions, message['id']), source)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+        self.announce()
+        return self
+
+    def stop(self):
+        try:
+            self.announce(ttl=0)
+        except OSError:
+            pass
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.sock.close()
+
+class MockFleet:
+    """A set of MockDevices on distinct loopback addresses or ports.
+
+    On Linux every 127.0.0.0/8 address is local, so devices get their own
+    address (``first_host``, +1, ...) on ``port``, which lets the scanner
+    sweep them like a real subnet. Elsewhere they share 127.0.0.1 and use
+    consecutive ports. ``shared_bandwidth`` (bytes/s) caps all uploads
+    together, modelling one access point. ``mdns`` starts a
+    MockMdnsResponder for the fleet on 127.0.0.1.
+    """
+
+    def __init__(self, count, first_host="127.0.0.10", port=8080, shared_bandwidth=0, mdns=False,
+                 **device_options):
+        self.shared_pacer = Pacer(shared_bandwidth) if shared_bandwidth else None
+        self.mdns = mdns
+        self.responder = None
+        self.devices = []
+        base, first = first_host.rsplit(".", 1)
+        per_address = sys.platform.startswith("linux")
+        for i in range(count):
+            host = f"{base}.{int(first) + i}" if per_address else "127.0.0.1"
+            device_port = port if per_address else port + i
+            self.devices.append(MockDevice(host, device_port, shared_pacer=self.shared_pacer,
+                                           seed=i, **device_options))
+
+    @property
+    def addresses(self):
+        return [device.address for device in self.devices]
+
+    def start(self):
+        for device in self.devices:
+            device.start()
+        if self.mdns:
+            self.responder = MockMdnsResponder(self.devices).start()
+        return self
+
+    def stop(self):
+        if self.responder:
+            self.responder.stop()
+            self.responder = None
+        for device in self.devices:
+            device.stop()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
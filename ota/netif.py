@@ -0,0 +1,80 @@
+"""Local IPv4 interfaces, without trusting gethostbyname(gethostname()).
+
+On many Linux installs the hostname resolves to 127.0.1.1 (the Debian
+/etc/hosts convention), so a subnet guessed from it is a loopback /24.
+These helpers ask the routing table and the interfaces instead.
+"""
+import socket
+import struct
+import sys
+
+# ioctl requests from <linux/sockios.h>
+SIOCGIFADDR = 0x8915
+SIOCGIFNETMASK = 0x891B
+
+def primary_ipv4_address():
+    """Address of the interface that carries the default route, or None.
+
+    connect() on a UDP socket only selects a route; no packet is sent.
+    """
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.connect(("192.0.2.1", 9))  # TEST-NET-1, never actually contacted
+            address = s.getsockname()[0]
+        if not address.startswith("127.") and address != "0.0.0.0":
+            return address
+    except OSError:
+        pass
+    for address in _hostname_addresses():
+        return address
+    return None
+
+def _hostname_addresses():
+    try:
+        infos = socket.getaddrinfo(socket.gethostname(), None, socket.AF_INET)
+    except OSError:
+        return []
+    addresses = []
+    for info in infos:
+        address = info[4][0]
+        if not address.startswith("127.") and address not in addresses:
+            addresses.append(address)
+    return addresses
+
+def _linux_interfaces():
+    import fcntl
+
+    found = []
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        for _, name in socket.if_nameindex():
+            request = struct.pack("256s", name.encode()[:15])
+            try:
+                address = socket.inet_ntoa(fcntl.ioctl(s.fileno(), SIOCGIFADDR, request)[20:24])
+                netmask = fcntl.ioctl(s.fileno(), SIOCGIFNETMASK, request)[20:24]
+            except OSError:
+                continue  # down, or no IPv4 address
+            prefix = bin(int.from_bytes(netmask, "big")).count("1")
+            found.append({'name': name, 'address': address, 'prefix': prefix})
+    return found
+
+def interface_addresses(include_loopback=False):
+    """IPv4 interfaces as dicts with ``name``, ``address`` and ``prefix`` (netmask length).
+
+    On Linux every interface with an IPv4 address is listed. Elsewhere the
+    default-route address and the hostname's addresses are returned with
+    ``name`` None and an assumed /24.
+    """
+    found = []
+    if sys.platform.startswith("linux"):
+        try:
+            found = _linux_interfaces()
+        except (OSError, ImportError):
+            found = []
+    if not found:
+        primary = primary_ipv4_address()
+        addresses = ([primary] if primary else []) + _hostname_addresses()
+        found = [{'name': None, 'address': address, 'prefix': 24}
+                 for i, address in enumerate(addresses) if address not in addresses[:i]]
+    if not include_loopback:
+        found = [iface for iface in found if not iface['address'].startswith("127.")]
+    return found
@@ -0,0 +1,127 @@
+"""Background /info poller that keeps an up-to-date view of the saved fleet."""
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+from .device import get_device_info, record_device_info
+
+# Poller tuning (overridable via app_config.json)
+DEFAULT_POLL_INTERVAL = 30
+DEFAULT_POLL_CONCURRENCY = 8
+POLL_JITTER = 0.2
+POLL_MAX_BACKOFF = 300
+POLL_FIELDS = ('online', 'name', 'version')
+POLL_DETAIL_FIELDS = ('uptime', 'rssi')  # reported, but change on every poll
+
+class DevicePoller:
+    """Refresh /info for every target device on a jittered schedule.
+
+    ``get_targets()`` is called each cycle, so devices added to or removed
+    from ips.json are picked up automatically. Online devices are polled
+    every ``interval`` seconds (+/- POLL_JITTER); offline devices back off
+    exponentially up to POLL_MAX_BACKOFF. At most ``concurrency`` requests
+    are in flight at once.
+
+    As each poll completes, ``on_change(changes)`` is called from the poller
+    thread with ``{ip: state}`` if one of that device's POLL_FIELDS changed,
+    so a slow or offline device never delays updates for the others. The
+    state also carries the POLL_DETAIL_FIELDS and ``checked`` (ISO
+    timestamp), which change on every poll and are not pushed on their own.
+    Version or name changes are also written to device_versions.json.
+    """
+
+    def __init__(self, get_targets, interval=DEFAULT_POLL_INTERVAL, concurrency=DEFAULT_POLL_CONCURRENCY,
+                 on_change=None):
+        self.get_targets = get_targets
+        self.interval = interval
+        self.concurrency = concurrency
+        self.on_change = on_change
+        self._states = {}
+        self._failures = {}
+        self._next_due = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="device-poller", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def poll_now(self, ips=None):
+        """Make ``ips`` (default: all targets) due immediately."""
+        with self._lock:
+            for ip in ips if ips is not None else list(self._next_due):
+                self._next_due[ip] = 0.0
+        self._wake.set()
+
+    def get(self, ip):
+        """Last known state for ``ip``, or None if it has not been polled yet."""
+        with self._lock:
+            state = self._states.get(ip)
+            return dict(state) if state else None
+
+    def snapshot(self):
+        with self._lock:
+            return {ip: dict(state) for ip, state in self._states.items()}
+
+    def _delay(self, ip):
+        failures = self._failures.get(ip, 0)
+        base = min(self.interval * (2 ** failures), POLL_MAX_BACKOFF) if failures else self.interval
+        return base * random.uniform(1 - POLL_JITTER, 1 + POLL_JITTER)
+
+    def _poll_one(self, ip):
+        info = get_device_info(ip)
+        state = {'online': info is not None, 'checked': datetime.now().isoformat()}
+        if info:
+            state.update({field: info.get(field) for field in POLL_FIELDS + POLL_DETAIL_FIELDS if field != 'online'})
+        return ip, state
+
+    def _run(self):
+        with ThreadPoolExecutor(max_workers=max(1, int(self.concurrency))) as pool:
+            while not self._stop.is_set():
+                try:
+                    targets = list(dict.fromkeys(self.get_targets()))
+                except Exception:
+                    targets = []
+                now = time.monotonic()
+                with self._lock:
+                    for ip in list(self._states):
+                        if ip not in targets:
+                            self._states.pop(ip, None)
+                            self._next_due.pop(ip, None)
+                            self._failures.pop(ip, None)
+                    due = [ip for ip in targets if self._next_due.get(ip, 0.0) <= now]
+
+                futures = [pool.submit(self._poll_one, ip) for ip in due]
+                for future in as_completed(futures):
+                    ip, state = future.result()
+                    with self._lock:
+                        previous = self._states.get(ip) or {}
+                        if state['online']:
+                            self._failures.pop(ip, None)
+                        else:
+                            # Keep the last known identity while the device is unreachable
+                            state.update({k: previous.get(k) for k in ('name', 'version') if previous.get(k)})
+                            self._failures[ip] = self._failures.get(ip, 0) + 1
+                        self._states[ip] = state
+                        self._next_due[ip] = time.monotonic() + self._delay(ip)
+                    if state['online'] and (previous.get('version') != state.get('version')
+                                            or previous.get('name') != state.get('name')):
+                        record_device_info(ip, state)
+                    if self.on_change and any(previous.get(field) != state.get(field) for field in POLL_FIELDS):
+                        self.on_change({ip: dict(state)})
+
+                with self._lock:
+                    pending = [self._next_due.get(ip, 0.0) for ip in targets]
+                wait = max(0.5, min(pending) - time.monotonic()) if pending else self.interval
+                self._wake.wait(min(wait, self.interval))
+                self._wake.clear()
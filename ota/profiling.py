@@ -0,0 +1,342 @@
+"""Opt-in profiling of uploads, scans and rollouts, with one report file per operation.
+
+Set ``profiling`` in app_config.json (or, for one run, pass ``--profile``
+to ``python -m ota``; see set_profiling_override()) to one of:
+
+  off          nothing is measured (default)
+  timers       hot-path timers only: checksum, compression, HTTP, rate
+               limiting, JSON store writes, history writes, GUI event pumps
+  cprofile     timers plus a cProfile of the operation's threads
+  memory       timers plus tracemalloc allocation sites and peak
+  full         all of the above
+
+Each profiled operation (upload_to_device, rollout_firmware,
+adaptive_rollout, scans) writes ``profiles/<time>-<kind>[-<label>].txt``
+when it ends, and cProfile modes also ``.prof`` for pstats or snakeviz.
+Timers are inclusive (``checksum`` contains ``checksum.hash``, for
+instance) and cost one check of a module flag while no operation is being
+profiled.
+"""
+import cProfile
+import functools
+import io
+import os
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from datetime import datetime
+
+PROFILING_MODES = ("off", "timers", "cprofile", "memory", "full")
+
+# Profiling tuning (overridable via app_config.json)
+PROFILING_MAX_REPORTS = 100
+PROFILING_TOP = 25
+PROFILING_TRACE_FRAMES = 8
+
+_current = ContextVar("ota_profile_operation", default=None)
+_lock = threading.Lock()
+_active = 0  # operations being profiled; timers are free while this is 0
+_totals = {}  # process-wide timers, {name: [count, seconds, max]}
+_tracing = 0  # operations that asked for tracemalloc
+_recent_reports = deque(maxlen=64)
+_NULL_TIMER = nullcontext()
+_override = None  # mode set for this process only, e.g. by --profile
+
+def set_profiling_override(mode):
+    """Use ``mode`` instead of the ``profiling`` setting for the rest of this process (None to stop).
+
+    Unlike changing app_config, the override is never saved with the settings.
+    """
+    global _override
+    _override = mode
+
+def profiling_mode():
+    """The override or the ``profiling`` setting as one of PROFILING_MODES (``true`` means ``timers``)."""
+    # Imported here: storage itself uses the timers below
+    from .storage import app_config
+
+    mode = _override if _override is not None else app_config.get('profiling', "off")
+    if mode is True:
+        return "timers"
+    return mode if mode in PROFILING_MODES else "off"
+
+def _add(timers, name, seconds):
+    entry = timers.get(name)
+    if entry is None:
+        timers[name] = [1, seconds, seconds]
+    else:
+        entry[0] += 1
+        entry[1] += seconds
+        if seconds > entry[2]:
+            entry[2] = seconds
+
+def _record(name, seconds):
+    op = _current.get()
+    with _lock:
+        _add(_totals, name, seconds)
+        if op is not None:
+            _add(op.timers, name, seconds)
+
+class _Timer:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        _record(self.name, time.perf_counter() - self.start)
+        return False
+
+def hot_path(name):
+    """Context manager that times a block as ``name`` while an operation is being profiled."""
+    if not _active:
+        return _NULL_TIMER
+    return _Timer(name)
+
+def timed(name):
+    """Decorator form of hot_path()."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _active:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _record(name, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorate
+
+class Operation:
+    """One profiled upload, scan or rollout: its timers, profiles and memory snapshots."""
+
+    def __init__(self, kind, label, mode):
+        self.kind = kind
+        self.label = label
+        self.mode = mode
+        self.timers = {}
+        self.started = datetime.now()
+        self.report_path = None
+        self.notes = []
+        self._start = time.perf_counter()
+        self._totals_start = {}
+        self._stats = None
+        self._stats_lock = threading.Lock()
+        self._profiler = None
+        self._snapshot = None
+        self._traced_start = 0
+
+    @property
+    def cprofile(self):
+        return self.mode in ("cprofile", "full")
+
+    @property
+    def memory(self):
+        return self.mode in ("memory", "full")
+
+    def start_profiler(self):
+        """A running cProfile.Profile for the current thread, or None if it cannot be enabled."""
+        if not self.cprofile:
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Python 3.12+ allows one active profiler per process
+            self._note("cProfile skipped for some threads: another profiler was active")
+            return None
+        return profiler
+
+    def add_profile(self, profiler):
+        profiler.disable()
+        stats = pstats.Stats(profiler)  # built outside the lock, it walks every profiled function
+        with self._stats_lock:
+            if self._stats is None:
+                self._stats = stats
+            else:
+                self._stats.add(stats)
+
+    def _note(self, text):
+        with self._stats_lock:
+            if text not in self.notes:
+                self.notes.append(text)
+
+def bind(fn):
+    """Wrap ``fn`` so that calls on worker threads count towards the caller's operation.
+
+    Use it for pool submissions inside a profiled operation; threads do not
+    inherit it otherwise. Returns ``fn`` itself when nothing is profiled.
+    """
+    op = _current.get()
+    if op is None:
+        return fn
+
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        token = _current.set(op)
+        profiler = op.start_profiler()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            if profiler:
+                op.add_profile(profiler)
+            _current.reset(token)
+
+    return run
+
+@contextmanager
+def profile_operation(kind, label=None):
+    """Profile the block as one ``kind`` operation and write its report when it ends.
+
+    Yields the Operation, or None when profiling is off. Inside another
+    operation the block is only timed, as ``kind``.
+    """
+    global _active, _tracing
+    if _current.get() is not None:
+        with _Timer(kind):
+            yield _current.get()
+        return
+    mode = profiling_mode()
+    if mode == "off":
+        yield None
+        return
+
+    op = Operation(kind, label, mode)
+    with _lock:
+        _active += 1
+        op._totals_start = {name: list(entry) for name, entry in _totals.items()}
+        if op.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(PROFILING_TRACE_FRAMES)
+            if _tracing == 0:
+                tracemalloc.reset_peak()
+            _tracing += 1
+    if op.memory:
+        op._snapshot = tracemalloc.take_snapshot()
+        op._traced_start = tracemalloc.get_traced_memory()[0]
+    token = _current.set(op)
+    op._profiler = op.start_profiler()
+    try:
+        yield op
+    finally:
+        if op._profiler:
+            op.add_profile(op._profiler)
+        _current.reset(token)
+        wall = time.perf_counter() - op._start
+        memory = None
+        if op.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            memory = (current - op._traced_start, peak, tracemalloc.take_snapshot())
+        with _lock:
+            _active -= 1
+            window = {}
+            for name, (count, seconds, longest) in _totals.items():
+                count0, seconds0, _ = op._totals_start.get(name, (0, 0.0, 0.0))
+                if count > count0:
+                    # The longest call is only known to fall in the window if the timer first ran in it
+                    window[name] = [count - count0, seconds - seconds0, longest if not count0 else None]
+            if op.memory:
+                _tracing -= 1
+                if _tracing == 0:
+                    tracemalloc.stop()
+        try:
+            write_report(op, wall, window, memory)
+        except OSError:
+            pass  # profiling must never fail the operation
+
+def profiled(kind):
+    """Decorator: run the function as a ``kind`` operation, labelled by its first argument if it is a string."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            label = args[0] if args and isinstance(args[0], str) else None
+            with profile_operation(kind, label):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+def profiles_dir():
+    from .storage import DATA_DIR, app_config
+
+    return app_config.get('profiling_dir') or os.path.join(DATA_DIR, "profiles")
+
+def _format_timers(lines, title, timers, wall):
+    lines.append(title)
+    if not timers:
+        lines.append("  (none)")
+        return
+    lines.append(f"  {'name':<24} {'count':>7} {'total s':>10} {'avg ms':>9} {'max ms':>9} {'% wall':>7}")
+    for name, (count, seconds, longest) in sorted(timers.items(), key=lambda item: -item[1][1]):
+        share = seconds * 100 / wall if wall > 0 else 0
+        longest = f"{longest * 1000:.2f}" if longest is not None else "-"
+        lines.append(f"  {name:<24} {count:>7} {seconds:>10.4f} {seconds * 1000 / count:>9.2f} "
+                     f"{longest:>9} {share:>6.1f}%")
+
+def write_report(op, wall, window, memory=None):
+    """Write an operation's report (and .prof) to profiles_dir(); returns the report path."""
+    from .storage import app_config
+
+    directory = profiles_dir()
+    os.makedirs(directory, exist_ok=True)
+    name = f"{op.started:%Y%m%d-%H%M%S-%f}-{op.kind}"
+    if op.label:
+        name += "-" + re.sub(r"[^\w.-]", "_", op.label)
+    base = os.path.join(directory, name)
+
+    lines = [f"ota profile: {op.kind}" + (f" {op.label}" if op.label else ""),
+             f"started {op.started.isoformat()} • {wall:.3f}s wall • mode {op.mode} • pid {os.getpid()}", ""]
+    _format_timers(lines, "Timers for this operation (inclusive, all of its threads):", op.timers, wall)
+    lines.append("")
+    _format_timers(lines, "Process-wide timers while it ran (other uploads, GUI event pump):", window, wall)
+    if op._stats is not None:
+        op._stats.dump_stats(base + ".prof")
+        out = io.StringIO()
+        op._stats.stream = out
+        op._stats.sort_stats("cumulative").print_stats(PROFILING_TOP)
+        lines += ["", f"cProfile, top {PROFILING_TOP} by cumulative time (all stats: {os.path.basename(base)}.prof):",
+                  out.getvalue().strip("\n")]
+    if memory:
+        growth, peak, snapshot = memory
+        lines += ["", f"Memory (tracemalloc, whole process): {growth / 1024:+.1f} KiB traced during the "
+                      f"operation, peak {peak / (1024 * 1024):.2f} MiB",
+                  f"Top {PROFILING_TOP} allocation sites by growth:"]
+        for stat in snapshot.compare_to(op._snapshot, "lineno")[:PROFILING_TOP]:
+            lines.append(f"  {stat}")
+    if op.notes:
+        lines += [""] + [f"Note: {note}" for note in op.notes]
+
+    with open(base + ".txt", "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    op.report_path = base + ".txt"
+    with _lock:
+        _recent_reports.append(op.report_path)
+    _prune(directory, app_config.get('profiling_max_reports', PROFILING_MAX_REPORTS))
+    return op.report_path
+
+def _prune(directory, max_reports):
+    reports = sorted(name for name in os.listdir(directory) if name.endswith(".txt"))
+    for name in reports[:max(0, len(reports) - max_reports)]:
+        for path in (name, name[:-4] + ".prof"):
+            try:
+                os.remove(os.path.join(directory, path))
+            except OSError:
+                pass
+
+def recent_reports():
+    """Report paths written by this process, oldest first."""
+    with _lock:
+        return list(_recent_reports)
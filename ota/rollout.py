@@ -0,0 +1,227 @@
+"""Adaptive fleet rollouts: a canary wave, then AIMD-controlled concurrency.
+
+A fixed parallelism either under-uses the network or, with many devices
+behind one access point, overloads it until uploads time out. The
+adaptive scheduler flashes a small canary wave first and waits for the
+canaries to come back with the new firmware. It then adjusts the number
+of concurrent uploads the way TCP adjusts its window. After every
+"window" of completed uploads it compares aggregate throughput with the
+previous window:
+  * noticeably higher: one more concurrent upload (additive increase), or
+    twice as many until the first plateau or decrease (slow start)
+  * noticeably lower, or a connection error or timeout: halve it
+    (multiplicative decrease)
+  * about the same: keep it; the network is saturated
+The rollout stops, skipping devices not yet started, when a canary fails or
+the failure rate crosses a threshold.
+"""
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+from .checksum import calculate_checksum
+from .profiling import bind, profiled
+from .shaping import global_rate_limit
+from .storage import app_config
+from .upload import DEFAULT_ROLLOUT_PARALLELISM, format_rate, upload_to_device
+from .verify import verify_update, verify_workers
+
+# Adaptive rollout tuning (overridable via app_config.json)
+ROLLOUT_CANARY_SIZE = 2
+ROLLOUT_MAX_CONCURRENCY = 16
+ROLLOUT_MAX_FAILURE_RATE = 0.25
+ROLLOUT_MIN_SAMPLES = 4
+AIMD_INCREASE = 1
+AIMD_DECREASE = 0.5
+AIMD_GAIN_THRESHOLD = 0.05
+AIMD_DROP_THRESHOLD = 0.2
+NETWORK_ERRORS = ("ConnectionError", "TimeoutError")
+
+class ConcurrencyController:
+    """AIMD window over concurrent uploads, driven by per-window aggregate throughput."""
+
+    def __init__(self, initial=DEFAULT_ROLLOUT_PARALLELISM, maximum=ROLLOUT_MAX_CONCURRENCY):
+        self.maximum = max(1, int(maximum))
+        self.limit = min(max(1, int(initial)), self.maximum)
+        self.history = [(0.0, self.limit)]
+        self._start = time.monotonic()
+        self._window_start = self._start
+        self._window_bytes = 0
+        self._window_count = 0
+        self._last_rate = None
+        self._last_decrease = self._start
+        self._slow_start = True
+
+    def restart_window(self):
+        """Start a fresh measurement window, e.g. after a pause between waves."""
+        self._window_start = time.monotonic()
+        self._window_bytes = self._window_count = 0
+
+    def _set(self, limit):
+        limit = min(max(1, int(limit)), self.maximum)
+        if limit != self.limit:
+            self.limit = limit
+            self.history.append((time.monotonic() - self._start, limit))
+
+    def _decrease(self):
+        self._slow_start = False
+        self._set(self.limit * AIMD_DECREASE)
+        self._last_decrease = time.monotonic()
+        self._window_start = self._last_decrease
+        self._window_bytes = self._window_count = 0
+
+    def record(self, result, started_at):
+        """Feed one finished upload; ``started_at`` is its monotonic start time."""
+        if result['status'] != "success":
+            # Only one decrease per congestion event: ignore failures of uploads
+            # that were already running when the window was last cut.
+            if result['error_type'] in NETWORK_ERRORS and started_at >= self._last_decrease:
+                self._decrease()
+            return
+        self._window_bytes += result['wire_bytes']
+        self._window_count += 1
+        if self._window_count < self.limit:
+            return
+        now = time.monotonic()
+        rate = self._window_bytes / (now - self._window_start) if now > self._window_start else 0.0
+        if self._last_rate is None or rate >= self._last_rate * (1 + AIMD_GAIN_THRESHOLD):
+            self._set(self.limit * 2 if self._slow_start else self.limit + AIMD_INCREASE)
+        elif rate < self._last_rate * (1 - AIMD_DROP_THRESHOLD):
+            self._decrease()
+            self._last_rate = rate
+            return
+        else:
+            self._slow_start = False
+        self._last_rate = rate
+        self._window_start = now
+        self._window_bytes = self._window_count = 0
+
+@profiled("rollout")
+def adaptive_rollout(ips, file_path, max_parallelism=None, canary=None, max_failure_rate=None, checksum=None,
+                     on_state=None, compression=None, compute_checksum=False, verify=None, expected_version=None,
+                     delta=None):
+    """Flash a fleet with a canary wave and adaptive concurrency (see module docstring).
+
+    ``max_parallelism`` caps the window (default: ``rollout_max_concurrency``),
+    ``canary`` is the size of the first wave (``rollout_canary``, 0 to skip)
+    and ``max_failure_rate`` the fraction of failed or unverified devices,
+    after ROLLOUT_MIN_SAMPLES, that stops the rollout
+    (``rollout_max_failure_rate``). Devices that are never started get the
+    ``skipped`` state.
+
+    Returns the same summary as rollout_firmware() (throughput covers the
+    uploads, not the wait for the canaries' reboot) plus ``stopped`` (the
+    reason, or None), ``skipped`` and ``concurrency`` (the window over time
+    as ``(seconds, limit)`` pairs).
+    """
+    max_parallelism = max_parallelism or app_config.get('rollout_max_concurrency', ROLLOUT_MAX_CONCURRENCY)
+    canary = canary if canary is not None else app_config.get('rollout_canary', ROLLOUT_CANARY_SIZE)
+    max_failure_rate = (max_failure_rate if max_failure_rate is not None
+                        else app_config.get('rollout_max_failure_rate', ROLLOUT_MAX_FAILURE_RATE))
+    verify = verify if verify is not None else app_config.get('verify_reboot', True)
+
+    start_time = time.monotonic()
+    results, skipped = [], []
+    outcomes = {}
+    stopped = None
+    pending = deque(ips)
+    canaries = [pending.popleft() for _ in range(min(max(0, int(canary)), len(pending)))]
+    controller = ConcurrencyController(initial=max(1, len(canaries) or ROLLOUT_CANARY_SIZE),
+                                       maximum=max_parallelism)
+    hash_pool = None
+    if checksum is None and compute_checksum:
+        hash_pool = ThreadPoolExecutor(max_workers=1)
+        checksum = hash_pool.submit(bind(calculate_checksum), file_path)
+    pool = ThreadPoolExecutor(max_workers=controller.maximum)
+    verify_pool = ThreadPoolExecutor(max_workers=verify_workers(len(ips))) if verify else None
+    uploads, verifications = {}, {}
+    last_upload_end = start_time
+
+    def failure_rate():
+        failed = sum(1 for ok in outcomes.values() if not ok)
+        return failed / len(outcomes) if len(outcomes) >= ROLLOUT_MIN_SAMPLES else 0.0
+
+    def start(ip):
+        uploads[pool.submit(bind(upload_to_device), ip, file_path, checksum, on_state=on_state, on_progress=None,
+                            compression=compression, compute_checksum=False, verify=False,
+                            delta=delta)] = time.monotonic()
+
+    def handle(future):
+        nonlocal stopped, last_upload_end
+        if future in verifications:
+            result = verifications.pop(future)
+            outcomes[result['ip']] = (result['reboot'] or {}).get('status') == "verified"
+        else:
+            result = future.result()
+            last_upload_end = time.monotonic()
+            controller.record(result, uploads.pop(future))
+            results.append(result)
+            if result['status'] == "success" and verify_pool:
+                verifications[verify_pool.submit(bind(verify_update), result, result['device_info'],
+                                                 expected_version, on_state, time.monotonic())] = result
+            else:
+                outcomes[result['ip']] = result['status'] == "success"
+        if stopped is None and result['ip'] in canaries and outcomes.get(result['ip']) is False:
+            stopped = f"canary {result['ip']} failed"
+        elif stopped is None and failure_rate() > max_failure_rate:
+            stopped = f"failure rate {failure_rate():.0%} exceeded {max_failure_rate:.0%}"
+
+    def drain(until_idle):
+        while uploads or (verifications and until_idle):
+            done, _ = wait(list(uploads) + list(verifications), return_when=FIRST_COMPLETED)
+            for future in done:
+                handle(future)
+            if not until_idle:
+                return
+
+    try:
+        # Canary wave: all canaries must upload and come back before anything else starts
+        for ip in canaries:
+            start(ip)
+        drain(until_idle=True)
+        controller.restart_window()
+        while pending and stopped is None:
+            while pending and len(uploads) < controller.limit:
+                start(pending.popleft())
+            drain(until_idle=False)
+        drain(until_idle=True)
+    finally:
+        for ip in pending:
+            skipped.append(ip)
+            if on_state:
+                on_state(ip, "skipped", stopped or "rollout stopped")
+        pool.shutdown(wait=True)
+        if verify_pool:
+            verify_pool.shutdown(wait=False)
+        if hash_pool:
+            hash_pool.shutdown(wait=False)
+    if isinstance(checksum, Future):
+        checksum = checksum.result() if checksum.done() and not checksum.exception() else None
+
+    elapsed = time.monotonic() - start_time
+    bytes_sent = sum(r['bytes'] for r in results)
+    upload_elapsed = last_upload_end - start_time
+    return {
+        'verified': sum(1 for r in results if (r['reboot'] or {}).get('status') == "verified"),
+        'results': results,
+        'succeeded': sum(1 for r in results if r['status'] == "success"),
+        'elapsed': elapsed,
+        'bytes_sent': bytes_sent,
+        'throughput': bytes_sent / upload_elapsed if upload_elapsed > 0 else 0,
+        'wire_throughput': sum(r['wire_bytes'] for r in results) / upload_elapsed if upload_elapsed > 0 else 0,
+        'rate_limit': global_rate_limit() or None,
+        'checksum': checksum,
+        'stopped': stopped,
+        'skipped': skipped,
+        'concurrency': controller.history,
+    }
+
+def describe_rollout(summary, count, verify=True):
+    """One line with the outcome of a rollout to ``count`` devices, for the CLI and the rollout window."""
+    limit = (f", {format_rate(summary['wire_throughput'])} sent of {format_rate(summary['rate_limit'])} limit"
+             if summary.get('rate_limit') else "")
+    text = (f"{summary['succeeded']}/{count} succeeded in {summary['elapsed']:.1f}s "
+            f"({format_rate(summary['throughput'])} aggregate{limit})")
+    if verify:
+        text += f", {summary['verified']} verified after reboot"
+    return text
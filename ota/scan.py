@@ -0,0 +1,205 @@
+"""Concurrent subnet scan for ESP32 devices."""
+import ipaddress
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .device import check_device_online, get_device_info
+from .history import record_spans
+from .profiling import bind, profiled, timed
+from .storage import app_config
+from .netif import interface_addresses, primary_ipv4_address
+
+# Network scan tuning (overridable via app_config.json)
+DEVICE_PORT = 80
+DEFAULT_SCAN_CONCURRENCY = 64
+DEFAULT_SCAN_PROBE_TIMEOUT = 0.5
+DEFAULT_SCAN_RATE = 0
+SCAN_BATCH_SIZE = 256
+SCAN_MAX_HOSTS = 16384
+
+@timed("scan.connect")
+def probe_device_port(ip, port=DEVICE_PORT, timeout=DEFAULT_SCAN_PROBE_TIMEOUT):
+    """Fast TCP-connect pre-probe; True if the port accepts connections."""
+    try:
+        with socket.create_connection((ip, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+def device_address(ip, port=DEVICE_PORT):
+    """Address used in device URLs: the bare IP on port 80, otherwise ``ip:port``."""
+    return ip if port == DEVICE_PORT else f"{ip}:{port}"
+
+def _probe_scan_host(ip, probe_timeout, port=DEVICE_PORT):
+    """Probe a single host and return a device dict, or None if it is not an ESP32.
+
+    The dict's ``timings`` holds the seconds spent on the TCP probe, /status
+    and /info.
+    """
+    start = time.monotonic()
+    if not probe_device_port(ip, port=port, timeout=probe_timeout):
+        return None
+    probed = time.monotonic()
+    address = device_address(ip, port)
+    if not check_device_online(address):
+        return None
+    online = time.monotonic()
+    info = get_device_info(address)
+    timings = {'probe': probed - start, 'status': online - probed, 'info': time.monotonic() - online}
+    return {'ip': address, 'info': info, 'timings': timings}
+
+def local_subnet_hosts():
+    """The 254 host addresses of the /24 around this machine's address.
+
+    The address comes from the default route, not the hostname, which often
+    resolves to 127.0.1.1 on Linux.
+    """
+    local_ip = primary_ipv4_address() or socket.gethostbyname(socket.gethostname())
+    base_ip = ".".join(local_ip.split(".")[:-1])
+    return [f"{base_ip}.{i}" for i in range(1, 255)]
+
+def _interface_networks():
+    return {iface['name']: ipaddress.ip_network(f"{iface['address']}/{iface['prefix']}", strict=False)
+            for iface in interface_addresses(include_loopback=True) if iface['name']}
+
+def _expand_target(target, networks):
+    """Lazily expanded host addresses for one target: an interface name, a CIDR, ``a.b.c.d-e.f.g.h`` or one address."""
+    target = target.strip()
+    if target in networks:
+        network = networks[target]
+        return network.hosts() if network.prefixlen < 32 else [network.network_address]
+    if "-" in target:
+        first, last = (ipaddress.IPv4Address(part.strip()) for part in target.split("-", 1))
+        if last < first:
+            raise ValueError(f"empty address range: {target}")
+        return (ipaddress.IPv4Address(n) for n in range(int(first), int(last) + 1))
+    network = ipaddress.IPv4Network(target, strict=False)
+    return network.hosts() if network.prefixlen < 31 else iter(network)
+
+def plan_scan_targets(targets=None, max_hosts=SCAN_MAX_HOSTS):
+    """Expand scan targets into a de-duplicated list of host addresses.
+
+    ``targets`` may mix interface names (``eth0``: that interface's whole
+    subnet), CIDRs (``10.20.0.0/22``), ranges (``10.0.0.10-10.0.0.50``)
+    and single addresses. The default is the /24 around this machine.
+    This machine's own addresses are skipped. Raises ValueError for an
+    unknown target or a plan larger than ``max_hosts``.
+    """
+    if not targets:
+        return local_subnet_hosts()
+    networks = _interface_networks()
+    own = {iface['address'] for iface in interface_addresses(include_loopback=True)}
+    hosts, seen = [], set()
+    for target in targets:
+        try:
+            addresses = _expand_target(target, networks)
+        except ValueError as e:
+            raise ValueError(f"invalid scan target {target!r}: {e}") from None
+        for address in addresses:
+            ip = str(address)
+            if ip not in seen and ip not in own:
+                if len(hosts) >= max_hosts:
+                    raise ValueError(f"scan plan exceeds {max_hosts} addresses; narrow the targets "
+                                     "or raise scan_max_hosts")
+                seen.add(ip)
+                hosts.append(ip)
+    return hosts
+
+class _StartPacer:
+    """Spaces probe starts ``1/rate`` seconds apart across all workers (0 = no limit)."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def wait(self, cancel=None):
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next, now)
+            self._next = slot + 1.0 / self.rate
+            delay = slot - now
+        if delay > 0:
+            if cancel:
+                cancel.wait(delay)
+            else:
+                time.sleep(delay)
+
+@profiled("scan")
+def scan_network_for_devices(on_found=None, concurrency=DEFAULT_SCAN_CONCURRENCY,
+                             probe_timeout=DEFAULT_SCAN_PROBE_TIMEOUT, hosts=None, port=DEVICE_PORT,
+                             targets=None, rate=DEFAULT_SCAN_RATE, batch_size=SCAN_BATCH_SIZE,
+                             on_progress=None, cancel=None):
+    """Scan local network for ESP32 devices.
+
+    Hosts (``hosts``, or the plan_scan_targets() expansion of ``targets``,
+    by default the local /24) are probed by a bounded worker pool,
+    ``batch_size`` at a time. Thousands of addresses never mean thousands
+    of threads or queued futures. ``rate`` caps new probes per second (0
+    for no cap). Each host gets a cheap TCP connect on ``port`` first; only
+    hosts that accept it are asked for /status and /info.
+
+    ``on_found(device)`` is called from the scanning thread as soon as each
+    device is identified and ``on_progress(done, total)`` after every host.
+    Setting the ``cancel`` event stops the scan early and returns what was
+    found so far. The sweep time and each device's probe timings are stored
+    as ``scan`` spans. Invalid ``targets`` raise ValueError before anything
+    is probed; a network error ends the sweep with what was found so far.
+    """
+    if hosts is None and targets:
+        hosts = plan_scan_targets(targets, app_config.get('scan_max_hosts', SCAN_MAX_HOSTS))
+    devices, _ = sweep_hosts(hosts, on_found=on_found, concurrency=concurrency, probe_timeout=probe_timeout,
+                             port=port, rate=rate, batch_size=batch_size, on_progress=on_progress, cancel=cancel)
+    return devices
+
+def sweep_hosts(hosts=None, on_found=None, concurrency=DEFAULT_SCAN_CONCURRENCY,
+                probe_timeout=DEFAULT_SCAN_PROBE_TIMEOUT, port=DEVICE_PORT, rate=DEFAULT_SCAN_RATE,
+                batch_size=SCAN_BATCH_SIZE, on_progress=None, cancel=None):
+    """Probe ``hosts`` (default: the local /24) as scan_network_for_devices() does.
+
+    Returns ``(devices, swept)``; ``swept`` is False when the sweep was
+    cancelled or cut short by a network error, so hosts that did not answer
+    may not have been asked.
+    """
+    devices = []
+    start_time = time.monotonic()
+    swept = True
+    try:
+        if hosts is None:
+            hosts = local_subnet_hosts()
+        pacer = _StartPacer(rate)
+
+        @bind
+        def probe(ip):
+            pacer.wait(cancel)
+            if cancel is not None and cancel.is_set():
+                return None
+            return _probe_scan_host(ip, probe_timeout, port)
+
+        done = 0
+        with ThreadPoolExecutor(max_workers=max(1, int(concurrency))) as pool:
+            for first in range(0, len(hosts), max(1, int(batch_size))):
+                if cancel is not None and cancel.is_set():
+                    break
+                futures = [pool.submit(probe, ip) for ip in hosts[first:first + max(1, int(batch_size))]]
+                for future in as_completed(futures):
+                    device = future.result()
+                    done += 1
+                    if device:
+                        devices.append(device)
+                        if on_found:
+                            on_found(device)
+                    if on_progress:
+                        on_progress(done, len(hosts))
+        swept = cancel is None or not cancel.is_set()
+    except OSError:
+        swept = False  # no local address to sweep around, or the network went away mid-sweep
+    devices.sort(key=lambda d: socket.inet_aton(d['ip'].split(':')[0]))
+    spans = [(d['ip'], phase, seconds, True) for d in devices for phase, seconds in d['timings'].items()]
+    spans.append((None, "sweep", time.monotonic() - start_time, swept))
+    record_spans("scan", spans)
+    return devices, swept
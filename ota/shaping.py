@@ -0,0 +1,148 @@
+"""Token-bucket bandwidth shaping for firmware uploads.
+
+Every upload draws from one global bucket, shared by all uploads in the
+process (``upload_rate_limit``), and from a bucket for its device
+(``upload_device_rate_limits[address]``, else ``upload_device_rate_limit``).
+Limits are bytes/s, 0 for none, and may be written as "500k" or "2M".
+They are re-read from app_config while a transfer runs, so a limit changed
+mid-upload (e.g. from the GUI) applies within SHAPING_REFRESH seconds.
+"""
+import threading
+import time
+
+from .profiling import hot_path
+from .storage import app_config
+
+# Shaping tuning: a bucket holds SHAPING_BURST seconds of traffic (at least
+# SHAPING_MIN_BURST bytes); waits are sliced so a raised limit applies at once
+SHAPING_BURST = 0.25
+SHAPING_MIN_BURST = 4096
+SHAPING_REFRESH = 0.5
+SHAPING_MAX_SLEEP = 0.1
+
+def parse_rate(value):
+    """Parse a bandwidth such as 500k, 2M, 500kbps, 1MB/s, 125000 or 0 (unlimited) into bytes/s.
+
+    Units are bytes (k = 1024); an optional ``b/s``, ``bps``, ``/s`` or
+    ``b`` suffix is ignored. Raises ValueError.
+    """
+    if value is None:
+        return 0
+    if isinstance(value, (int, float)):
+        return max(0, int(value))
+    units = {'k': 1024, 'm': 1024 * 1024}
+    text = str(value).strip().lower()
+    for suffix in ("b/s", "bps", "/s", "b"):
+        if text.endswith(suffix):
+            text = text[:-len(suffix)].rstrip()
+            break
+    if text and text[-1] in units:
+        return max(0, int(float(text[:-1]) * units[text[-1]]))
+    return max(0, int(float(text or 0)))
+
+class TokenBucket:
+    """Byte token bucket refilled at ``rate`` bytes/s (0: unlimited).
+
+    consume() may overdraw the bucket and then waits until the debt is paid
+    back, so chunks larger than the burst still average out to ``rate``.
+    """
+
+    def __init__(self, rate=0):
+        self._lock = threading.Lock()
+        self.rate = 0
+        self.burst = SHAPING_MIN_BURST
+        self._tokens = 0.0
+        self._stamp = time.monotonic()
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        with self._lock:
+            self._refill()
+            self.rate = rate
+            self.burst = max(SHAPING_MIN_BURST, rate * SHAPING_BURST)
+            self._tokens = min(self._tokens, self.burst)
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate:
+            self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def consume(self, n, on_wait=None):
+        """Take ``n`` bytes of tokens, sleeping as long as the limit requires.
+
+        ``on_wait()`` is called between sleeps, e.g. to apply a new rate.
+        """
+        with self._lock:
+            self._refill()
+            if not self.rate:
+                return
+            self._tokens -= n
+        with hot_path("shaping.wait"):
+            while True:
+                with self._lock:
+                    self._refill()
+                    if not self.rate:
+                        self._tokens = max(self._tokens, 0.0)
+                        return
+                    if self._tokens >= 0:
+                        return
+                    wait = -self._tokens / self.rate
+                time.sleep(min(wait, SHAPING_MAX_SLEEP))
+                if on_wait:
+                    on_wait()
+
+_global_bucket = TokenBucket()
+_device_buckets = {}
+_buckets_lock = threading.Lock()
+
+def _config_rate(value):
+    try:
+        return parse_rate(value)
+    except (TypeError, ValueError):
+        return 0  # an unparsable setting is treated as no limit
+
+def global_rate_limit():
+    """The ``upload_rate_limit`` shared by all uploads, in bytes/s (0: unlimited)."""
+    return _config_rate(app_config.get('upload_rate_limit', 0))
+
+def rate_limits(ip):
+    """``(global, device)`` limits in bytes/s for uploads to ``ip`` (0: unlimited)."""
+    overrides = app_config.get('upload_device_rate_limits') or {}
+    device = overrides.get(ip, app_config.get('upload_device_rate_limit', 0))
+    return global_rate_limit(), _config_rate(device)
+
+class UploadShaper:
+    """Paces one upload through the global and the device bucket.
+
+    Call consume() with every block before it is sent. ``limit`` is the
+    tighter of the two current limits (None if neither is set); the
+    global one is shared with any other running upload.
+    """
+
+    def __init__(self, ip):
+        self.ip = ip
+        with _buckets_lock:
+            self._device_bucket = _device_buckets.setdefault(ip, TokenBucket())
+        self._refreshed = 0.0
+        self.limit = None
+        self.refresh()
+
+    def refresh(self):
+        """Pick up limits changed in app_config."""
+        self._refreshed = time.monotonic()
+        global_limit, device_limit = rate_limits(self.ip)
+        if _global_bucket.rate != global_limit:
+            _global_bucket.set_rate(global_limit)
+        if self._device_bucket.rate != device_limit:
+            self._device_bucket.set_rate(device_limit)
+        self.limit = min((rate for rate in (global_limit, device_limit) if rate), default=None)
+
+    def _maybe_refresh(self):
+        if time.monotonic() - self._refreshed >= SHAPING_REFRESH:
+            self.refresh()
+
+    def consume(self, n):
+        self._maybe_refresh()
+        self._device_bucket.consume(n, self._maybe_refresh)
+        _global_bucket.consume(n, self._maybe_refresh)
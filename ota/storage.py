@@ -0,0 +1,196 @@
+"""JSON-backed settings and device stores: app_config, ips and device versions.
+
+Every file is held by a JsonStore: parsed once, changed in memory under a
+lock and written back at most every ``store_write_delay`` seconds through a
+temporary file and os.replace(), so concurrent workers cannot interleave
+writes, a crash never leaves a half-written file, and a scan or rollout that
+updates a store hundreds of times only writes it a few times.
+"""
+import atexit
+import copy
+import json
+import os
+import threading
+
+from .profiling import hot_path
+
+# Data files live next to main.py unless OTA_DATA_DIR points elsewhere
+DATA_DIR = os.environ.get("OTA_DATA_DIR", os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+IPS_FILE = os.path.join(DATA_DIR, "ips.json")
+CONFIG_FILE = os.path.join(DATA_DIR, "app_config.json")
+VERSION_CACHE_FILE = os.path.join(DATA_DIR, "device_versions.json")
+
+# Store tuning (overridable via app_config.json)
+STORE_WRITE_DELAY = 0.5
+
+_stores = []
+
+class JsonStore:
+    """In-memory copy of one JSON file with locked updates and debounced, atomic writes.
+
+    ``default()`` provides the data for a missing or unreadable file, or one
+    whose contents fail ``validate``. The file is parsed again only when it
+    changed on disk (e.g. another ``python -m ota`` process saved it) while
+    no local changes are waiting to be written. Pending changes are flushed
+    at exit.
+    """
+
+    def __init__(self, path, default, validate=None, delay=None):
+        self.path = path
+        self.default = default
+        self.validate = validate
+        self.delay = delay
+        self.writes = 0
+        self._lock = threading.RLock()
+        self._write_lock = threading.Lock()
+        self._data = None
+        self._signature = None
+        self._dirty = False
+        self._timer = None
+        _stores.append(self)
+
+    def _file_signature(self):
+        try:
+            st = os.stat(self.path)
+            return st.st_mtime_ns, st.st_size
+        except OSError:
+            return None
+
+    def _current(self):
+        """The in-memory data, (re)read if the file changed; call with the lock held."""
+        if self._dirty:
+            return self._data
+        signature = self._file_signature()
+        if self._data is None or signature != self._signature:
+            data = None
+            if signature:
+                try:
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        data = json.load(f)
+                except (OSError, ValueError):
+                    data = None
+            if data is None or (self.validate and not self.validate(data)):
+                data = self.default()
+            self._data, self._signature = data, signature
+        return self._data
+
+    def load(self):
+        """A private copy of the data."""
+        with self._lock:
+            return copy.deepcopy(self._current())
+
+    def read(self, fn):
+        """Return ``fn(data)`` without copying; ``fn`` must neither keep nor change ``data``."""
+        with self._lock:
+            return fn(self._current())
+
+    def save(self, data):
+        """Replace the data; the file is written after the debounce delay."""
+        with self._lock:
+            self._data = copy.deepcopy(data)
+            self._schedule()
+
+    def update(self, fn):
+        """Atomically apply ``fn(data)``, which changes ``data`` in place, and return its result."""
+        with self._lock:
+            result = fn(self._current())
+            self._schedule()
+            return result
+
+    def _schedule(self):
+        self._dirty = True
+        if self._timer is None:
+            delay = self.delay if self.delay is not None else app_config.get('store_write_delay', STORE_WRITE_DELAY)
+            self._timer = threading.Timer(delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """Write pending changes now (a no-op if there are none)."""
+        with self._write_lock:
+            with self._lock:
+                if self._timer:
+                    self._timer.cancel()
+                    self._timer = None
+                if not self._dirty:
+                    return
+                text = json.dumps(self._data, indent=2)
+                self._dirty = False
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            try:
+                with hot_path("store.write"):
+                    with open(tmp_path, "w", encoding="utf-8") as f:
+                        f.write(text)
+                        f.flush()
+                        os.fsync(f.fileno())
+                    os.replace(tmp_path, self.path)
+            except OSError:
+                with self._lock:
+                    self._dirty = True  # keep the changes in memory; the next update retries
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+                return
+            with self._lock:
+                self.writes += 1
+                self._signature = self._file_signature()
+
+def flush_stores():
+    """Write every store's pending changes now."""
+    for store in _stores:
+        store.flush()
+
+atexit.register(flush_stores)
+
+_config_store = JsonStore(CONFIG_FILE, lambda: {'theme': 'dark', 'verify_checksum': True},
+                          lambda data: isinstance(data, dict))
+_versions_store = JsonStore(VERSION_CACHE_FILE, dict, lambda data: isinstance(data, dict))
+_ips_store = JsonStore(IPS_FILE, list, lambda data: isinstance(data, list))
+
+def load_config():
+    """Load app configuration."""
+    return _config_store.load()
+
+def save_config(config):
+    """Save app configuration."""
+    _config_store.save(config)
+
+def load_device_versions():
+    """Load cached device versions."""
+    return _versions_store.load()
+
+def save_device_versions(versions):
+    """Save device versions cache."""
+    _versions_store.save(versions)
+
+def update_device_versions(fn):
+    """Atomically change the device versions cache in place with ``fn(versions)``; returns its result."""
+    return _versions_store.update(fn)
+
+def load_ips():
+    """Load saved IPs from file."""
+    return _ips_store.load()
+
+def save_ips(ips):
+    """Save IPs to file."""
+    _ips_store.save(ips)
+
+def merge_ips(new_ips):
+    """Append addresses that are not saved yet; returns the ones that were added."""
+    def merge(ips):
+        added = [ip for i, ip in enumerate(new_ips) if ip not in ips and ip not in new_ips[:i]]
+        ips.extend(added)
+        return added
+
+    return _ips_store.update(merge)
+
+def remove_ips(addresses):
+    """Remove addresses from the saved list."""
+    def remove(ips):
+        ips[:] = [ip for ip in ips if ip not in addresses]
+
+    _ips_store.update(remove)
+
+# Shared, mutable settings; the GUI and the core read and update the same dict
+app_config = load_config()
@@ -0,0 +1,548 @@
+"""Streaming firmware uploads to one device or a whole fleet."""
+import os
+import time
+import uuid
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+
+import requests
+
+from .artifacts import store_artifact
+from .checksum import calculate_checksum
+from .compression import choose_upload_image, device_capabilities
+from .delta import DeltaError, choose_delta_image
+from .device import check_device_online, get_device_info, http_request, http_timeout, record_device_image
+from .history import log_upload
+from .profiling import bind, profiled
+from .shaping import UploadShaper, global_rate_limit
+from .storage import app_config
+from .verify import verify_update, verify_workers
+
+# Upload tuning
+UPLOAD_TIMEOUT = 120
+UPLOAD_CHUNK_SIZE = 64 * 1024
+PROGRESS_INTERVAL = 0.1
+DEFAULT_ROLLOUT_PARALLELISM = 4
+UPLOAD_ERROR_MESSAGES = {
+    400: "Invalid firmware file or corrupted upload",
+    413: "Firmware file too large for device",
+    500: "Device internal error during upload",
+}
+# File name suffix of the multipart part for each upload encoding
+ENCODING_SUFFIXES = {'gzip': ".gz", 'delta': ".delta", 'delta-gzip': ".delta.gz"}
+
+# Resumable upload tuning (overridable via app_config.json)
+RESUMABLE_CHUNK_SIZE = 32 * 1024
+RESUME_ATTEMPTS = 5
+RESUME_BACKOFF = 0.5
+CHUNK_TIMEOUT = 30
+
+class MultipartFileStream:
+    """Streaming multipart/form-data body for a single file field.
+
+    requests takes the Content-Length from ``len()`` and pulls the body
+    through ``read()``, so the image is read from disk in chunks and memory
+    stays flat no matter how large it is. ``on_progress(sent, total)`` is
+    called after every read with the body bytes handed to the socket. A
+    ``shaper`` (see ota.shaping) paces the reads to its rate limits.
+    """
+
+    def __init__(self, file_path, field_name="file", chunk_size=UPLOAD_CHUNK_SIZE, on_progress=None, file_name=None,
+                 shaper=None):
+        self.boundary = uuid.uuid4().hex
+        self.chunk_size = chunk_size
+        self.on_progress = on_progress
+        self.shaper = shaper
+        file_name = file_name or os.path.basename(file_path)
+        self._head = (
+            f"--{self.boundary}\r\n"
+            f'Content-Disposition: form-data; name="{field_name}"; filename="{file_name}"\r\n'
+            f"Content-Type: application/octet-stream\r\n\r\n"
+        ).encode("utf-8")
+        self._tail = f"\r\n--{self.boundary}--\r\n".encode("utf-8")
+        self.file_size = os.path.getsize(file_path)
+        self.total = len(self._head) + self.file_size + len(self._tail)
+        self.sent = 0
+        self._file = open(file_path, "rb")
+        self._pending = self._head
+        self._tail_queued = False
+
+    @property
+    def content_type(self):
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self):
+        return self.total
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(self.chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def read(self, size=-1):
+        """Return up to ``size`` body bytes (one chunk when size is negative)."""
+        if size is None or size < 0:
+            size = self.chunk_size
+        out = bytearray()
+        while len(out) < size:
+            if self._pending:
+                take = self._pending[:size - len(out)]
+                self._pending = self._pending[len(take):]
+                out += take
+                continue
+            data = self._file.read(size - len(out)) if not self._file.closed else b""
+            if data:
+                out += data
+                continue
+            if self._tail_queued:
+                break
+            self._file.close()
+            self._pending = self._tail
+            self._tail_queued = True
+        if out and self.shaper:
+            self.shaper.consume(len(out))
+        self.sent += len(out)
+        if out and self.on_progress:
+            self.on_progress(self.sent, self.total)
+        return bytes(out)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class TransferMeter:
+    """Derives instantaneous rate, average rate and ETA from byte counts.
+
+    ``limit`` is the target rate (bytes/s) the transfer is shaped to, if any.
+    """
+
+    def __init__(self, total, window=1.0, limit=None):
+        self.total = total
+        self.window = window
+        self.limit = limit
+        self.sent = 0
+        self.start_time = time.monotonic()
+        self._samples = deque([(self.start_time, 0)])
+
+    def update(self, sent):
+        now = time.monotonic()
+        self.sent = sent
+        self._samples.append((now, sent))
+        while len(self._samples) > 2 and now - self._samples[1][0] >= self.window:
+            self._samples.popleft()
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.start_time
+
+    @property
+    def average_rate(self):
+        elapsed = self.elapsed
+        return self.sent / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def instant_rate(self):
+        (t0, b0), (t1, b1) = self._samples[0], self._samples[-1]
+        return (b1 - b0) / (t1 - t0) if t1 > t0 else self.average_rate
+
+    @property
+    def eta(self):
+        rate = self.instant_rate or self.average_rate
+        return (self.total - self.sent) / rate if rate > 0 else None
+
+    def describe(self):
+        """Human readable progress line, e.g. for progress_label."""
+        eta = self.eta
+        return (f"{self.sent / (1024 * 1024):.2f} / {self.total / (1024 * 1024):.2f} MB • "
+                f"{format_rate(self.instant_rate)} now • {format_rate(self.average_rate)} avg • "
+                + (f"limit {format_rate(self.limit)} • " if self.limit else "")
+                + f"ETA {f'{eta:.0f}s' if eta is not None else '--'}")
+
+def format_rate(bytes_per_second):
+    """Format a transfer rate as KB/s or MB/s."""
+    if bytes_per_second >= 1024 * 1024:
+        return f"{bytes_per_second / (1024 * 1024):.2f} MB/s"
+    return f"{bytes_per_second / 1024:.1f} KB/s"
+
+def post_firmware(ip, file_path, timeout=UPLOAD_TIMEOUT, on_progress=None, encoding=None, file_name=None,
+                  shaper=None):
+    """Stream a firmware image to the device's /update endpoint and return the response.
+
+    ``encoding="gzip"`` tells the sketch to inflate the stream before
+    writing it to flash.
+    """
+    url = f"http://{ip}/update" + (f"?encoding={encoding}" if encoding else "")
+    with MultipartFileStream(file_path, on_progress=on_progress, file_name=file_name, shaper=shaper) as body:
+        try:
+            return http_request("POST", url, data=body, headers={'Content-Type': body.content_type},
+                                timeout=http_timeout(timeout))
+        except requests.exceptions.Timeout:
+            raise TimeoutError(f"Upload timed out after {timeout} seconds. The firmware file may be too large or the connection is slow.")
+        except requests.exceptions.ConnectionError:
+            raise ConnectionError(f"Connection lost during upload. Device may have reset or network connection was interrupted.")
+        except requests.exceptions.RequestException as e:
+            raise Exception(f"Network error: {str(e)}")
+
+class ResumableUpload:
+    """Chunked upload to /update/chunk that resumes after dropped connections.
+
+    Every chunk is sent with the session id, its byte offset, the image size
+    and a CRC32, and the device only acknowledges it once it is written to
+    flash. After a connection error or timeout the uploader asks
+    /update/status how far the device got and carries on from that offset,
+    so a Wi-Fi drop costs at most one chunk instead of the whole transfer.
+    409 (offset or session mismatch) and 422 (CRC mismatch) replies carry the
+    device's offset as well. ``on_progress(acked, total)`` follows the
+    acknowledged bytes, and a ``shaper`` (see ota.shaping) paces every
+    chunk sent, resends included.
+    """
+
+    def __init__(self, ip, file_path, chunk_size=None, on_progress=None, encoding=None, max_resumes=None,
+                 shaper=None):
+        self.ip = ip
+        self.file_path = file_path
+        self.chunk_size = chunk_size or app_config.get('upload_chunk_size', RESUMABLE_CHUNK_SIZE)
+        self.on_progress = on_progress
+        self.encoding = encoding
+        self.shaper = shaper
+        self.max_resumes = (max_resumes if max_resumes is not None
+                            else app_config.get('upload_resume_attempts', RESUME_ATTEMPTS))
+        self.session = uuid.uuid4().hex[:16]
+        self.total = os.path.getsize(file_path)
+        self.offset = 0
+        self.resumes = 0
+
+    def _send_chunk(self, data):
+        params = {'session': self.session, 'offset': self.offset, 'total': self.total,
+                  'crc': f"{zlib.crc32(data):08x}"}
+        if self.encoding:
+            params['encoding'] = self.encoding
+        return http_request("POST", f"http://{self.ip}/update/chunk", params=params, data=data,
+                            headers={'Content-Type': "application/octet-stream"},
+                            timeout=http_timeout(app_config.get('upload_chunk_timeout', CHUNK_TIMEOUT)))
+
+    def _device_offset(self, response=None):
+        """Offset the device has written for this session; 0 if it lost the session (e.g. rebooted)."""
+        if response is None:
+            response = http_request("GET", f"http://{self.ip}/update/status")
+        state = response.json()
+        return int(state.get('offset', 0)) if state.get('session') == self.session else 0
+
+    def _resume(self, error, response=None):
+        """Resynchronise ``offset`` with the device, or give up once the resume budget is spent."""
+        while True:
+            self.resumes += 1
+            if self.resumes > self.max_resumes:
+                sent = f"{self.offset / (1024 * 1024):.2f} of {self.total / (1024 * 1024):.2f} MB"
+                if isinstance(error, requests.exceptions.Timeout):
+                    raise TimeoutError(f"Upload stalled after {sent} ({self.max_resumes} resume attempts).")
+                if isinstance(error, requests.exceptions.ConnectionError):
+                    raise ConnectionError(f"Connection lost during upload after {sent} ({self.max_resumes} resume "
+                                          f"attempts). Device may have reset or network connection was interrupted.")
+                raise ConnectionError(f"{error} after {sent} ({self.max_resumes} resume attempts)")
+            if response is None:
+                time.sleep(min(RESUME_BACKOFF * 2 ** (self.resumes - 1), 10))
+            try:
+                self.offset = self._device_offset(response)
+                return
+            except (requests.exceptions.RequestException, ValueError) as e:
+                error, response = e, None
+
+    def run(self):
+        """Send the image and return the device's final response (200 once flashed)."""
+        with open(self.file_path, "rb") as f:
+            while True:
+                f.seek(self.offset)
+                data = f.read(self.chunk_size)
+                if self.shaper:
+                    self.shaper.consume(len(data))
+                try:
+                    r = self._send_chunk(data)
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                    self._resume(e)
+                    continue
+                if r.status_code in (409, 422):
+                    self._resume(ConnectionError(f"Device rejected chunks (HTTP {r.status_code})"), r)
+                    continue
+                if r.status_code != 200:
+                    return r
+                self.offset += len(data)
+                if self.on_progress:
+                    self.on_progress(self.offset, self.total)
+                if self.offset >= self.total:
+                    return r
+
+def preflight(ip, file_path, checksum=None, compute_checksum=False, timings=None):
+    """Hash the image, probe /status and fetch /info concurrently.
+
+    None of the three depend on each other, so the upload only waits for the
+    slowest. ``checksum`` may be a digest, or a Future that resolves to one
+    (rollout_firmware hashes once for the whole fleet); with no checksum,
+    ``compute_checksum`` hashes the file here. Raises ConnectionError as soon
+    as /status fails, without waiting for the hash, and hashing errors
+    (missing or unreadable file) as soon as they happen.
+
+    Returns ``(checksum, info, timings)``; ``timings`` (filled in place when
+    passed, so it survives a failure) has the seconds from the start of
+    pre-flight until each check finished plus the total.
+    """
+    start_time = time.monotonic()
+    pool = ThreadPoolExecutor(max_workers=3)
+    tasks = {pool.submit(bind(check_device_online), ip): 'connect', pool.submit(bind(get_device_info), ip): 'info'}
+    if isinstance(checksum, Future):
+        tasks[checksum] = 'checksum'
+    elif checksum is None and compute_checksum:
+        tasks[pool.submit(bind(calculate_checksum), file_path)] = 'checksum'
+    values = {'checksum': checksum}
+    timings = {} if timings is None else timings
+    try:
+        for future in as_completed(tasks):
+            phase = tasks[future]
+            values[phase] = future.result()
+            timings[phase] = time.monotonic() - start_time
+            if phase == 'connect' and not values['connect']:
+                raise ConnectionError(f"Device at {ip} is offline or unreachable. Please check the IP address and network connection.")
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+        timings['preflight'] = time.monotonic() - start_time
+    return values['checksum'], values['info'], timings
+
+def upload_error_message(response):
+    """Return a readable error for a failed /update response, or None on success."""
+    if response.status_code == 200:
+        return None
+    return UPLOAD_ERROR_MESSAGES.get(response.status_code, f"Unexpected response (HTTP {response.status_code})")
+
+@profiled("upload")
+def upload_to_device(ip, file_path, checksum=None, on_state=None, on_progress=None, compression=None,
+                     compute_checksum=False, verify=None, expected_version=None, delta=None):
+    """Upload firmware to one device without touching the GUI.
+
+    ``on_state(ip, state, detail)`` is called as the upload moves through
+    ``checking``, ``uploading`` and finally ``success`` or ``failed``.
+    ``on_progress(meter)`` receives the TransferMeter at most every
+    PROGRESS_INTERVAL seconds while bytes are flowing. The attempt is
+    recorded with log_upload() and a result dict is returned; failures carry
+    ``error_type`` (the exception class name, or ``HTTPError``) and, for HTTP
+    failures, ``http_status`` and the start of the response body. An empty
+    image fails with ValueError before the device is contacted.
+
+    ``compression`` (default: the ``compression`` setting, ``auto``) sends a
+    cached gzip copy to devices that advertise the ``gzip`` capability;
+    ``bytes`` is always the image size and ``wire_bytes`` what was sent.
+    Devices that advertise ``chunked`` get a ResumableUpload unless the
+    ``resumable_uploads`` setting is off; ``resumes`` counts the reconnects.
+
+    The transfer is shaped to the global and per-device rate limits (see
+    ota.shaping), which may change while it runs; ``rate_limit`` is the
+    tighter of the two when the transfer ended (None if unlimited).
+
+    ``delta`` (default: the ``delta_uploads`` setting, ``auto``) sends a
+    binary delta against the device's running image instead when the device
+    supports it and that image is in the artifact store (see
+    ota.delta.choose_delta_image()); ``encoding`` is then ``delta`` or
+    ``delta-gzip``. Successfully uploaded images are added to the artifact
+    store unless the ``artifact_store`` setting is off.
+
+    The checksum (see preflight()), online check and /info run in parallel.
+    ``timings`` breaks the attempt down into ``checksum``/``connect``/``info``
+    (completion times within pre-flight), ``preflight``, ``prepare``
+    (picking or compressing the image), ``transfer`` (until the last byte
+    left), ``response`` (device finishing the update and replying; for
+    chunked uploads the whole final chunk request) and ``total`` seconds.
+    They are stored as spans with the history entry (see ota.metrics).
+
+    After a successful upload the device's reboot is tracked with
+    ota.verify.verify_update() (states ``rebooting``, then ``verified`` or
+    ``unverified``) unless ``verify`` is False or the ``verify_reboot``
+    setting is off; ``reboot`` then holds its result. ``expected_version``
+    makes a different reported version count as unverified.
+    """
+    file_name = os.path.basename(file_path)
+    result = {'ip': ip, 'status': 'failed', 'error': None, 'error_type': None, 'bytes': 0, 'wire_bytes': 0,
+              'encoding': None, 'protocol': None, 'resumes': 0, 'elapsed': 0.0, 'transfer_elapsed': 0.0,
+              'transfer_rate': 0.0, 'checksum': checksum if isinstance(checksum, str) else None, 'timings': {},
+              'device_info': None, 'history_id': None, 'reboot': None, 'rate_limit': None}
+    compression = compression or app_config.get('compression', 'auto')
+    delta = delta or app_config.get('delta_uploads', 'auto')
+
+    def notify(state, detail=""):
+        if on_state:
+            on_state(ip, state, detail)
+
+    start_time = time.monotonic()
+    timings = result['timings']
+    try:
+        file_size = os.path.getsize(file_path)
+        if not file_size:
+            raise ValueError(f"Firmware file is empty: {file_name}")
+        notify("checking", "Verifying device is online...")
+        checksum, info, _ = preflight(ip, file_path, checksum, compute_checksum, timings)
+        result['checksum'], result['device_info'] = checksum, info
+
+        phase_start = time.monotonic()
+        image_path, encoding = file_path, None
+        if compression != "off":
+            image_path, encoding = choose_upload_image(file_path, info, compression, checksum)
+        if delta != "off":
+            try:
+                patch = choose_delta_image(file_path, info, checksum, compress=compression != "off",
+                                           limit=os.path.getsize(image_path))
+            except (DeltaError, OSError):
+                patch = None  # fall back to the full image
+            if patch:
+                image_path, encoding = patch
+        result['encoding'] = encoding
+        wire_size = os.path.getsize(image_path)
+        resumable = "chunked" in device_capabilities(info) and app_config.get('resumable_uploads', True)
+        result['protocol'] = "chunked" if resumable else "multipart"
+        timings['prepare'] = time.monotonic() - phase_start
+
+        notify("uploading", f"{wire_size / (1024 * 1024):.2f} MB" + (f" ({encoding})" if encoding else ""))
+        shaper = UploadShaper(ip)
+        meter = TransferMeter(wire_size, limit=shaper.limit)
+        last_report = [0.0]
+        last_byte = [None]
+
+        def report(sent, total):
+            meter.total = total
+            meter.limit = shaper.limit
+            meter.update(sent)
+            now = time.monotonic()
+            if sent == total:
+                last_byte[0] = now
+            if now - last_report[0] >= PROGRESS_INTERVAL or sent == total:
+                last_report[0] = now
+                notify("uploading", f"{sent * 100 // total}% • {format_rate(meter.instant_rate)}"
+                       + (f" / {format_rate(shaper.limit)} limit" if shaper.limit else ""))
+                if on_progress:
+                    on_progress(meter)
+
+        if resumable:
+            chunk_size = min(app_config.get('upload_chunk_size', RESUMABLE_CHUNK_SIZE),
+                             int((info or {}).get('chunk_max') or RESUMABLE_CHUNK_SIZE))
+            upload = ResumableUpload(ip, image_path, chunk_size=chunk_size, on_progress=report, encoding=encoding,
+                                     shaper=shaper)
+            try:
+                r = upload.run()
+            finally:
+                result['resumes'] = upload.resumes
+        else:
+            r = post_firmware(ip, image_path, on_progress=report, encoding=encoding,
+                              file_name=file_name + ENCODING_SUFFIXES.get(encoding, ""), shaper=shaper)
+        result['wire_bytes'] = wire_size
+        result['transfer_elapsed'] = meter.elapsed
+        if resumable:
+            timings['response'] = min(r.elapsed.total_seconds(), meter.elapsed)
+        else:
+            timings['response'] = time.monotonic() - last_byte[0] if last_byte[0] else 0.0
+        timings['transfer'] = meter.elapsed - timings['response']
+        result['transfer_rate'] = meter.average_rate
+        result['rate_limit'] = shaper.limit
+        result['error'] = upload_error_message(r)
+        if result['error'] is None:
+            result['status'] = "success"
+            result['bytes'] = file_size
+        else:
+            result['error_type'] = "HTTPError"
+            result['http_status'] = r.status_code
+            result['response'] = r.text[:50] if r.text else ""
+    except FileNotFoundError:
+        result['error'] = f"Firmware file not found: {file_name}"
+        result['error_type'] = "FileNotFoundError"
+    except PermissionError:
+        result['error'] = f"Permission denied: Cannot read {file_name}"
+        result['error_type'] = "PermissionError"
+    except Exception as e:
+        result['error'] = str(e)
+        result['error_type'] = type(e).__name__
+
+    result['elapsed'] = timings['total'] = time.monotonic() - start_time
+    checksum = result['checksum']
+    if result['status'] == "success":
+        result['history_id'] = log_upload(ip, "success", file_name, checksum=checksum, timings=timings)
+        if app_config.get('artifact_store', True):
+            try:
+                record_device_image(ip, store_artifact(file_path, checksum))
+            except OSError:
+                pass
+        saved = f", {result['encoding']} -{(1 - result['wire_bytes'] / result['bytes']) * 100:.0f}%" if result['encoding'] and result['bytes'] else ""
+        resumed = f", resumed {result['resumes']}x" if result['resumes'] else ""
+        limited = f" of {format_rate(result['rate_limit'])} limit" if result['rate_limit'] else ""
+        notify("success", f"{result['transfer_elapsed']:.1f}s ({format_rate(result['transfer_rate'])}{limited}{saved}{resumed})")
+        if verify if verify is not None else app_config.get('verify_reboot', True):
+            verify_update(result, result['device_info'], expected_version, on_state)
+    else:
+        result['history_id'] = log_upload(ip, "failed", file_name, error=result['error'], checksum=checksum,
+                                          timings=timings)
+        notify("failed", result['error'])
+    return result
+
+@profiled("rollout")
+def rollout_firmware(ips, file_path, parallelism=DEFAULT_ROLLOUT_PARALLELISM, checksum=None, on_state=None,
+                     compression=None, compute_checksum=False, verify=None, expected_version=None, delta=None):
+    """Upload one firmware image to many devices, at most ``parallelism`` at a time.
+
+    With ``compute_checksum`` the image is hashed once in the background
+    while the first devices run their connectivity checks. Reboot tracking
+    (see upload_to_device) runs on its own threads, so an upload slot is
+    free for the next device as soon as the previous one answered.
+
+    Returns a summary dict with per-device results, wall time, aggregate
+    throughput (image bytes/s over the whole rollout, excluding reboots),
+    ``wire_throughput`` (bytes actually sent per second, to compare with
+    the global ``rate_limit``), the checksum and the number of devices
+    verified after reboot.
+    """
+    start_time = time.monotonic()
+    results = []
+    verify = verify if verify is not None else app_config.get('verify_reboot', True)
+    hash_pool = None
+    if checksum is None and compute_checksum:
+        hash_pool = ThreadPoolExecutor(max_workers=1)
+        checksum = hash_pool.submit(bind(calculate_checksum), file_path)
+    verify_pool = ThreadPoolExecutor(max_workers=verify_workers(len(ips))) if verify else None
+    verifications = []
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, int(parallelism))) as pool:
+            futures = [pool.submit(bind(upload_to_device), ip, file_path, checksum, on_state=on_state, on_progress=None,
+                                   compression=compression, compute_checksum=False, verify=False, delta=delta)
+                       for ip in ips]
+            for future in as_completed(futures):
+                result = future.result()
+                results.append(result)
+                if verify_pool and result['status'] == "success":
+                    verifications.append(verify_pool.submit(bind(verify_update), result, result['device_info'],
+                                                            expected_version, on_state, time.monotonic()))
+        upload_elapsed = time.monotonic() - start_time
+        for future in verifications:
+            future.result()
+    finally:
+        if hash_pool:
+            hash_pool.shutdown(wait=False)
+        if verify_pool:
+            verify_pool.shutdown(wait=False)
+    if isinstance(checksum, Future):
+        checksum = checksum.result() if checksum.done() and not checksum.exception() else None
+
+    elapsed = time.monotonic() - start_time
+    bytes_sent = sum(r['bytes'] for r in results)
+    return {
+        'verified': sum(1 for r in results if (r['reboot'] or {}).get('status') == "verified"),
+        'results': results,
+        'succeeded': sum(1 for r in results if r['status'] == "success"),
+        'elapsed': elapsed,
+        'bytes_sent': bytes_sent,
+        'throughput': bytes_sent / upload_elapsed if upload_elapsed > 0 else 0,
+        'wire_throughput': sum(r['wire_bytes'] for r in results) / upload_elapsed if upload_elapsed > 0 else 0,
+        'rate_limit': global_rate_limit() or None,
+        'checksum': checksum,
+    }
@@ -0,0 +1,127 @@
+"""Post-upload verification: wait for the device to reboot and report its new version.
+
+After a successful /update the sketch waits about a second and restarts;
+an ESP32 is typically back on Wi-Fi 2-6 s later. wait_for_reboot() polls
+/status with exponential backoff, starting just before the reboot time
+observed for earlier updates (an exponentially weighted average), and
+then reads /info. A reboot is recognised by the device dropping off the
+network, its uptime restarting, or its version changing.
+"""
+import threading
+import time
+from datetime import datetime
+
+from .device import check_device_online, get_device_info, record_device_info
+from .history import record_spans, update_upload
+from .profiling import timed
+from .storage import app_config
+
+# Reboot tracking tuning (overridable via app_config.json)
+REBOOT_TIMEOUT = 60
+REBOOT_GRACE = 1.0
+REBOOT_POLL_INITIAL = 0.25
+REBOOT_POLL_MAX = 5.0
+REBOOT_POLL_FACTOR = 1.5
+REBOOT_ESTIMATE_INITIAL = 4.0
+REBOOT_ESTIMATE_WEIGHT = 0.3
+VERIFY_CONCURRENCY = 16
+
+_estimate_lock = threading.Lock()
+_reboot_estimate = REBOOT_ESTIMATE_INITIAL
+
+def reboot_estimate():
+    """Current estimate of seconds from upload response to the device being back online."""
+    with _estimate_lock:
+        return _reboot_estimate
+
+def _observe_reboot(seconds):
+    global _reboot_estimate
+    with _estimate_lock:
+        _reboot_estimate += REBOOT_ESTIMATE_WEIGHT * (seconds - _reboot_estimate)
+
+def wait_for_reboot(ip, previous_info=None, timeout=None, expected_version=None, since=None):
+    """Poll a freshly flashed device until it is back with the new firmware.
+
+    ``previous_info`` is the /info response from before the upload; it is
+    used to tell an old-firmware answer (the sketch keeps serving for about
+    a second after replying) from the rebooted one. Returns a dict with
+    ``status`` (``verified``, ``version_mismatch``, ``not_rebooted`` or
+    ``offline``), ``online``, ``time_to_online``, ``version``,
+    ``previous_version``, ``version_changed`` and ``polls``. ``since`` is
+    the time.monotonic() at which the upload finished, when tracking starts
+    later than that.
+    """
+    timeout = timeout if timeout is not None else app_config.get('reboot_timeout', REBOOT_TIMEOUT)
+    previous_version = (previous_info or {}).get('version')
+    start = since if since is not None else time.monotonic()
+    deadline = start + timeout
+    result = {'status': "offline", 'online': False, 'time_to_online': None, 'version': None,
+              'previous_version': previous_version, 'version_changed': False, 'polls': 0}
+    seen_offline = False
+    interval = REBOOT_POLL_INITIAL
+    # Nothing useful can be learned before the sketch restarts; after that,
+    # poll fast around the expected reboot time and back off beyond it.
+    time.sleep(max(0.0, start + max(REBOOT_GRACE, reboot_estimate() * 0.5) - time.monotonic()))
+    while True:
+        result['polls'] += 1
+        if check_device_online(ip):
+            info = get_device_info(ip)
+            elapsed = time.monotonic() - start
+            if info is not None:
+                uptime = info.get('uptime')
+                version_changed = previous_version is not None and info.get('version') != previous_version
+                restarted = uptime is not None and uptime <= elapsed + 1
+                if seen_offline or restarted or version_changed:
+                    result.update(online=True, time_to_online=elapsed, version=info.get('version'),
+                                  version_changed=version_changed, info=info)
+                    result['status'] = ("version_mismatch" if expected_version and info.get('version') != expected_version
+                                        else "verified")
+                    if seen_offline or restarted:
+                        _observe_reboot(elapsed)
+                    return result
+                result.update(online=True, version=info.get('version'), status="not_rebooted")
+        else:
+            seen_offline = True
+        now = time.monotonic()
+        if now >= deadline:
+            return result
+        time.sleep(min(interval, deadline - now))
+        interval = min(interval * REBOOT_POLL_FACTOR, REBOOT_POLL_MAX)
+
+def verify_workers(count):
+    """Threads for tracking ``count`` reboots: one each, up to the ``verify_concurrency`` setting."""
+    return max(1, min(count, int(app_config.get('verify_concurrency', VERIFY_CONCURRENCY))))
+
+@timed("verify")
+def verify_update(upload_result, previous_info=None, expected_version=None, on_state=None, since=None):
+    """Track the reboot after a successful upload and record what came back.
+
+    The new version and time-to-online go into device_versions.json, the
+    upload's history entry and a ``reboot`` span. ``upload_result['reboot']``
+    is set to the wait_for_reboot() result, which is also returned.
+    ``since`` is passed on to wait_for_reboot().
+    """
+    ip = upload_result['ip']
+    if on_state:
+        on_state(ip, "rebooting", "Waiting for the device to come back...")
+    reboot = wait_for_reboot(ip, previous_info, expected_version=expected_version, since=since)
+    info = reboot.pop('info', None)
+    if info:
+        record_device_info(ip, info, last_update=datetime.now().isoformat(),
+                           time_to_online=round(reboot['time_to_online'], 2))
+    update_upload(upload_result.get('history_id'), version=reboot['version'],
+                  reboot_seconds=reboot['time_to_online'])
+    if reboot['time_to_online'] is not None:
+        record_spans("upload", [(ip, "reboot", reboot['time_to_online'], reboot['status'] == "verified")],
+                     upload_result.get('history_id'))
+    upload_result['reboot'] = reboot
+    if on_state:
+        if reboot['status'] == "verified":
+            on_state(ip, "verified", f"v{reboot['version']} online after {reboot['time_to_online']:.1f}s")
+        elif reboot['status'] == "version_mismatch":
+            on_state(ip, "unverified", f"running v{reboot['version']}, expected v{expected_version}")
+        elif reboot['status'] == "not_rebooted":
+            on_state(ip, "unverified", f"still running v{reboot['version']}; no reboot seen")
+        else:
+            on_state(ip, "unverified", "did not come back online")
+    return reboot
@@ -0,0 +1,23 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The data directory is resolved when ota is imported; keep the tests away from the real one
+os.environ.setdefault("OTA_DATA_DIR", tempfile.mkdtemp(prefix="ota-tests-"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def history_db(tmp_path, monkeypatch):
+    """A fresh, empty upload history in ``tmp_path`` (see ota.history)."""
+    from ota import history
+
+    monkeypatch.setattr(history, "HISTORY_FILE", str(tmp_path / "upload_history.json"))
+    monkeypatch.setattr(history, "HISTORY_DB_FILE", str(tmp_path / "upload_history.db"))
+    monkeypatch.setattr(history, "HISTORY_ARCHIVE_FILE", str(tmp_path / "upload_history.archive.jsonl.gz"))
+    monkeypatch.setattr(history, "_history_db", None)
+    yield history
+    with history._history_lock:
+        if history._history_db is not None:
+            history._history_db.close()
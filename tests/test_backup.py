@@ -0,0 +1,79 @@
+import json
+
+import pytest
+
+from ota import backup
+
+def _entries(count, ip="10.0.1.1"):
+    return [{'timestamp': f"2025-01-01T{i // 3600:02d}:{i // 60 % 60:02d}:{i % 60:02d}", 'ip': ip,
+             'status': "success", 'file': "a.bin", 'checksum': f"{i:064x}"}
+            for i in range(count)]
+
+def _fresh_history(history, path):
+    """Point ``history`` at an empty database in ``path``."""
+    path.mkdir()
+    with history._history_lock:
+        history._history_db.close()
+        history._history_db = None
+        history.HISTORY_DB_FILE = str(path / "upload_history.db")
+        history.HISTORY_ARCHIVE_FILE = str(path / "upload_history.archive.jsonl.gz")
+
+def test_export_import_round_trip(history_db, tmp_path):
+    entries = _entries(1200)  # more than one merge batch and timestamp chunk
+    assert history_db.merge_history(entries) == (1200, 0)
+    path = str(tmp_path / "export.jsonl.gz")
+    summary = backup.export_config(path)
+    assert summary['history'] == 1200 and not summary['cancelled']
+
+    _fresh_history(history_db, tmp_path / "fresh")
+    assert history_db.count_history() == 0
+    summary = backup.import_config(path, settings=False)
+    assert summary['complete'] and summary['invalid'] == 0
+    assert (summary['history_added'], summary['history_duplicates']) == (1200, 0)
+    assert [entry['checksum'] for entry in history_db.iter_history()] == [entry['checksum'] for entry in entries]
+
+def test_import_twice_skips_duplicates(history_db, tmp_path):
+    history_db.merge_history(_entries(700))
+    path = str(tmp_path / "export.jsonl")
+    backup.export_config(path)
+    _fresh_history(history_db, tmp_path / "fresh")
+
+    first = backup.import_config(path, settings=False)
+    second = backup.import_config(path, settings=False)
+    assert (first['history_added'], first['history_duplicates']) == (700, 0)
+    assert (second['history_added'], second['history_duplicates']) == (0, 700)
+    assert history_db.count_history() == 700
+
+def test_interrupted_export_is_incomplete(history_db, tmp_path):
+    history_db.merge_history(_entries(10))
+    path = tmp_path / "export.jsonl"
+    backup.export_config(str(path))
+    lines = path.read_text(encoding="utf-8").splitlines()
+    path.write_text("\n".join(lines[:-3]) + "\n", encoding="utf-8")  # drop the end record and two entries
+
+    _fresh_history(history_db, tmp_path / "fresh")
+    summary = backup.import_config(str(path), settings=False)
+    assert not summary['complete']
+    assert summary['history_added'] == 8
+
+def test_import_legacy_document(history_db, tmp_path):
+    entries = _entries(5, ip="10.0.1.2")
+    path = tmp_path / "legacy.json"
+    path.write_text(json.dumps({'settings': {'theme': "light"}, 'ips': ["10.0.1.2"],
+                                'versions': {'10.0.1.2': {'version': "1.2.3", 'checked': "2025-01-01T00:00:00"}},
+                                'history': entries + [{'ip': "10.0.1.2"}]}, indent=2), encoding="utf-8")
+    summary = backup.import_config(str(path), settings=False)
+    assert summary['complete'] and not summary['settings']
+    assert (summary['history_added'], summary['invalid']) == (5, 1)
+    assert summary['versions'] == 1
+    assert "10.0.1.2" in backup.load_ips()
+    assert backup.load_device_versions()['10.0.1.2']['version'] == "1.2.3"
+
+    summary = backup.import_config(str(path), settings=False)
+    assert (summary['history_added'], summary['history_duplicates']) == (0, 5)
+
+def test_import_rejects_other_files(history_db, tmp_path):
+    path = tmp_path / "history.json"
+    path.write_text(json.dumps(_entries(2)), encoding="utf-8")
+    with pytest.raises(ValueError):
+        backup.import_config(str(path))
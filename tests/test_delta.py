@@ -0,0 +1,49 @@
+import random
+
+import pytest
+
+from ota.delta import DeltaDecoder, DeltaError, apply_delta, make_delta
+
+def _images(size=64 * 1024, seed=1):
+    rng = random.Random(seed)
+    base = bytes(rng.getrandbits(8) for _ in range(size))
+    # A typical rebuild: code shifted by an insertion, a patched constant and a new tail
+    target = bytearray(base[:1000] + b"inserted code" + base[1000:])
+    target[30000:30004] = b"\x01\x02\x03\x04"
+    target += b"new data" * 100
+    return base, bytes(target)
+
+def test_round_trip():
+    base, target = _images()
+    delta = make_delta(base, target)
+    assert len(delta) < len(target) // 10
+    assert apply_delta(base, delta) == target
+
+@pytest.mark.parametrize("piece", [1, 7, 4096])
+def test_decoder_streams_in_pieces(piece):
+    base, target = _images()
+    delta = make_delta(base, target)
+    decoder = DeltaDecoder(base)
+    out = b"".join(decoder.feed(delta[i:i + piece]) for i in range(0, len(delta), piece))
+    assert out == target
+    assert decoder.finish()
+
+def test_unrelated_images():
+    base, _ = _images(seed=1)
+    target, _ = _images(size=10000, seed=2)
+    assert apply_delta(base, make_delta(base, target)) == target
+    assert apply_delta(b"", make_delta(b"", target)) == target
+
+def test_rejects_other_base():
+    base, target = _images()
+    delta = make_delta(base, target)
+    with pytest.raises(DeltaError):
+        apply_delta(base[:-1] + b"\x00", delta)
+
+def test_rejects_truncated_delta():
+    base, target = _images()
+    delta = make_delta(base, target)
+    with pytest.raises(DeltaError):
+        apply_delta(base, delta[:-1])
+    with pytest.raises(DeltaError):
+        apply_delta(base, b"not a delta" * 10)
@@ -0,0 +1,33 @@
+import time
+
+from ota import discovery
+from ota.scan import device_address
+
+def _stale_device(host, port):
+    address = device_address(host, port)
+    discovery.remember_devices([{'ip': address, 'info': {'name': "ESP32_OTA"}}])
+    discovery._cache_store.update(lambda cache: cache['devices'][address].update(seen=time.time() - 3600))
+    return address
+
+def _misses(address):
+    return discovery.load_discovery_cache()['devices'][address]['misses']
+
+def test_interrupted_sweep_keeps_cached_devices(monkeypatch):
+    address = _stale_device("127.0.0.201", 8081)
+    monkeypatch.setattr(discovery, "arp_neighbors", list)
+    monkeypatch.setattr(discovery, "sweep_hosts", lambda hosts, **options: ([], False))
+    for _ in range(discovery.DISCOVERY_MAX_MISSES + 1):
+        assert discovery.cached_scan(targets=["127.0.0.201"], port=8081, ttl=60) == []
+    assert _misses(address) == 0
+    assert "127.0.0.201:8081" not in discovery.load_discovery_cache()['sweeps']
+
+def test_completed_sweep_counts_misses(monkeypatch):
+    address = _stale_device("127.0.0.202", 8081)
+    monkeypatch.setattr(discovery, "arp_neighbors", list)
+    monkeypatch.setattr(discovery, "sweep_hosts", lambda hosts, **options: ([], True))
+    discovery.cached_scan(targets=["127.0.0.202"], port=8081, ttl=60)
+    assert _misses(address) == 1
+    assert "127.0.0.202:8081" in discovery.load_discovery_cache()['sweeps']
+    for _ in range(discovery.DISCOVERY_MAX_MISSES - 1):
+        discovery.cached_scan(targets=["127.0.0.202"], port=8081, ttl=60)
+    assert address not in discovery.load_discovery_cache()['devices']
@@ -0,0 +1,80 @@
+import json
+import os
+
+import pytest
+
+def _write_legacy(history, data):
+    with open(history.HISTORY_FILE, "w", encoding="utf-8") as f:
+        f.write(data if isinstance(data, str) else json.dumps(data))
+
+def test_migrates_legacy_json(history_db):
+    entries = [{'timestamp': f"2025-01-01T00:00:0{i}", 'ip': "10.0.0.1", 'status': "success", 'file': "a.bin"}
+               for i in range(3)]
+    _write_legacy(history_db, entries + ["not an entry", {'ip': "10.0.0.2"}])
+    loaded = history_db.load_history()
+    assert [entry['timestamp'] for entry in loaded] == [entry['timestamp'] for entry in entries]
+    assert not os.path.exists(history_db.HISTORY_FILE)
+    assert os.path.exists(history_db.HISTORY_FILE + ".migrated")
+
+def test_keeps_legacy_file_that_is_not_a_history(history_db):
+    _write_legacy(history_db, {'uploads': []})
+    assert history_db.load_history() == []
+    assert os.path.exists(history_db.HISTORY_FILE)
+    assert not os.path.exists(history_db.HISTORY_FILE + ".migrated")
+
+def test_keeps_unreadable_legacy_file(history_db):
+    _write_legacy(history_db, "[{\"timestamp\": ")
+    assert history_db.load_history() == []
+    assert os.path.exists(history_db.HISTORY_FILE)
+
+def _populate(history):
+    entries = []
+    for i in range(30):
+        entries.append({'timestamp': f"2026-01-{10 + i // 10:02d}T12:00:{i:02d}",
+                        'ip': f"10.0.{4 + i % 2}.{1 + i % 3 * 9}",
+                        'status': "failed" if i % 5 == 0 else "success",
+                        'file': "fw_100%.bin" if i % 2 else "fw-1.0.bin",
+                        'checksum': f"{i:02d}" + "a" * 62})
+    assert history.merge_history(entries) == (30, 0)
+    return entries
+
+def _timestamps(entries):
+    return [entry['timestamp'] for entry in entries]
+
+def test_query_filters(history_db):
+    entries = _populate(history_db)
+
+    def expect(filters, predicate):
+        matched = [entry for entry in entries if predicate(entry)]
+        assert sorted(_timestamps(history_db.query_history(limit=100, filters=filters))) == _timestamps(matched)
+        assert history_db.count_history(filters) == len(matched)
+
+    expect({'ip': "10.0.4.1"}, lambda e: e['ip'] == "10.0.4.1")  # exact, not 10.0.4.10
+    expect({'ip': "10.0.5."}, lambda e: e['ip'].startswith("10.0.5."))
+    expect({'status': "failed"}, lambda e: e['status'] == "failed")
+    expect({'file': "100%"}, lambda e: e['file'] == "fw_100%.bin")  # LIKE wildcards are literal
+    expect({'file': "_"}, lambda e: "_" in e['file'])
+    expect({'checksum': "1"}, lambda e: e['checksum'].startswith("1"))
+    expect({'since': "2026-01-11", 'until': "2026-01-11"}, lambda e: e['timestamp'].startswith("2026-01-11"))
+    expect({'ip': "10.0.4.", 'status': "success", 'until': "2026-01-10"},
+           lambda e: e['ip'].startswith("10.0.4.") and e['status'] == "success" and e['timestamp'] < "2026-01-11")
+    expect({'ip': "", 'status': None}, lambda e: True)  # empty filters are ignored
+
+def test_query_pages(history_db):
+    entries = _populate(history_db)
+    pages = [history_db.query_history(limit=7, offset=offset) for offset in range(0, 35, 7)]
+    assert [len(page) for page in pages] == [7, 7, 7, 7, 2]
+    assert _timestamps(entry for page in pages for entry in page) == _timestamps(entries[::-1])  # newest first, no gaps or repeats
+    assert history_db.query_history(limit=7, offset=30) == []
+
+    oldest = history_db.query_history(limit=5, offset=5, descending=False)
+    assert _timestamps(oldest) == _timestamps(entries[5:10])
+    by_ip = history_db.query_history(limit=100, sort='ip', filters={'status': "success"})
+    assert [(e['ip'], e['timestamp']) for e in by_ip] == sorted(((e['ip'], e['timestamp']) for e in by_ip),
+                                                                reverse=True)
+
+def test_query_rejects_unknown_filters_and_columns(history_db):
+    with pytest.raises(ValueError, match="unknown history filter"):
+        history_db.query_history(filters={'version': "1.0.0"})
+    with pytest.raises(ValueError, match="cannot sort"):
+        history_db.query_history(sort='error')
@@ -0,0 +1,81 @@
+import struct
+import time
+
+import pytest
+
+from ota import mdns
+from ota.mock import MockFleet
+
+def _records(ttl=120):
+    instance = f"bench-1.{mdns.OTA_SERVICE}"
+    return [
+        {'name': mdns.OTA_SERVICE, 'type': mdns.TYPE_PTR, 'ttl': ttl, 'data': instance},
+        {'name': instance, 'type': mdns.TYPE_SRV, 'ttl': ttl, 'data': {'port': 8080, 'target': "bench-1.local"}},
+        {'name': instance, 'type': mdns.TYPE_TXT, 'ttl': ttl, 'data': {'name': "Bench", 'version': "1.2.0"}},
+        {'name': "bench-1.local", 'type': mdns.TYPE_A, 'ttl': ttl, 'data': "10.0.2.1"},
+    ]
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return condition()
+
+def test_build_parse_round_trip():
+    records = _records()
+    message = mdns.parse_message(mdns.build_message(answers=records[:1], additional=records[1:],
+                                                    response=True, message_id=7))
+    assert message['id'] == 7 and message['response']
+    assert message['records'] == records
+
+def test_parses_compressed_names():
+    header = struct.pack("!HHHHHH", 0, mdns.FLAG_RESPONSE, 1, 1, 0, 0)
+    question = mdns.encode_name(mdns.OTA_SERVICE) + struct.pack("!HH", mdns.TYPE_PTR, mdns.CLASS_IN)
+    rdata = b"\x07bench-1\xc0\x0c"  # instance label, then a pointer to the service name at offset 12
+    answer = b"\xc0\x0c" + struct.pack("!HHIH", mdns.TYPE_PTR, mdns.CLASS_IN, 120, len(rdata)) + rdata
+    message = mdns.parse_message(header + question + answer)
+    assert message['questions'] == [(mdns.OTA_SERVICE, mdns.TYPE_PTR)]
+    assert message['records'] == [{'name': mdns.OTA_SERVICE, 'type': mdns.TYPE_PTR, 'ttl': 120,
+                                   'data': f"bench-1.{mdns.OTA_SERVICE}"}]
+
+def test_truncated_packets_raise_value_error():
+    data = mdns.build_message(answers=_records(), response=True)
+    for length in (5, 13, 40, len(data) - 3):
+        with pytest.raises(ValueError):
+            mdns.parse_message(data[:length])
+
+def test_compression_loop_raises_value_error():
+    header = struct.pack("!HHHHHH", 0, 0, 1, 0, 0, 0)
+    with pytest.raises(ValueError, match="compression loop"):
+        mdns.parse_message(header + b"\xc0\x0c" + struct.pack("!HH", mdns.TYPE_PTR, mdns.CLASS_IN))
+
+def test_goodbye_removes_device():
+    cache = mdns._ServiceCache(mdns.OTA_SERVICE)
+    cache.add(_records(), "10.0.2.1", now=100.0)
+    assert [device['ip'] for device in cache.devices().values()] == ["10.0.2.1:8080"]
+    cache.add(_records(ttl=0), "10.0.2.1", now=101.0)
+    cache.expire(101.0)
+    assert cache.devices() == {}
+
+def test_discover_devices_against_mock_responder():
+    found = []
+    with MockFleet(3, first_host="127.0.0.110", mdns=True) as fleet:
+        devices = mdns.discover_devices(timeout=0.5, interfaces=["127.0.0.1"], on_found=found.append)
+        assert fleet.responder.queries >= 1
+    assert [device['ip'] for device in devices] == fleet.addresses
+    assert len(found) == 3
+    assert all(device['info']['caps'] == ["gzip", "chunked", "delta"] for device in devices)
+
+def test_browser_drops_devices_that_say_goodbye():
+    changes = []
+    browser = mdns.MdnsBrowser(on_change=changes.append, interfaces=["127.0.0.1"]).start()
+    try:
+        with MockFleet(2, first_host="127.0.0.120", mdns=True) as fleet:
+            assert _wait_for(lambda: len(browser.devices()) == 2)
+            if not browser.passive:
+                pytest.skip("port 5353 is not available to listen for goodbyes")
+            assert browser.get(fleet.addresses[0])['source'] == "mdns"
+        assert _wait_for(lambda: not browser.devices())
+        assert set(changes[-1].values()) == {None}
+    finally:
+        browser.stop()
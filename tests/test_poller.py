@@ -0,0 +1,38 @@
+import time
+
+from ota.mock import MockDevice
+from ota.poller import DevicePoller
+
+def _wait_for_polls(poller, polls, timeout=10):
+    deadline = time.monotonic() + timeout
+    while poller.polls < polls:
+        assert time.monotonic() < deadline, "poller stalled"
+        time.sleep(0.02)
+
+def test_pushes_only_identity_changes():
+    device = MockDevice(host="127.0.0.1", seed=1).start()
+    changes = []
+    poller = DevicePoller(lambda: [device.address], interval=0.05, on_change=changes.append)
+    poller.polls = 0
+    poll_one = poller._poll_one
+
+    def counted(ip):
+        result = poll_one(ip)
+        poller.polls += 1
+        return result
+
+    poller._poll_one = counted
+    try:
+        poller.start()
+        _wait_for_polls(poller, 5)
+        assert len(changes) == 1
+        state = changes[0][device.address]
+        assert state['online'] and state['version'] == "1.0.0"
+        assert 'rssi' in state and 'uptime' in state
+
+        device.version = "1.0.1"
+        _wait_for_polls(poller, poller.polls + 3)
+        assert [change[device.address]['version'] for change in changes] == ["1.0.0", "1.0.1"]
+    finally:
+        poller.stop()
+        device.stop()
@@ -0,0 +1,111 @@
+import os
+
+import pytest
+
+from ota import rollout
+from ota.mock import MockFleet
+from ota.rollout import ConcurrencyController, adaptive_rollout
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rollout.time, "monotonic", clock)
+    return clock
+
+def _ok(size=100000):
+    return {'status': "success", 'error_type': None, 'wire_bytes': size}
+
+def _window(controller, clock, seconds, size=100000):
+    """Finish one window of uploads that took ``seconds`` in total."""
+    started = clock.now
+    clock.now += seconds
+    for _ in range(controller.limit):
+        controller.record(_ok(size), started)
+
+def test_slow_start_then_additive_increase(clock):
+    controller = ConcurrencyController(initial=2, maximum=32)
+    _window(controller, clock, 1.0)  # first measurement: slow start doubles
+    assert controller.limit == 4
+    _window(controller, clock, 1.0)  # twice the bytes in the same time
+    assert controller.limit == 8
+    _window(controller, clock, 2.0)  # no gain: plateau ends slow start
+    assert controller.limit == 8
+    _window(controller, clock, 1.5)  # gain again: one more at a time now
+    assert controller.limit == 9
+    assert [limit for _, limit in controller.history] == [2, 4, 8, 9]
+
+def test_halves_on_network_errors_once_per_event(clock):
+    controller = ConcurrencyController(initial=8, maximum=32)
+    started = clock.now
+    clock.now += 1.0
+    controller.record({'status': "failed", 'error_type': "ConnectionError", 'wire_bytes': 0}, started)
+    assert controller.limit == 4
+    # Uploads that were already running when the window was cut do not cut it again
+    controller.record({'status': "failed", 'error_type': "TimeoutError", 'wire_bytes': 0}, started)
+    assert controller.limit == 4
+    # Device-side rejections say nothing about the network
+    controller.record({'status': "failed", 'error_type': "HTTPError", 'wire_bytes': 0}, clock.now)
+    assert controller.limit == 4
+    controller.record({'status': "failed", 'error_type': "TimeoutError", 'wire_bytes': 0}, clock.now)
+    assert controller.limit == 2
+
+def test_halves_when_throughput_drops(clock):
+    controller = ConcurrencyController(initial=4, maximum=32)
+    _window(controller, clock, 1.0)
+    assert controller.limit == 8
+    _window(controller, clock, 4.0)  # the same bytes per upload, much slower overall
+    assert controller.limit == 4
+
+@pytest.fixture
+def image(tmp_path):
+    path = tmp_path / "firmware.bin"
+    path.write_bytes(os.urandom(64 * 1024))
+    return str(path)
+
+def test_grows_then_halves_against_a_fleet(image):
+    # Multipart only, so a dropped connection fails the upload instead of being resumed
+    with MockFleet(16, first_host="127.0.0.40", bandwidth=256 * 1024, capabilities=()) as fleet:
+        for device in fleet.devices[10:]:
+            device.reset_rate = 1.0
+        summary = adaptive_rollout(fleet.addresses, image, max_parallelism=8, canary=2, max_failure_rate=1.0,
+                                   verify=False)
+    limits = [limit for _, limit in summary['concurrency']]
+    assert summary['stopped'] is None
+    assert summary['succeeded'] == 10
+    peak = limits.index(max(limits))
+    assert max(limits) > 2
+    assert limits[peak + 1] == max(limits) // 2
+
+def test_failed_canary_stops_the_rollout(image):
+    with MockFleet(6, first_host="127.0.0.60", fail_status=500) as fleet:
+        states = []
+        summary = adaptive_rollout(fleet.addresses, image, canary=2, verify=False,
+                                   on_state=lambda ip, state, detail: states.append((ip, state)))
+        uploads = sum(device.stats['uploads'] for device in fleet.devices)
+    assert summary['stopped'].startswith("canary")
+    assert len(summary['results']) == 2
+    assert summary['skipped'] == fleet.addresses[2:]
+    assert uploads == 2
+    assert [ip for ip, state in states if state == "skipped"] == fleet.addresses[2:]
+
+def test_failure_rate_stops_the_rollout(image):
+    with MockFleet(12, first_host="127.0.0.80") as fleet:
+        for device in fleet.devices[2:]:
+            device.fail_status = 500
+        summary = adaptive_rollout(fleet.addresses, image, max_parallelism=2, canary=2, max_failure_rate=0.25,
+                                   verify=False)
+    # Canaries pass; the rollout stops as soon as enough results show a failure rate above 25%
+    assert summary['stopped'].startswith("failure rate")
+    assert summary['succeeded'] == 2
+    assert summary['skipped']
+    assert len(summary['results']) + len(summary['skipped']) == 12
+    failed = len(summary['results']) - 2
+    assert failed / len(summary['results']) > 0.25
+    assert failed <= rollout.ROLLOUT_MIN_SAMPLES
@@ -0,0 +1,36 @@
+import pytest
+
+from ota import scan
+
+@pytest.fixture(autouse=True)
+def interfaces(monkeypatch):
+    """This machine is 10.0.3.5 on eth0 (10.0.3.0/28) and 127.0.0.1 on lo."""
+    monkeypatch.setattr(scan, "interface_addresses", lambda include_loopback=False: [
+        {'name': "lo", 'address': "127.0.0.1", 'prefix': 8},
+        {'name': "eth0", 'address': "10.0.3.5", 'prefix': 28},
+    ])
+
+def test_cidr_expands_to_hosts():
+    assert scan.plan_scan_targets(["192.168.7.0/30"]) == ["192.168.7.1", "192.168.7.2"]
+    assert scan.plan_scan_targets(["192.168.7.9/31"]) == ["192.168.7.8", "192.168.7.9"]
+
+def test_interface_range_and_single_address():
+    hosts = scan.plan_scan_targets(["eth0", "10.0.3.20-10.0.3.22", "10.0.3.2", "10.0.3.21"])
+    assert hosts[:13] == [f"10.0.3.{n}" for n in range(1, 15) if n != 5]  # own address skipped
+    assert hosts[13:] == ["10.0.3.20", "10.0.3.21", "10.0.3.22"]  # duplicates planned once
+
+def test_plan_larger_than_max_hosts_is_rejected():
+    assert len(scan.plan_scan_targets(["10.8.0.0/22"], max_hosts=1022)) == 1022
+    with pytest.raises(ValueError, match="exceeds 1000 addresses"):
+        scan.plan_scan_targets(["10.8.0.0/22"], max_hosts=1000)
+    with pytest.raises(ValueError, match="exceeds"):
+        scan.plan_scan_targets(["0.0.0.0/0"])  # fails fast instead of expanding 4 billion hosts
+
+@pytest.mark.parametrize("target", ["wlan7", "10.0.0.300", "10.0.0.0/33", "10.0.0.1-", "example.com"])
+def test_invalid_targets_are_rejected(target):
+    with pytest.raises(ValueError, match="invalid scan target"):
+        scan.plan_scan_targets([target])
+
+def test_empty_range_is_rejected():
+    with pytest.raises(ValueError, match="empty address range"):
+        scan.plan_scan_targets(["10.0.0.9-10.0.0.1"])
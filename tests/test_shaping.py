@@ -0,0 +1,26 @@
+import pytest
+
+from ota.shaping import parse_rate
+
+@pytest.mark.parametrize("text, expected", [
+    ("125000", 125000),
+    ("500k", 500 * 1024),
+    ("2M", 2 * 1024 * 1024),
+    ("500kbps", 500 * 1024),
+    ("1MB/s", 1024 * 1024),
+    ("3k/s", 3 * 1024),
+    ("10 kb/s", 10 * 1024),
+    ("125000b", 125000),
+    ("0", 0),
+    ("", 0),
+    (None, 0),
+    (7.5, 7),
+    (-5, 0),
+])
+def test_parse_rate(text, expected):
+    assert parse_rate(text) == expected
+
+@pytest.mark.parametrize("text", ["fast", "5x", "kbps"])
+def test_parse_rate_rejects_garbage(text):
+    with pytest.raises(ValueError):
+        parse_rate(text)
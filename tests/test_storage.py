@@ -0,0 +1,53 @@
+import json
+import os
+import time
+
+from ota.storage import JsonStore
+
+def _store(tmp_path, delay=0.2):
+    return JsonStore(str(tmp_path / "store.json"), dict, validate=lambda data: isinstance(data, dict), delay=delay)
+
+def test_updates_within_the_delay_are_written_once(tmp_path):
+    store = _store(tmp_path)
+    for i in range(20):
+        store.update(lambda data: data.__setitem__(str(i), i))
+    assert not os.path.exists(store.path)
+    assert store.load() == {str(i): i for i in range(20)}
+    time.sleep(0.5)
+    assert store.writes == 1
+    with open(store.path, encoding="utf-8") as f:
+        assert json.load(f) == {str(i): i for i in range(20)}
+
+def test_flush_writes_atomically(tmp_path):
+    store = _store(tmp_path, delay=60)
+    store.save({'a': 1})
+    store.flush()
+    store.flush()  # nothing pending
+    assert store.writes == 1
+    assert os.listdir(tmp_path) == ["store.json"]  # no temporary file left behind
+    with open(store.path, encoding="utf-8") as f:
+        assert json.load(f) == {'a': 1}
+
+def test_failed_write_keeps_changes(tmp_path):
+    store = JsonStore(str(tmp_path / "missing" / "store.json"), dict, delay=60)
+    store.save({'a': 1})
+    store.flush()
+    assert store.writes == 0
+    assert store.load() == {'a': 1}
+    os.mkdir(tmp_path / "missing")
+    store.flush()
+    assert store.writes == 1
+
+def test_reloads_changes_made_by_another_process(tmp_path):
+    store = _store(tmp_path, delay=60)
+    store.save({'a': 1})
+    store.flush()
+    with open(store.path, "w", encoding="utf-8") as f:
+        json.dump({'a': 2, 'b': 3}, f)
+    os.utime(store.path, ns=(time.time_ns() + 10 ** 9,) * 2)
+    assert store.load() == {'a': 2, 'b': 3}
+
+def test_invalid_file_falls_back_to_default(tmp_path):
+    path = tmp_path / "store.json"
+    path.write_text("[1, 2", encoding="utf-8")
+    assert _store(tmp_path).load() == {}
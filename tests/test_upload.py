@@ -0,0 +1,46 @@
+import hashlib
+import os
+
+import pytest
+
+from ota.mock import MockDevice
+from ota.upload import ResumableUpload, upload_to_device
+
+@pytest.fixture
+def image(tmp_path):
+    path = tmp_path / "firmware.bin"
+    path.write_bytes(os.urandom(200 * 1024))
+    return str(path)
+
+@pytest.fixture
+def device():
+    device = MockDevice(host="127.0.0.1", reset_rate=1.0, seed=1).start()
+    yield device
+    device.stop()
+
+def test_resumable_upload_survives_a_reset(device, image):
+    progress = []
+    upload = ResumableUpload(device.address, image, chunk_size=16 * 1024,
+                             on_progress=lambda acked, total: progress.append(acked))
+    r = upload.run()
+    assert r.status_code == 200
+    assert device.stats['resets'] == 1
+    assert upload.resumes == 1
+    with open(image, "rb") as f:
+        assert device.last_image_sha256 == hashlib.sha256(f.read()).hexdigest()
+    assert progress == sorted(progress) and progress[-1] == os.path.getsize(image)
+
+def test_upload_to_device_resumes(device, image):
+    result = upload_to_device(device.address, image, compression="off", delta="off", verify=False)
+    assert result['status'] == "success", result['error']
+    assert result['protocol'] == "chunked"
+    assert result['resumes'] == 1
+    assert result['bytes'] == os.path.getsize(image)
+
+def test_empty_image_is_rejected(device, tmp_path):
+    path = tmp_path / "empty.bin"
+    path.write_bytes(b"")
+    result = upload_to_device(device.address, str(path), verify=False)
+    assert result['status'] == "failed"
+    assert result['error_type'] == "ValueError"
+    assert device.stats['requests'] == 0
@@ -0,0 +1,65 @@
+import os
+
+import pytest
+
+from ota import verify
+from ota.mock import MockDevice
+from ota.storage import app_config
+from ota.upload import upload_to_device
+
+@pytest.fixture(autouse=True)
+def fast_polling(monkeypatch):
+    monkeypatch.setattr(verify, "REBOOT_GRACE", 0.1)
+    monkeypatch.setattr(verify, "REBOOT_POLL_INITIAL", 0.05)
+    monkeypatch.setattr(verify, "_reboot_estimate", 0.2)
+
+@pytest.fixture
+def image(tmp_path):
+    path = tmp_path / "firmware.bin"
+    path.write_bytes(os.urandom(64 * 1024))
+    return str(path)
+
+def _upload(device, image, expected_version=None):
+    states = []
+    result = upload_to_device(device.address, image, on_state=lambda ip, state, message: states.append(state),
+                              delta="off", verify=True, expected_version=expected_version)
+    assert result['status'] == "success", result['error']
+    return result, states
+
+def test_verified_after_reboot(history_db, image):
+    device = MockDevice(reboot_seconds=0.5, version_after_update="1.0.1").start()
+    try:
+        result, states = _upload(device, image, expected_version="1.0.1")
+    finally:
+        device.stop()
+    reboot = result['reboot']
+    assert reboot['status'] == "verified"
+    assert (reboot['previous_version'], reboot['version'], reboot['version_changed']) == ("1.0.0", "1.0.1", True)
+    assert reboot['time_to_online'] >= 0.5
+    assert states[-2:] == ["rebooting", "verified"]
+    entry = history_db.load_history()[-1]
+    assert (entry['version'], entry['reboot_seconds']) == ("1.0.1", reboot['time_to_online'])
+
+def test_version_mismatch(history_db, image):
+    device = MockDevice(reboot_seconds=0.3, version_after_update="1.0.1").start()
+    try:
+        result, states = _upload(device, image, expected_version="2.0.0")
+    finally:
+        device.stop()
+    assert result['reboot']['status'] == "version_mismatch"
+    assert result['reboot']['version'] == "1.0.1"
+    assert states[-1] == "unverified"
+
+def test_device_that_stays_offline_times_out(history_db, image, monkeypatch):
+    monkeypatch.setitem(app_config, 'reboot_timeout', 1.0)
+    device = MockDevice(reboot_seconds=30, version_after_update="1.0.1").start()
+    try:
+        result, states = _upload(device, image, expected_version="1.0.1")
+    finally:
+        device.stop()
+    reboot = result['reboot']
+    assert reboot['status'] == "offline"
+    assert not reboot['online'] and reboot['time_to_online'] is None
+    assert reboot['polls'] > 1
+    assert states[-1] == "unverified"
+    assert history_db.load_history()[-1]['reboot_seconds'] is None